@@ -0,0 +1,243 @@
+"""
+Streaming anomaly and degradation detection over enriched telemetry.
+
+AnomalyDetector keeps exponentially weighted baselines per segment, where a
+segment is an ISP/city pair or a checked URL:
+
+- ISP/city segments track download_speed, upload_speed, ping_ms and
+  availability (sites_ok / sites_total) of each test;
+- URL segments track availability of that site's checks.
+
+Every metric holds a slow EWMA of mean and variance (the baseline) and a fast
+EWMA of recent values. Speeds and ping are tracked as log(1 + x), so their
+long right tails do not swamp the variance. Each record updates them in
+constant time, and a segment holds a fixed handful of floats, so memory is
+O(1) per segment. The number of segments is capped, evicting the least
+recently updated one.
+
+A metric alerts when its fast average moves more than `threshold` standard
+errors away from the baseline in the bad direction (speeds or availability
+falling, ping rising) after a warm-up period. While the alert is open the
+baseline is frozen, so it does not drift towards the degraded level. The
+alert resolves once the fast average is back within half the threshold. A
+change that persists for ADAPT_AFTER values becomes the new baseline, which
+also resolves the alert. Alerts are kept in a bounded list for /api/alerts.
+
+The detector is fed as a sync listener, so it sees each new record once;
+URL segments follow the sync's site checks through update_sites().
+"""
+
+from collections import OrderedDict, deque
+import itertools
+import math
+import threading
+
+from telemetry_store import to_epoch
+
+# Weight of each new value in the baseline and in the recent average
+BASELINE_ALPHA = 0.01
+RECENT_ALPHA = 0.05
+# Standard errors between the recent average and the baseline that raise an alert
+DEFAULT_THRESHOLD = 5.0
+# Values a metric must see before it may alert
+DEFAULT_WARMUP = 100
+# Values after which an ongoing deviation is accepted as the new baseline
+ADAPT_AFTER = 1000
+DEFAULT_MAX_SEGMENTS = 5000
+DEFAULT_MAX_ALERTS = 500
+
+# metric -> (direction that is bad: -1 falling / +1 rising, smallest standard
+# deviation assumed, tracked as log(1 + x))
+METRICS = {
+    'download_speed': (-1, 0.1, True),
+    'upload_speed': (-1, 0.1, True),
+    'ping_ms': (1, 0.1, True),
+    'availability': (-1, 0.15, False),
+}
+
+# Standard deviation of the recent average relative to that of single values
+_RECENT_SCALE = math.sqrt(RECENT_ALPHA / (2 - RECENT_ALPHA))
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        return None  # 'Failed' and missing values are not measurements
+    return float(value)
+
+
+class MetricBaseline:
+    """EWMA baseline and recent average of one metric of one segment."""
+
+    __slots__ = ('count', 'mean', 'var', 'recent', 'alert', 'alerting')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.recent = 0.0
+        self.alert = None   # the open alert of this metric, if any
+        self.alerting = 0   # values seen while it was open
+
+    def deviation(self, floor):
+        """Standard error of the recent average under the baseline."""
+        return max(math.sqrt(self.var), floor) * _RECENT_SCALE
+
+    def update(self, value):
+        if self.count == 0:
+            self.mean = self.recent = value
+        else:
+            self.recent += RECENT_ALPHA * (value - self.recent)
+            if self.alert is not None:
+                self.alerting += 1
+                if self.alerting < ADAPT_AFTER:
+                    self.count += 1
+                    return  # baseline frozen while alerting
+            # Plain running mean and variance until there are 1 / BASELINE_ALPHA values
+            alpha = max(BASELINE_ALPHA, 1 / (self.count + 1))
+            delta = value - self.mean
+            self.mean += alpha * delta
+            self.var = (1 - alpha) * (self.var + alpha * delta * delta)
+        self.count += 1
+
+    def to_dict(self, floor, log):
+        unit = math.expm1 if log else float
+        return {'count': self.count, 'baseline': round(unit(self.mean), 3), 'recent': round(unit(self.recent), 3),
+                'open_alert': self.alert['id'] if self.alert is not None else None}
+
+
+class AnomalyDetector:
+    """Per-segment EWMA baselines and the alerts raised from them."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, warmup=DEFAULT_WARMUP,
+                 max_segments=DEFAULT_MAX_SEGMENTS, max_alerts=DEFAULT_MAX_ALERTS, on_alert=None):
+        self.threshold = threshold
+        self.warmup = warmup
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        self._segments = OrderedDict()  # (kind, name) -> {metric: MetricBaseline}
+        self._alerts = deque(maxlen=max_alerts)
+        self._ids = itertools.count(1)
+        self.records = 0
+        self.evicted = 0
+        # Called as on_alert(alert) for every new alert, outside the lock
+        self.on_alert = on_alert
+
+    def __len__(self):
+        return len(self._segments)
+
+    def update(self, added, dropped=()):
+        """Feed new records, oldest first. Usable as a sync listener; dropped is ignored."""
+        raised = []
+        with self._lock:
+            for record in sorted(added, key=lambda r: to_epoch(r['publish_time'])):
+                self._observe(record, raised)
+        self._raise(raised)
+
+    def update_sites(self, added, site_checks):
+        """Feed the site checks of new records (site_checks[i] belongs to added[i]).
+
+        Usable as a sync site-check listener.
+        """
+        raised = []
+        with self._lock:
+            for record, checks in sorted(zip(added, site_checks), key=lambda item: to_epoch(item[0]['publish_time'])):
+                for url, ok, *_ in checks or ():
+                    if url is not None:
+                        site = ('site', url)
+                        self._add(site, self._segment(site), 'availability', 1.0 if ok else 0.0,
+                                  record['publish_time'], raised)
+        self._raise(raised)
+
+    def _raise(self, raised):
+        if self.on_alert is not None:
+            for alert in raised:
+                self.on_alert(alert)
+
+    def _segment(self, key):
+        metrics = self._segments.get(key)
+        if metrics is None:
+            metrics = self._segments[key] = {}
+            if len(self._segments) > self.max_segments:
+                self._segments.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._segments.move_to_end(key)
+        return metrics
+
+    def _observe(self, record, raised):
+        publish_time = record.get('publish_time')
+        if not publish_time:
+            return
+        self.records += 1
+        isp = record.get('isp_provider') or 'Unknown'
+        city = record.get('city') or 'Unknown'
+        segment = ('isp_city', f'{isp} / {city}')
+        metrics = self._segment(segment)
+        for metric in ('download_speed', 'upload_speed', 'ping_ms'):
+            value = _number(record.get(metric))
+            if value is not None:
+                self._add(segment, metrics, metric, value, publish_time, raised)
+        total = record.get('sites_total') or 0
+        if total:
+            self._add(segment, metrics, 'availability', (record.get('sites_ok') or 0) / total, publish_time, raised)
+
+    def _add(self, segment, metrics, metric, value, publish_time, raised):
+        baseline = metrics.get(metric)
+        if baseline is None:
+            baseline = metrics[metric] = MetricBaseline()
+        direction, floor, log = METRICS[metric]
+        baseline.update(math.log1p(value) if log else value)
+        if baseline.count < self.warmup:
+            return
+        score = direction * (baseline.recent - baseline.mean) / baseline.deviation(floor)
+        unit = math.expm1 if log else float
+        alert = baseline.alert
+        if alert is None and score > self.threshold:
+            alert = baseline.alert = {
+                'id': next(self._ids),
+                'kind': segment[0],
+                'segment': segment[1],
+                'metric': metric,
+                'direction': 'drop' if direction < 0 else 'rise',
+                'baseline': round(unit(baseline.mean), 3),
+                'value': round(unit(baseline.recent), 3),
+                'score': round(score, 2),
+                'started_at': publish_time,
+                'resolved_at': None,
+            }
+            baseline.alerting = 0
+            self._alerts.append(alert)
+            raised.append(dict(alert))
+        elif alert is not None:
+            if score > alert['score']:
+                alert['score'] = round(score, 2)
+                alert['value'] = round(unit(baseline.recent), 3)
+            if score < self.threshold / 2:
+                alert['resolved_at'] = publish_time
+                baseline.alert = None
+
+    def alerts(self, open_only=False, kind=None, limit=None):
+        """Alerts, newest first, optionally only unresolved ones or those of one segment kind."""
+        with self._lock:
+            out = [dict(alert) for alert in reversed(self._alerts)
+                   if (not open_only or alert['resolved_at'] is None) and (kind is None or alert['kind'] == kind)]
+        return out[:limit] if limit is not None else out
+
+    def segment(self, kind, name):
+        """Current baselines of one segment, or None if it is not tracked."""
+        with self._lock:
+            metrics = self._segments.get((kind, name))
+            if metrics is None:
+                return None
+            return {metric: baseline.to_dict(*METRICS[metric][1:]) for metric, baseline in metrics.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'segments': len(self._segments),
+                'max_segments': self.max_segments,
+                'evicted': self.evicted,
+                'records': self.records,
+                'alerts': len(self._alerts),
+                'open_alerts': sum(1 for alert in self._alerts if alert['resolved_at'] is None),
+            }
@@ -0,0 +1,263 @@
+"""
+Bulk backfill of telemetry from the source table, one UTC day at a time.
+
+A date range is split into day-sized windows that are fetched in parallel by
+a bounded worker pool. Each window is read with keyset-paged `rows_between`
+queries (never more than page_size + 1 rows per query, so the bq CLI's row cap
+and query timeout are never hit), enriched a page at a time and written
+straight to disk, so memory stays flat however large the range is:
+
+- 'ndjson': one `<day>.ndjson` file of enriched records per window, written
+  to `<day>.ndjson.part` and renamed into place once the window completes.
+- 'store': pages are appended, with their site checks, to a TelemetryStore,
+  the same day-partitioned columnar store the dashboard server reads (and
+  may be writing at the same time). The store skips request_ids it already
+  holds, so days the server has synced, and pages fetched again on resume,
+  add no duplicate rows.
+
+Progress is checkpointed in a manifest after every page: the window's keyset
+cursor, rows written and (for NDJSON) the part file's length. A rerun skips
+completed windows and continues partial ones from their last checkpoint,
+truncating any bytes written after it. Failed pages are retried with
+exponential backoff before the window is given up on. A window whose page
+boundary falls inside rows sharing one keyset position is left partial
+rather than marked done, since the next page would skip the rest of them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+import json
+import logging
+import os
+import threading
+import time
+
+from enrichment import enrich_batch
+from http_payload import json_chunks
+from query_backend import QueryError
+from telemetry_store import TelemetryStore
+
+FORMATS = ('ndjson', 'store')
+DEFAULT_WORKERS = 4
+# Rows per query; the bq CLI backend returns at most 10000, and each page reads one row ahead
+DEFAULT_PAGE_SIZE = 5000
+MAX_PAGE_SIZE = 9999
+DEFAULT_RETRIES = 3
+RETRY_DELAY = 2
+MANIFEST_NAME = 'backfill-manifest.json'
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+log = logging.getLogger('backfill')
+
+
+class StalledWindow(QueryError):
+    """A full page ends inside rows sharing one keyset position, so paging on would lose rows."""
+
+
+def parse_day(value):
+    """Parse a YYYY-MM-DD date; raises ValueError."""
+    return date.fromisoformat(value)
+
+
+def day_windows(start, end):
+    """(day, start_ts, end_ts) for every UTC day from start to end, both inclusive."""
+    windows = []
+    day = start
+    while day <= end:
+        begin = datetime.combine(day, datetime.min.time())
+        windows.append((day.isoformat(), begin.strftime(TIMESTAMP_FORMAT),
+                        (begin + timedelta(days=1)).strftime(TIMESTAMP_FORMAT)))
+        day += timedelta(days=1)
+    return windows
+
+
+class Manifest:
+    """Per-window progress of a backfill, saved as JSON after every change."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.windows = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.windows = json.load(f).get('windows', {})
+
+    def get(self, day):
+        with self._lock:
+            return dict(self.windows.get(day) or {})
+
+    def update(self, day, **state):
+        with self._lock:
+            self.windows.setdefault(day, {}).update(state)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'windows': self.windows}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def done(self, day):
+        return self.get(day).get('status') == 'done'
+
+
+class NdjsonSink:
+    """Writes one window's records to <day>.ndjson via a resumable .part file."""
+
+    def __init__(self, directory, day):
+        self.path = os.path.join(directory, f'{day}.ndjson')
+        self.part_path = self.path + '.part'
+        self._file = None
+
+    def open(self, offset):
+        """Open the part file positioned at offset, dropping anything written after it."""
+        mode = 'r+b' if offset and os.path.exists(self.part_path) else 'wb'
+        self._file = open(self.part_path, mode)
+        self._file.truncate(offset if mode == 'r+b' else 0)
+        self._file.seek(0, os.SEEK_END)
+
+    def write(self, batch):
+        """Write an EnrichedBatch's records (site checks are not exported); returns the file size."""
+        for chunk in json_chunks(batch.to_dicts(), ndjson=True):
+            self._file.write(chunk)
+        self._file.flush()
+        return self._file.tell()
+
+    def commit(self):
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self.part_path, self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StoreSink:
+    """Appends one window's records to a shared TelemetryStore.
+
+    A page appended just before a crash, but not yet checkpointed, is
+    fetched again on resume; the store skips its rows on append, as it does
+    for rows the dashboard server already synced.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def open(self, offset):
+        pass
+
+    def write(self, batch):
+        self.store.append(batch.to_dicts(), batch.site_checks())
+        return 0
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _position(row):
+    """Keyset position (publish_time, requestId) of a raw row."""
+    return (str(row.get('publish_time')), row.get('requestId') or '')
+
+
+def fetch_window(backend, window, sink, manifest, page_size=DEFAULT_PAGE_SIZE,
+                 retries=DEFAULT_RETRIES, retry_delay=RETRY_DELAY):
+    """Page through one window into sink, checkpointing after every page; returns rows written.
+
+    Raises QueryError once a page has failed retries + 1 times, and
+    StalledWindow when a full page ends inside rows that share one keyset
+    position; the window then stays 'partial' in the manifest.
+    """
+    day, start_ts, end_ts = window
+    state = manifest.get(day)
+    cursor = tuple(state.get('cursor') or ('', ''))
+    rows = state.get('rows', 0)
+    sink.open(state.get('bytes', 0))
+    try:
+        while True:
+            for attempt in range(retries + 1):
+                try:
+                    # One row past the page shows whether the page ends inside a run of rows
+                    # sharing a position, which the next page would skip
+                    page = backend.run('rows_between', start_ts=start_ts, end_ts=end_ts,
+                                       after_ts=cursor[0], after_id=cursor[1], limit=page_size + 1)
+                    break
+                except QueryError:
+                    if attempt == retries:
+                        raise
+                    time.sleep(retry_delay * 2 ** attempt)
+            more = len(page) > page_size
+            extra = page[page_size] if more else None
+            page = page[:page_size]
+            if page:
+                next_cursor = _position(page[-1])
+                if extra is not None and _position(extra) == next_cursor:
+                    # The next page would start after this position and skip the
+                    # rest of the rows sharing it; stop before writing this page
+                    log.warning(f"⚠️  {day}: a page of {page_size} rows ends inside rows sharing "
+                                f"{next_cursor}; the window is left partial")
+                    raise StalledWindow(f'rows share the keyset position {next_cursor} across a page boundary; '
+                                        f'rerun with a larger --page-size')
+                written = sink.write(enrich_batch(page))
+                rows += len(page)
+                manifest.update(day, status='partial', cursor=list(next_cursor), rows=rows, bytes=written)
+                cursor = next_cursor
+            if not more:
+                break
+        sink.commit()
+    finally:
+        sink.close()
+    manifest.update(day, status='done', rows=rows)
+    return rows
+
+
+def backfill(backend, start, end, output, fmt='ndjson', workers=DEFAULT_WORKERS, page_size=DEFAULT_PAGE_SIZE,
+             retries=DEFAULT_RETRIES, progress=print):
+    """Fetch every day from start to end (dates, inclusive) into output.
+
+    output is a directory of NDJSON files, or the store root for fmt='store'.
+    Windows already completed by an earlier run are skipped. Returns a
+    summary dict; windows that still failed after their retries are listed
+    under 'failed' and can be picked up by running the same backfill again.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown format {fmt!r}; choose from {", ".join(FORMATS)}')
+    os.makedirs(output, exist_ok=True)
+    manifest = Manifest(os.path.join(output, MANIFEST_NAME))
+    windows = day_windows(start, end)
+    pending = [window for window in windows if not manifest.done(window[0])]
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    store = TelemetryStore(output) if fmt == 'store' else None
+    summary = {'windows': len(windows), 'skipped': len(windows) - len(pending), 'done': 0, 'rows': 0, 'failed': []}
+    started = time.perf_counter()
+
+    def run(window):
+        sink = StoreSink(store) if store is not None else NdjsonSink(output, window[0])
+        window_started = time.perf_counter()
+        rows = fetch_window(backend, window, sink, manifest, page_size, retries)
+        return rows, time.perf_counter() - window_started
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='backfill') as pool:
+            futures = {pool.submit(run, window): window for window in pending}
+            for future in as_completed(futures):
+                day = futures[future][0]
+                try:
+                    rows, seconds = future.result()
+                except (QueryError, OSError) as e:
+                    summary['failed'].append(day)
+                    progress(f"❌ {day}: {e}")
+                    continue
+                summary['done'] += 1
+                summary['rows'] += rows
+                progress(f"✅ {day}: {rows} rows in {seconds:.1f}s "
+                         f"({summary['done'] + len(summary['failed'])}/{len(pending)})")
+    finally:
+        if store is not None:
+            store.close()
+    summary['failed'].sort()
+    summary['seconds'] = round(time.perf_counter() - started, 1)
+    return summary
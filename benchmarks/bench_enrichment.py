@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: batched enrichment (enrichment.py) vs the old per-row loop.
+
+The server holds CompactRecords built with from_batch() (compact_records.py),
+so that is the path the speedup is measured on; to_dicts() is shown for
+comparison.
+
+Usage: python3 benchmarks/bench_enrichment.py [--sizes 500 10000 100000] [--repeat 3]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact_records import from_batch, json_default, new_dictionaries  # noqa: E402
+from enrichment import enrich_batch  # noqa: E402
+from synthetic_data import raw_rows  # noqa: E402
+
+
+def legacy_enrich_rows(rows):
+    """The per-row loop serve_data used before enrichment.py (kept as the baseline)"""
+    enriched = []
+    for r in rows:
+        if not isinstance(r, dict):
+            continue
+        # Skip records with null publish_time (essential for dashboard)
+        if not r.get('publish_time'):
+            continue
+        def parse_or_none(raw):
+            if not raw or not isinstance(raw, str):
+                return None
+            try:
+                return json.loads(raw)
+            except Exception:
+                return None
+        speed_obj = parse_or_none(r.get('speed')) or {}
+        reach_obj = parse_or_none(r.get('reachability')) or {}
+        device_obj = parse_or_none(r.get('device')) or {}
+        dev_meta = {}
+        isp_meta = {}
+        if isinstance(device_obj, dict):
+            inner_dev = device_obj.get('device')
+            if isinstance(inner_dev, dict):
+                dev_meta = inner_dev
+            isp = device_obj.get('isp')
+            if isinstance(isp, dict):
+                isp_meta = isp
+        reach_results_raw = reach_obj.get('results') if isinstance(reach_obj, dict) else []
+        reach_results = reach_results_raw if isinstance(reach_results_raw, list) else []
+        sites_total = len(reach_results)
+        sites_ok = sum(1 for x in reach_results if isinstance(x, dict) and ((x.get('ok') is True) or (x.get('status') == 200 and x.get('error') is None)))
+        # Coerce numeric speed metrics
+        def num(val):
+            try:
+                if val is None: return None
+                if isinstance(val, (int,float)): return val
+                return float(val)
+            except Exception:
+                return None
+        download_speed = num(speed_obj.get('downloadMbps'))
+        upload_speed = num(speed_obj.get('uploadMbps'))
+        ping_ms = num(speed_obj.get('pingMs') or speed_obj.get('pingMs'.lower()))
+
+        # Check for failed tests and mark appropriately
+        download_failed = speed_obj.get('downloadError') or speed_obj.get('downloadErrorFallback')
+        ping_failed = speed_obj.get('pingError')
+
+        # Extract OS info if available
+        os_name = dev_meta.get('os') if isinstance(dev_meta, dict) else None
+        os_version = dev_meta.get('osVersion') if isinstance(dev_meta, dict) else None
+        # Extract user if present inside device_obj.user or device_obj.device.user
+        user_email = None
+        if isinstance(device_obj, dict):
+            possible_user = device_obj.get('user')
+            if isinstance(possible_user, dict):
+                user_email = possible_user.get('email')
+        enriched.append({
+            'publish_time': r.get('publish_time'),
+            'trigger': r.get('trigger'),
+            'version': r.get('version'),
+            'duration_ms': r.get('durationMs'),
+            'user_email': user_email,
+            'device_make': dev_meta.get('make') if isinstance(dev_meta, dict) and dev_meta.get('make') else 'Unknown',
+            'device_type': dev_meta.get('type') if isinstance(dev_meta, dict) and dev_meta.get('type') else 'Unknown',
+            'device_os': os_name or 'Unknown',
+            'device_os_version': os_version or 'Unknown',
+            'isp_provider': isp_meta.get('provider') if isinstance(isp_meta, dict) and isp_meta.get('provider') else 'Unknown',
+            'city': isp_meta.get('city') if isinstance(isp_meta, dict) and isp_meta.get('city') else 'Unknown',
+            'download_speed': download_speed if download_speed is not None and not download_failed else ('Failed' if download_failed else 0),
+            'upload_speed': upload_speed if upload_speed is not None else 0,
+            'ping_ms': ping_ms if ping_ms is not None and not ping_failed else ('Failed' if ping_failed else 0),
+            'sites_ok': sites_ok,
+            'sites_total': sites_total,
+            'request_id': r.get('requestId')
+        })
+    return enriched
+
+
+def best_of(repeat, fn, rows):
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    # Sanity check: both paths must serialize to the same JSON
+    sample = raw_rows(500)
+    legacy = json.dumps(legacy_enrich_rows(sample))
+    if json.dumps(enrich_batch(sample).to_dicts()) != legacy:
+        sys.exit('enrich_batch output differs from the legacy loop')
+    if json.dumps([dict(view) for view in enrich_batch(sample)]) != legacy:
+        sys.exit('RecordView output differs from the legacy loop')
+    if json.dumps(from_batch(enrich_batch(sample), new_dictionaries()), default=json_default) != legacy:
+        sys.exit('from_batch output differs from the legacy loop')
+
+    print(f"{'rows':>8} {'legacy ms':>10} {'columnar ms':>12} {'compact ms':>11} {'dicts ms':>9} {'speedup':>8}")
+    for size in args.sizes:
+        rows = raw_rows(size)
+        legacy = best_of(args.repeat, legacy_enrich_rows, rows)
+        columnar = best_of(args.repeat, enrich_batch, rows)
+        compact = best_of(args.repeat, lambda r: from_batch(enrich_batch(r), new_dictionaries()), rows)
+        dicts = best_of(args.repeat, lambda r: enrich_batch(r).to_dicts(), rows)
+        print(f"{size:>8} {legacy * 1000:>10.1f} {columnar * 1000:>12.1f} {compact * 1000:>11.1f} "
+              f"{dicts * 1000:>9.1f} {legacy / compact:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark: enriched records held as dicts vs CompactRecords.
+
+Each representation is built in a fresh child process from synthetic rows,
+enriched a batch at a time, and kept in one list, as the incremental sync
+holds them. Reports resident memory per record (RSS growth divided by the
+record count, so shared dictionary values are included), the time to build
+them, one rollup-style pass over every record, and serializing a 1000-record
+page at the API boundary.
+
+Usage: python3 benchmarks/bench_records.py [--records 1000000] [--batch 10000]
+"""
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from compact_records import from_batch, json_default, new_dictionaries  # noqa: E402
+from enrichment import enrich_batch  # noqa: E402
+from metrics import _process_rss  # noqa: E402
+from synthetic_data import raw_rows  # noqa: E402
+
+DICTIONARIES = new_dictionaries()
+REPRESENTATIONS = {
+    'dict': lambda batch: batch.to_dicts(),
+    'compact': lambda batch: from_batch(batch, DICTIONARIES),
+}
+PAGE = 1000
+
+
+def measure(representation, count, batch_size):
+    """Build count records in this process and return their measurements."""
+    build = REPRESENTATIONS[representation]
+    gc.collect()
+    rss_before = _process_rss()
+    records = []
+    started = time.perf_counter()
+    for seed in range(0, count, batch_size):
+        rows = raw_rows(min(batch_size, count - seed), seed=seed)
+        records.extend(build(enrich_batch(rows)))
+        del rows
+    build_s = time.perf_counter() - started
+    gc.collect()
+    rss_after = _process_rss()
+
+    started = time.perf_counter()
+    total = 0.0
+    for record in records:
+        download = record.get('download_speed')
+        if download != 'Failed':
+            total += download
+    scan_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    body = json.dumps(records[:PAGE], default=json_default).encode()
+    page_ms = (time.perf_counter() - started) * 1000
+    return {
+        'records': len(records),
+        'bytes_per_record': round((rss_after - rss_before) / len(records), 1),
+        'rss_mb': round(rss_after / 2 ** 20, 1),
+        'build_s': round(build_s, 2),
+        'scan_ms': round(scan_s * 1000, 1),
+        'page_ms': round(page_ms, 2),
+        'page_bytes': len(body),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=10000, help='rows enriched at a time')
+    parser.add_argument('--only', choices=sorted(REPRESENTATIONS), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.only:
+        # Child process: measure one representation and report it as JSON
+        print(json.dumps(measure(args.only, args.records, args.batch)))
+        return
+
+    results = {}
+    for name in REPRESENTATIONS:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--only', name,
+                                 '--records', str(args.records), '--batch', str(args.batch)],
+                                capture_output=True, text=True, check=True).stdout
+        results[name] = json.loads(output)
+
+    print(f"{'records':>10} {'repr':>8} {'B/record':>9} {'RSS MB':>8} {'build s':>8} {'scan ms':>8} {'page ms':>8}")
+    for name, r in results.items():
+        print(f"{r['records']:>10} {name:>8} {r['bytes_per_record']:>9.0f} {r['rss_mb']:>8.0f} "
+              f"{r['build_s']:>8.2f} {r['scan_ms']:>8.1f} {r['page_ms']:>8.2f}")
+    if results['dict']['page_bytes'] != results['compact']['page_bytes']:
+        sys.exit('compact records serialize differently from dicts')
+    print(f"\n{results['dict']['bytes_per_record'] / results['compact']['bytes_per_record']:.1f}x "
+          f"less memory per record")
+
+
+if __name__ == '__main__':
+    main()
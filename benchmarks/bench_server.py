@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Load test: dashboard-server.py against the synthetic backend, fully offline.
+
+Starts the server in a scratch directory with --backend synthetic, then
+drives each endpoint with concurrent clients for a fixed time and reports
+throughput, p50/p99 latency, peak RSS and CPU of the server process per
+endpoint. Results are written as JSON; --compare prints the change against
+an earlier result file.
+
+Usage: python3 benchmarks/bench_server.py [--rows 5000] [--latency-ms 50]
+           [--clients 8] [--duration 10] [--endpoints data reach-summary ...]
+           [--output results.json] [--compare old.json]
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import http.client
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic_data import SITES  # noqa: E402
+
+ENDPOINTS = {
+    'data': '/api/data',
+    'agg': '/api/agg',
+    'reach-summary': '/api/reachability/summary',
+    'reach-site': '/api/reachability/site?url=' + quote(SITES[1], safe=''),
+    'static': '/dashboard.html',
+}
+STATIC_FILES = ('dashboard.html', 'fivestar-logo-150.png')
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list; None when empty."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(q * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class ProcessMonitor:
+    """Samples RSS and CPU time of a process from /proc (Linux); reports None elsewhere."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.available = os.path.exists(f'/proc/{pid}/stat')
+
+    def cpu_seconds(self):
+        if not self.available:
+            return None
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime and stime are fields 14 and 15 of stat, i.e. 11 and 12 after the command name
+        return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+    def rss_mb(self):
+        if not self.available:
+            return None
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+        return None
+
+    def measure(self, fn):
+        """Run fn() and return (result, peak RSS MB, CPU seconds) of the process meanwhile."""
+        peak = [self.rss_mb()]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(self.interval):
+                rss = self.rss_mb()
+                if rss is not None and (peak[0] is None or rss > peak[0]):
+                    peak[0] = rss
+        sampler = threading.Thread(target=sample, daemon=True)
+        cpu_before = self.cpu_seconds()
+        sampler.start()
+        try:
+            result = fn()
+        finally:
+            done.set()
+            sampler.join()
+        cpu_after = self.cpu_seconds()
+        cpu = None if cpu_before is None else cpu_after - cpu_before
+        return result, peak[0], cpu
+
+
+def client_loop(host, port, path, deadline, headers):
+    """Request path until deadline on one keep-alive-capable connection; return (latencies, errors, bytes)."""
+    latencies = []
+    errors = 0
+    received = 0
+    conn = None
+    while time.perf_counter() < deadline:
+        if conn is None:
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - started)
+        received += len(body)
+        if response.status >= 400:
+            errors += 1
+        if response.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+    return latencies, errors, received
+
+
+def run_endpoint(host, port, path, clients, duration, headers):
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        futures = [pool.submit(client_loop, host, port, path, deadline, headers) for _ in range(clients)]
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - started
+    latencies = sorted(t for lat, _, _ in results for t in lat)
+    return {
+        'requests': len(latencies),
+        'errors': sum(e for _, e, _ in results),
+        'bytes': sum(b for _, _, b in results),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(1000 * sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': round(1000 * percentile(latencies, 0.50), 2) if latencies else None,
+        'p99_ms': round(1000 * percentile(latencies, 0.99), 2) if latencies else None,
+    }
+
+
+def wait_until_ready(host, port, process, timeout=60):
+    """Wait for the server to answer, then for its first telemetry load."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'dashboard-server.py exited with status {process.returncode}')
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+            conn.request('GET', '/api/data?limit=1')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    sys.exit('dashboard-server.py did not come up in time')
+
+
+def start_server(args, workdir, log):
+    for name in STATIC_FILES:
+        shutil.copy(os.path.join(ROOT, name), workdir)
+    env = dict(os.environ,
+               DASHBOARD_SYNTHETIC_ROWS=str(args.rows),
+               DASHBOARD_SYNTHETIC_LATENCY_MS=str(args.latency_ms),
+               DASHBOARD_STORE_DIR=os.path.join(workdir, 'telemetry_store'),
+               PYTHONUNBUFFERED='1')
+    command = [sys.executable, os.path.join(ROOT, 'dashboard-server.py'), '--backend', 'synthetic',
+               '--host', args.host, '--port', str(args.port), '--workers', str(args.workers),
+               '--max-records', str(args.max_records), '--no-browser']
+    if args.no_prefetch:
+        command.append('--no-prefetch')
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'endpoint':>14} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'RSS MB':>7} {'CPU %':>6}")
+    for name, r in results.items():
+        rss = f"{r['rss_mb_peak']:.0f}" if r['rss_mb_peak'] is not None else '--'
+        cpu = f"{r['cpu_pct']:.0f}" if r['cpu_pct'] is not None else '--'
+        print(f"{name:>14} {r['throughput_rps'] or 0:>8.1f} {r['p50_ms'] or 0:>8.2f} {r['p99_ms'] or 0:>8.2f} "
+              f"{r['errors']:>7} {rss:>7} {cpu:>6}")
+
+
+def print_comparison(results, baseline):
+    """Change of throughput and latency against an earlier result file."""
+    print(f"\nvs {baseline.get('revision') or 'baseline'} ({baseline.get('started')}):")
+    print(f"{'endpoint':>14} {'req/s':>9} {'p50':>9} {'p99':>9}")
+    for name, r in results.items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+
+        def change(key):
+            if not old.get(key) or r.get(key) is None:
+                return '--'
+            return f"{100 * (r[key] - old[key]) / old[key]:+.1f}%"
+        print(f"{name:>14} {change('throughput_rps'):>9} {change('p50_ms'):>9} {change('p99_ms'):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--rows', type=int, default=5000, help='synthetic rows in the fake pubsub_raw table')
+    parser.add_argument('--latency-ms', type=float, default=50, help='simulated latency of each backend query')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients per endpoint')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per endpoint')
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument('--workers', type=int, default=16, help='server --workers')
+    parser.add_argument('--max-records', type=int, default=5000, help='server --max-records')
+    parser.add_argument('--accept-encoding', default='gzip', help="Accept-Encoding sent by clients ('' for none)")
+    parser.add_argument('--no-prefetch', action='store_true', help='start the server with --no-prefetch')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help='result file (default benchmarks/results/server-<time>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    args = parser.parse_args()
+
+    started = datetime.now()
+    headers = {'Accept-Encoding': args.accept_encoding} if args.accept_encoding else {}
+    workdir = tempfile.mkdtemp(prefix='bench-server-')
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = start_server(args, workdir, log)
+    results = {}
+    try:
+        wait_until_ready(args.host, args.port, process)
+        monitor = ProcessMonitor(process.pid)
+        print(f"Server up (pid {process.pid}, {monitor.rss_mb() or 0:.0f} MB RSS); "
+              f"{args.rows} rows, {args.latency_ms:g} ms backend latency, {args.clients} clients x {args.duration:g}s")
+        for name in args.endpoints:
+            stats, rss, cpu = monitor.measure(
+                lambda: run_endpoint(args.host, args.port, ENDPOINTS[name], args.clients, args.duration, headers))
+            stats['rss_mb_peak'] = round(rss, 1) if rss is not None else None
+            stats['cpu_s'] = round(cpu, 3) if cpu is not None else None
+            stats['cpu_pct'] = round(100 * cpu / stats['elapsed_s'], 1) if cpu is not None else None
+            results[name] = stats
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    report = {
+        'started': started.isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: getattr(args, key) for key in
+                   ('rows', 'latency_ms', 'clients', 'duration', 'workers', 'max_records',
+                    'accept_encoding', 'no_prefetch')},
+        'endpoints': {name: ENDPOINTS[name] for name in results},
+        'results': results,
+    }
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                          f"server-{started.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Fan-out of live dashboard updates to server-sent event (SSE) subscribers.
+
+One publisher (the incremental sync) hands each change to the Broadcaster,
+which serializes it once into an SSE frame and queues the same bytes for
+every connected client. Each client has a small bounded queue: a client that
+falls behind does not slow down the publisher or other clients. Its backlog
+is discarded and replaced by a single `resync` event, telling the browser to
+reload the full state once it catches up.
+
+Several Broadcasters (one per tenant) may share one StreamSlots, so the
+streams connected across all of them stay within one global limit.
+"""
+
+import json
+import queue
+import threading
+
+from compact_records import json_default
+
+# Frames buffered per client before it is considered too slow
+DEFAULT_QUEUE_SIZE = 32
+RESYNC = b'event: resync\ndata: {}\n\n'
+_CLOSED = object()
+
+
+def sse_frame(event, data, event_id=None):
+    """Encode one SSE frame; data is serialized as single-line JSON."""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append('data: ' + json.dumps(data, default=json_default, separators=(',', ':')))
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class Subscription:
+    """One client's bounded queue of encoded frames."""
+
+    def __init__(self, broadcaster, queue_size):
+        self._broadcaster = broadcaster
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, frame):
+        """Queue a frame without blocking; on overflow collapse the backlog into a resync."""
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.dropped += self._drain()
+            self._queue.put_nowait(RESYNC)
+
+    def _drain(self):
+        count = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return count
+            count += 1
+
+    def end(self):
+        """Wake the reader with an end-of-stream marker, discarding anything pending."""
+        self.closed = True
+        self._drain()
+        self._queue.put_nowait(_CLOSED)
+
+    def next(self, timeout):
+        """Next frame, b'' when nothing arrived within timeout, or None once closed."""
+        try:
+            frame = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return b''
+        return None if frame is _CLOSED else frame
+
+    def close(self):
+        self._broadcaster.unsubscribe(self)
+
+
+class StreamSlots:
+    """A limit on open streams shared by several Broadcasters; 0 admits none."""
+
+    def __init__(self, limit):
+        self.limit = max(0, limit)
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot without blocking; False when all are in use."""
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.used -= 1
+
+
+class Broadcaster:
+    """Publishes frames to every subscriber, admitting at most max_subscribers.
+
+    With slots, each subscriber also holds one of the shared StreamSlots.
+    """
+
+    def __init__(self, max_subscribers, queue_size=DEFAULT_QUEUE_SIZE, slots=None):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.published = 0
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """Return a new Subscription, or None when no stream slot is free."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            if self.slots is not None and not self.slots.acquire():
+                return None
+            subscription = Subscription(self, self.queue_size)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.discard(subscription)
+                self._release()
+            subscription.closed = True
+
+    def _release(self):
+        if self.slots is not None:
+            self.slots.release()
+
+    def publish(self, event, data, event_id=None):
+        """Serialize once and queue for every subscriber; a no-op with none connected."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        frame = sse_frame(event, data, event_id)
+        for subscription in subscribers:
+            subscription.offer(frame)
+        self.published += 1
+
+    def close(self):
+        """End every subscriber's stream."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+            for _ in subscribers:
+                self._release()
+        for subscription in subscribers:
+            subscription.end()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'max_subscribers': self.max_subscribers,
+                'slots_used': self.slots.used if self.slots is not None else None,
+                'slots': self.slots.limit if self.slots is not None else None,
+                'published': self.published,
+                'dropped': sum(s.dropped for s in self._subscribers),
+            }
@@ -0,0 +1,261 @@
+"""
+Compact in-memory representation of enriched telemetry records.
+
+The dashboard server holds thousands of enriched records at once (the
+incremental sync, the record index, /api/data). As plain dicts each one
+carries its own hash table and its own copies of 'Unknown', ISP names,
+cities, OS versions and so on.
+
+CompactRecord stores the same record in __slots__ instead:
+
+- low-cardinality categorical fields (trigger, version, device make/type/OS/
+  OS version, ISP, city) are dictionary-encoded: each distinct value is held
+  once in a per-field Dictionary and records reference it. Dictionaries
+  belong to whoever holds the records (each tenant's IncrementalSync has its
+  own set, see new_dictionaries()), so tenants never share or fill up each
+  other's tables;
+- duration_ms is held as a number, and user_email as a plain string: both are
+  close to unique per record, so a dictionary would only grow;
+- download, upload and ping are packed into one 24-byte bytes object;
+- failed download/ping tests are bits in a flags int (DOWNLOAD_FAILED,
+  PING_FAILED) rather than 'Failed' strings in the numeric fields,
+  DOWNLOAD_INT, UPLOAD_INT and PING_INT mark metrics that are ints in the
+  dict shape (as EnrichedBatch does), and DURATION_TEXT marks a duration that
+  arrived as a numeric string.
+
+Records are read-only Mappings whose values are exactly those of the dict
+shape, so rollups, indexes and filters work unchanged. The dict is only
+built at the API boundary: json_default() serializes a record through
+to_dict().
+"""
+
+from collections.abc import Mapping
+import struct
+import threading
+
+from enrichment import FAILED, FIELDS
+
+DOWNLOAD_FAILED = 1
+PING_FAILED = 2
+DURATION_TEXT = 4
+DOWNLOAD_INT = 8
+UPLOAD_INT = 16
+PING_INT = 32
+
+# Distinct values kept per dictionary; later values are stored as-is
+MAX_DICTIONARY_SIZE = 1 << 12
+
+_METRICS = struct.Struct('<ddd')  # download, upload, ping
+
+
+class Dictionary:
+    """Table of the distinct values of one field, shared by the records built with it."""
+
+    def __init__(self, max_size=MAX_DICTIONARY_SIZE):
+        self.max_size = max_size
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def encode(self, value):
+        """Return the shared instance equal to value (value itself once the table is full)."""
+        if value is None:
+            return None
+        shared = self._values.get(value)
+        if shared is not None:
+            return shared
+        with self._lock:
+            if len(self._values) >= self.max_size:
+                return value
+            return self._values.setdefault(value, value)
+
+
+# Fields whose values are shared through a Dictionary
+CATEGORICAL_FIELDS = (
+    'trigger', 'version', 'device_make', 'device_type', 'device_os', 'device_os_version', 'isp_provider', 'city',
+)
+
+
+def new_dictionaries(max_size=MAX_DICTIONARY_SIZE):
+    """A Dictionary per categorical field, for one holder's records (e.g. one tenant)."""
+    return {name: Dictionary(max_size) for name in CATEGORICAL_FIELDS}
+
+
+class CompactRecord(Mapping):
+    """One enriched record in __slots__; reads like the /api/data dict."""
+
+    __slots__ = ('publish_time', 'request_id', 'sites_ok', 'sites_total', 'flags', '_metrics',
+                 'duration_ms', 'user_email') + CATEGORICAL_FIELDS
+
+    def __init__(self, publish_time, request_id=None, download_speed=0.0, upload_speed=0.0, ping_ms=0.0,
+                 flags=0, sites_ok=0, sites_total=0, duration_ms=None, user_email=None, dictionaries=None,
+                 **categories):
+        """Categorical values are shared through dictionaries (see new_dictionaries()), if given."""
+        self.publish_time = publish_time
+        self.request_id = request_id
+        self.sites_ok = sites_ok
+        self.sites_total = sites_total
+        self.duration_ms, text = _duration(duration_ms)
+        self.flags = flags | text
+        self.user_email = user_email
+        self._metrics = _METRICS.pack(download_speed, upload_speed, ping_ms)
+        for name in CATEGORICAL_FIELDS:
+            value = categories.get(name)
+            setattr(self, name, value if dictionaries is None else dictionaries[name].encode(value))
+
+    @classmethod
+    def from_mapping(cls, record, dictionaries=None):
+        """Build a CompactRecord from a record in the dict shape (e.g. read from the store)."""
+        if isinstance(record, cls):
+            return record
+        download = record.get('download_speed')
+        upload = record.get('upload_speed')
+        ping = record.get('ping_ms')
+        flags = (DOWNLOAD_FAILED if download == FAILED else 0) | (PING_FAILED if ping == FAILED else 0)
+        flags |= (DOWNLOAD_INT if _integral(download) else 0) | (UPLOAD_INT if _integral(upload) else 0) \
+            | (PING_INT if _integral(ping) else 0)
+        return cls(record.get('publish_time'), record.get('request_id'),
+                   _float(download), _float(upload), _float(ping), flags,
+                   record.get('sites_ok') or 0, record.get('sites_total') or 0,
+                   record.get('duration_ms'), record.get('user_email'), dictionaries,
+                   **{name: record.get(name) for name in CATEGORICAL_FIELDS})
+
+    @property
+    def download_failed(self):
+        return bool(self.flags & DOWNLOAD_FAILED)
+
+    @property
+    def ping_failed(self):
+        return bool(self.flags & PING_FAILED)
+
+    def metrics(self):
+        """(download, upload, ping) as floats; failed tests read 0.0."""
+        return _METRICS.unpack(self._metrics)
+
+    def get(self, field, default=None):
+        getter = _GETTERS.get(field)
+        return getter(self) if getter is not None else default
+
+    def __getitem__(self, field):
+        getter = _GETTERS.get(field)
+        if getter is None:
+            raise KeyError(field)
+        return getter(self)
+
+    def __contains__(self, field):
+        return field in _GETTERS
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def to_dict(self):
+        """The record in the JSON shape /api/data returns."""
+        download, upload, ping = _METRICS.unpack(self._metrics)
+        flags = self.flags
+        return {
+            'publish_time': self.publish_time,
+            'trigger': self.trigger,
+            'version': self.version,
+            'duration_ms': _duration_of(self),
+            'user_email': self.user_email,
+            'device_make': self.device_make,
+            'device_type': self.device_type,
+            'device_os': self.device_os,
+            'device_os_version': self.device_os_version,
+            'isp_provider': self.isp_provider,
+            'city': self.city,
+            'download_speed': FAILED if flags & DOWNLOAD_FAILED else int(download) if flags & DOWNLOAD_INT else download,
+            'upload_speed': int(upload) if flags & UPLOAD_INT else upload,
+            'ping_ms': FAILED if flags & PING_FAILED else int(ping) if flags & PING_INT else ping,
+            'sites_ok': self.sites_ok,
+            'sites_total': self.sites_total,
+            'request_id': self.request_id,
+        }
+
+    def __repr__(self):
+        return f'CompactRecord({self.to_dict()!r})'
+
+
+def _float(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else 0.0
+
+
+def _duration(value):
+    """(slot value, flag) for a duration_ms: numeric strings become ints flagged DURATION_TEXT."""
+    if isinstance(value, str):
+        try:
+            number = int(value)
+        except ValueError:
+            return value, 0
+        if str(number) == value:
+            return number, DURATION_TEXT
+    return value, 0
+
+
+def _duration_of(record):
+    return str(record.duration_ms) if record.flags & DURATION_TEXT else record.duration_ms
+
+
+def _integral(value):
+    """Whether a metric is an int in the dict shape; missing ones read as 0, like EnrichedBatch's."""
+    return value is None or (isinstance(value, int) and not isinstance(value, bool))
+
+
+def _download(record):
+    if record.flags & DOWNLOAD_FAILED:
+        return FAILED
+    value = _METRICS.unpack(record._metrics)[0]
+    return int(value) if record.flags & DOWNLOAD_INT else value
+
+
+def _upload(record):
+    value = _METRICS.unpack(record._metrics)[1]
+    return int(value) if record.flags & UPLOAD_INT else value
+
+
+def _ping(record):
+    if record.flags & PING_FAILED:
+        return FAILED
+    value = _METRICS.unpack(record._metrics)[2]
+    return int(value) if record.flags & PING_INT else value
+
+
+_GETTERS = {
+    'download_speed': _download,
+    'upload_speed': _upload,
+    'ping_ms': _ping,
+    'duration_ms': _duration_of,
+}
+for _name in ('publish_time', 'request_id', 'sites_ok', 'sites_total', 'user_email') + CATEGORICAL_FIELDS:
+    _GETTERS[_name] = getattr(CompactRecord, _name).__get__
+
+
+def from_batch(batch, dictionaries=None):
+    """CompactRecords of every record in an EnrichedBatch, built straight from its columns."""
+    categories = [getattr(batch, name) for name in CATEGORICAL_FIELDS]
+    records = []
+    for i, publish_time in enumerate(batch.publish_time):
+        flags = (DOWNLOAD_FAILED if batch.download_failed[i] else 0) | (PING_FAILED if batch.ping_failed[i] else 0) \
+            | (DOWNLOAD_INT if batch.download_int[i] else 0) | (UPLOAD_INT if batch.upload_int[i] else 0) \
+            | (PING_INT if batch.ping_int[i] else 0)
+        records.append(CompactRecord(
+            publish_time, batch.request_id[i], batch.download_speed[i], batch.upload_speed[i], batch.ping_ms[i],
+            flags, batch.sites_ok[i], batch.sites_total[i], batch.duration_ms[i], batch.user_email[i], dictionaries,
+            **{name: column[i] for name, column in zip(CATEGORICAL_FIELDS, categories)}))
+    return records
+
+
+def compact(records, dictionaries=None):
+    """Convert records in the dict shape to CompactRecords (already compact ones pass through)."""
+    return [CompactRecord.from_mapping(record, dictionaries) for record in records]
+
+
+def json_default(value):
+    """json.dumps default= hook: CompactRecords become their dict, anything else its str()."""
+    to_dict = getattr(value, 'to_dict', None)
+    return to_dict() if to_dict is not None else str(value)
@@ -102,3 +102,54 @@ WHERE DATE(publish_time) >= DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAYS)
   AND JSON_EXTRACT_SCALAR(data, '$.speed.downloadMbps') IS NOT NULL
 GROUP BY device_category
 ORDER BY avg_download_mbps DESC;
+
+-- Rollup versions
+-- `fetch-data.py --rollups` (or the dashboard server) keeps telemetry.pubsub_raw_hourly:
+-- one row per UTC hour and ISP / city / device make / type / OS with summed metrics.
+-- These read a few small columns of it instead of the raw JSON; averages are sum / n.
+
+-- 2. Device Distribution (rollup)
+SELECT
+  device_make,
+  device_type,
+  device_os AS operating_system,
+  SUM(tests) AS device_count
+FROM telemetry.pubsub_raw_hourly
+WHERE hour >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 30 DAY)
+GROUP BY device_make, device_type, operating_system
+ORDER BY device_count DESC;
+
+-- 3. Network Speed Performance by ISP (rollup)
+SELECT
+  isp_provider,
+  city,
+  SUM(tests) AS test_count,
+  SAFE_DIVIDE(SUM(download_sum), SUM(download_n)) AS avg_download_mbps,
+  SAFE_DIVIDE(SUM(upload_sum), SUM(upload_n)) AS avg_upload_mbps,
+  SAFE_DIVIDE(SUM(ping_sum), SUM(ping_n)) AS avg_ping_ms
+FROM telemetry.pubsub_raw_hourly
+WHERE hour >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)
+GROUP BY isp_provider, city
+HAVING test_count >= 5
+ORDER BY avg_download_mbps DESC;
+
+-- 5. Geographic Distribution (rollup)
+SELECT
+  city,
+  SUM(tests) AS total_tests,
+  SAFE_DIVIDE(SUM(download_sum), SUM(download_n)) AS avg_download_mbps
+FROM telemetry.pubsub_raw_hourly
+WHERE hour >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 30 DAY)
+GROUP BY city
+ORDER BY total_tests DESC;
+
+-- 6. Peak Usage Times (rollup)
+SELECT
+  EXTRACT(HOUR FROM hour) AS hour_of_day,
+  EXTRACT(DAYOFWEEK FROM hour) AS day_of_week,
+  SUM(tests) AS test_count,
+  SAFE_DIVIDE(SUM(download_sum), SUM(download_n)) AS avg_download_mbps
+FROM telemetry.pubsub_raw_hourly
+WHERE hour >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 14 DAY)
+GROUP BY hour_of_day, day_of_week
+ORDER BY hour_of_day, day_of_week;
@@ -4,228 +4,944 @@ Simple dashboard server for K-12 Network Telemetry
 Fetches data from BigQuery and serves a local dashboard
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
 from http.server import HTTPServer, SimpleHTTPRequestHandler
+from collections import Counter
+import argparse
+import itertools
 import json
+import logging
 import os
-import subprocess
+import threading
+import time
 import webbrowser
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlencode, urlparse, parse_qs
+
+from anomaly import AnomalyDetector
+from broadcast import Broadcaster, StreamSlots, sse_frame
+from http_payload import Payload, PayloadCache, StreamEncoder, etag_matches, json_chunks, negotiate_encoding
+from metrics import (CONTENT_TYPE, REGISTRY, SamplingProfiler, begin_trace, configure_logging, end_trace,
+                     fields, span, summarize_spans)
+from prefetch import PrefetchScheduler
+from query_backend import DEFAULT_SQLITE_PATH, QueryError, create_backend
+from reachability_engine import ReachabilityEngine
+from record_index import (FILTER_FIELDS, RecordFilter, RecordIndex, decode_cursor, encode_cursor,
+                          page_records, page_size)
+from result_cache import ResultCache, cache_key
+from rollup_tables import REPORTS as ROLLUP_REPORTS, RollupTables
+from rollups import Rollups, rollup_timezone
+from singleflight import SingleFlight, StaleWhileRevalidate
+from telemetry_store import DEFAULT_STORE_DIR, TelemetryStore
+from telemetry_sync import DEFAULT_MAX_RECORDS, IncrementalSync, parse_timestamp
+from tenants import DEFAULT_TENANT, DEFAULT_TOTAL_QUERIES, BudgetedBackend, QueryBudget, load_tenants
+
+log = logging.getLogger('dashboard')
+
+# Default number of worker threads serving requests concurrently
+DEFAULT_WORKERS = 16
+
+# Cache TTL (seconds) for /api/data
+CACHE_TTL = 60
+# Cache file written by earlier versions; imported into the store once
+LEGACY_CACHE_FILE = 'telemetry_data.json'
+DATA_CACHE_KEY = 'telemetry'
+# Maximum number of enriched records held for /api/data
+DATA_MAX_RECORDS = int(os.environ.get('DASHBOARD_MAX_RECORDS', DEFAULT_MAX_RECORDS))
+
+# Per-endpoint TTLs (seconds) for cached BigQuery results
+REACH_SUMMARY_TTL = 300
+REACH_SITE_TTL = 300
+RAW_TTL = 30
+REACH_SUMMARY_DAYS = 7
+# Default page sizes; ?limit= may ask for up to record_index.MAX_PAGE_SIZE
+REACH_SITE_LIMIT = 200
+RAW_LIMIT = 50
+ALERTS_LIMIT = 100
+DEFAULT_CACHE_ENTRIES = 256
+# Entries per tenant in the query result cache
+CACHE_ENTRIES = int(os.environ.get('DASHBOARD_CACHE_ENTRIES', DEFAULT_CACHE_ENTRIES))
+
+# Live updates (/api/stream): how often new rows are pulled while clients are
+# connected, the idle keepalive interval and the rows pushed for the table
+LIVE_INTERVAL = int(os.environ.get('DASHBOARD_LIVE_INTERVAL', 15))
+STREAM_KEEPALIVE = 15
+LIVE_TABLE_ROWS = 10
+
+# Background prefetch (seconds between refreshes). Telemetry is checked every
+# LIVE_INTERVAL and refreshed when streams are connected or the data is older
+# than PREFETCH_DATA_INTERVAL; reachability refreshes land before the TTL expires.
+PREFETCH_DATA_INTERVAL = int(os.environ.get('DASHBOARD_PREFETCH_DATA_INTERVAL', CACHE_TTL * 3 // 4))
+PREFETCH_REACH_INTERVAL = int(os.environ.get('DASHBOARD_PREFETCH_REACH_INTERVAL', REACH_SUMMARY_TTL * 3 // 4))
+PREFETCH_CONCURRENCY = int(os.environ.get('DASHBOARD_PREFETCH_CONCURRENCY', 2))
+# Prefetching pauses for a tenant once its data API has had no requests (and
+# no open streams) for this many seconds; the next request resumes it
+PREFETCH_IDLE = int(os.environ.get('DASHBOARD_PREFETCH_IDLE', 600))
+# Most requested per-site drill-downs kept warm
+PREFETCH_HOT_SITES = int(os.environ.get('DASHBOARD_PREFETCH_SITES', 5))
+# Hourly rollup tables are opt-in (--rollup-tables): they need write access to
+# the dataset. When on, they are checked for newly completed hours this often
+# and report results are cached for as long.
+ROLLUP_TABLES = os.environ.get('DASHBOARD_ROLLUP_TABLES', '') not in ('', '0')
+ROLLUP_INTERVAL = int(os.environ.get('DASHBOARD_ROLLUP_INTERVAL', 300))
+
+# Route label of request metrics; any other path is a static file
+ROUTES = ('/api/data', '/api/agg', '/api/stream', '/api/cache/stats', '/api/raw', '/api/tenants', '/api/alerts',
+          '/api/reachability/summary', '/api/reachability/site/stats', '/api/reachability/site', '/metrics')
+# Routes that do not count as demand for a tenant's data (monitoring)
+IDLE_ROUTES = ('/api/cache/stats', '/api/tenants', '/metrics', 'static')
+# Requests under /t/<tenant>/ (or with an X-Tenant header) are served for that tenant
+TENANT_PREFIX = '/t/'
+# With DASHBOARD_PROFILE_DIR set, ?profile=1 samples that one request's stack
+# and writes the folded stacks there (one profiled request at a time)
+PROFILE_DIR = os.environ.get('DASHBOARD_PROFILE_DIR')
+profile_lock = threading.Lock()
+
+REQUEST_SECONDS = REGISTRY.histogram('dashboard_request_seconds', 'Request latency by tenant, route and status.',
+                                     ('tenant', 'route', 'status'))
+BACKEND_ERRORS = REGISTRY.counter('dashboard_backend_errors', 'Failed backend queries by tenant and query name.',
+                                  ('tenant', 'query'))
+SAMPLE_FALLBACKS = REGISTRY.counter('dashboard_sample_fallbacks', 'Responses that fell back to sample data.')
+ALERTS = REGISTRY.counter('dashboard_alerts', 'Degradation alerts raised by tenant, segment kind and metric.',
+                          ('tenant', 'kind', 'metric'))
+
+
+# Backend settings, replaced from the command line in main()
+backend_name = os.environ.get('DASHBOARD_BACKEND', 'auto')
+backend_pool_size = DEFAULT_WORKERS
+max_streams = DEFAULT_WORKERS // 2
+
+# Tenants by name, configured in main(); the first one also serves unprefixed requests
+tenants = {}
+default_tenant = None
+query_budget = QueryBudget()
+prefetcher = None
+
+
+class Tenant:
+    """One district's table and everything the server derives from it.
+
+    Every tenant has its own backend, incremental sync, local store, rollups,
+    index, reachability engine, anomaly detector, rollup tables, live-update
+    stream and caches, so tenants
+    never see each other's data or evict each other's cache entries. The
+    query-result and payload caches share the tenant's memory quota; held
+    records and everything derived from them are bounded by max_records
+    instead. Backend queries draw on the tenant's share of query_budget.
+    Components are created on first use.
+    """
+
+    def __init__(self, config, budget, stream_slots):
+        self.name = config.name
+        self.config = config
+        self.budget = budget
+        self.stream_slots = stream_slots
+        self.max_records = config.max_records or DATA_MAX_RECORDS
+        self.lock = threading.Lock()
+        # Held while a sync-fed component is built and subscribed; it is
+        # published only then, so no request sees one missing records
+        self.build_lock = threading.RLock()
+        self.backend = None
+        self.sync = None
+        self.store = None
+        self.rollups = None
+        self.index = None
+        self.reach_engine = None
+        self.detector = None
+        self.rollup_tables = None
+        self.live_updates = None
+        # Last good /api/data payload, refreshed at most once at a time
+        self.data_cache = StaleWhileRevalidate()
+        # Query results and serialized bodies each get half of the memory quota
+        quota = config.memory_bytes // 2 if config.memory_bytes else None
+        self.result_cache = ResultCache(CACHE_ENTRIES, max_bytes=quota)
+        self.query_flight = SingleFlight()
+        self.payload_cache = PayloadCache(max_bytes=quota)
+        # Requests per reachability drill-down URL, decayed on every prefetch pass
+        self.site_requests = Counter()
+        self.site_requests_lock = threading.Lock()
+        # Monotonic time of the last data request; startup counts as one
+        self.last_request = time.monotonic()
+
+    def get_backend(self):
+        """Return the tenant's query backend, creating the configured one if needed"""
+        with self.lock:
+            if self.backend is None:
+                name = self.config.backend or backend_name
+                backend = create_backend(name, table=self.config.table, pool_size=backend_pool_size,
+                                         sqlite_path=self.config.sqlite_path)
+                self.backend = BudgetedBackend(backend, self.budget, self.name)
+                log.info(f"🗄️  Query backend: {backend.name}", extra=fields(tenant=self.name, table=backend.table))
+            return self.backend
+
+    def get_sync(self):
+        """Return the tenant's incremental sync, creating it if needed"""
+        sync_backend = self.get_backend()
+        with self.lock:
+            if self.sync is None:
+                self.sync = IncrementalSync(sync_backend, max_records=self.max_records)
+            return self.sync
+
+    def get_store(self):
+        """Return the tenant's local telemetry store, opening it if needed"""
+        with self.lock:
+            if self.store is None:
+                self.store = TelemetryStore(self.config.store_dir)
+            return self.store
+
+    def get_rollups(self):
+        """Return the tenant's dashboard rollups, subscribed to the incremental sync"""
+        if self.rollups is not None:
+            return self.rollups
+        sync = self.get_sync()
+        with self.build_lock:
+            if self.rollups is None:
+                rollups = Rollups(tz=rollup_timezone())
+                sync.subscribe(rollups.update)
+                self.rollups = rollups
+            return self.rollups
+
+    def get_index(self):
+        """Return the filter index over held records, subscribed to the incremental sync"""
+        if self.index is not None:
+            return self.index
+        sync = self.get_sync()
+        with self.build_lock:
+            if self.index is None:
+                index = RecordIndex()
+                sync.subscribe(index.update)
+                self.index = index
+            return self.index
+
+    def get_reach_engine(self):
+        """Return the reachability engine, loaded from the store and subscribed to the sync"""
+        if self.reach_engine is not None:
+            return self.reach_engine
+        sync = self.get_sync()
+        store = self.get_store()
+        with self.build_lock:
+            if self.reach_engine is None:
+                engine = ReachabilityEngine(retention_days=REACH_SUMMARY_DAYS)
+                engine.add(store.iter_site_checks(time.time() - engine.retention))
+                sync.subscribe_checks(engine.update)
+                self.reach_engine = engine
+                log.info(f"🛰️  Reachability engine tracking {len(engine)} sites", extra=fields(tenant=self.name))
+            return self.reach_engine
+
+    def get_rollup_tables(self):
+        """Return the hourly rollup tables kept in the tenant's backend"""
+        backend = self.get_backend()
+        with self.lock:
+            if self.rollup_tables is None:
+                self.rollup_tables = RollupTables(
+                    backend, tz=rollup_timezone(),
+                    run=lambda name, **params: self.cached_query(name, ROLLUP_INTERVAL, **params))
+            return self.rollup_tables
+
+    def get_detector(self):
+        """Return the anomaly detector, subscribed to the incremental sync"""
+        if self.detector is not None:
+            return self.detector
+        sync = self.get_sync()
+        with self.build_lock:
+            if self.detector is None:
+                detector = AnomalyDetector(on_alert=self.alert_raised)
+                sync.subscribe(detector.update)
+                sync.subscribe_checks(detector.update_sites)
+                self.detector = detector
+            return self.detector
+
+    def alert_raised(self, alert):
+        ALERTS.inc(tenant=self.name, kind=alert['kind'], metric=alert['metric'])
+        log.warning(f"🚨 {alert['segment']}: {alert['metric']} {alert['direction']} "
+                    f"to {alert['value']} (baseline {alert['baseline']}, score {alert['score']})",
+                    extra=fields(tenant=self.name, alert=alert['id']))
+
+    def get_live_updates(self):
+        """Return the broadcaster behind /api/stream, fed by the incremental sync.
+
+        Streams hold a worker each for as long as they are open, so every
+        stream takes one of the stream_slots shared by all tenants; the
+        remaining workers keep serving ordinary requests.
+        """
+        if self.live_updates is not None:
+            return self.live_updates
+        sync = self.get_sync()
+        aggregates = self.get_rollups()  # subscribed first, so events carry updated rollups
+        with self.build_lock:
+            if self.live_updates is not None:
+                return self.live_updates
+            updates = Broadcaster(self.stream_slots.limit, slots=self.stream_slots)
+
+            def publish(added, dropped):
+                if not len(updates):
+                    return
+                if added:
+                    updates.publish('records', added[:LIVE_TABLE_ROWS])
+                dashboard = aggregates.dashboard()
+                updates.publish('agg', dashboard, event_id=dashboard['version'])
+            sync.subscribe(publish)
+            self.live_updates = updates
+            return updates
+
+    def telemetry(self, fresh=False):
+        """Held records, newest first, refreshed as described in serve_data."""
+        return self.data_cache.get(DATA_CACHE_KEY, self.fetch_telemetry, CACHE_TTL, fresh=fresh)
+
+    def cached_query(self, name, ttl, refresh=False, **params):
+        """Run a named backend query through the tenant's result cache.
+
+        Concurrent misses for the same query and parameters share one query.
+        refresh=True skips the cache lookup, so prefetching replaces entries
+        before they expire.
+        """
+        query = self.get_backend().render(name)
+        key = cache_key(query, params)
+        if not refresh:
+            hit, data = self.result_cache.get(key)
+            if hit:
+                return data
+
+        def load():
+            try:
+                rows = self.get_backend().query(query, params)
+            except QueryError:
+                BACKEND_ERRORS.inc(tenant=self.name, query=name)
+                raise
+            self.result_cache.set(key, rows, ttl)
+            return rows
+        return self.query_flight.do(key, load)
+
+    def fetch_telemetry(self):
+        """Pull telemetry newer than the sync watermark into the local store.
+
+        Returns all held records (newest first), or None when BigQuery gave
+        nothing usable. Only ever runs inside data_cache's single-flight
+        refresh, so concurrent requests never race on the query or the store.
+        """
+        sync = self.get_sync()
+        try:
+            log.info(f"🔍 Fetching telemetry newer than {sync.watermark} from BigQuery...",
+                     extra=fields(tenant=self.name))
+            try:
+                added, site_checks = sync.sync()
+            except QueryError as e:
+                BACKEND_ERRORS.inc(tenant=self.name, query='telemetry_sync')
+                log.error(f"❌ BigQuery query failed: {e}", extra=fields(tenant=self.name))
+                return None
+            records = sync.records()
+            if not records:
+                log.error("❌ BigQuery returned empty results", extra=fields(tenant=self.name))
+                return None
+            log.info(f"✅ Synced {len(added)} new records; holding {len(records)}",
+                     extra=fields(tenant=self.name, added=len(added), held=len(records),
+                                  newest=records[0].get('publish_time')))
+            if added:
+                self.get_store().append(added, site_checks)
+            return records
+        except Exception as e:
+            log.exception(f"❌ Error fetching data: {e}", extra=fields(tenant=self.name))
+            return None
+
+    def load_local_data(self):
+        """Seed the in-memory records and sync watermark from the local store.
+
+        A telemetry_data.json cache file left by older versions is imported
+        into the default tenant's store the first time.
+        """
+        store = self.get_store()
+        if self.name == DEFAULT_TENANT and store.count() == 0 and os.path.exists(LEGACY_CACHE_FILE):
+            try:
+                with open(LEGACY_CACHE_FILE, 'r') as f:
+                    legacy = json.load(f)
+                if isinstance(legacy, list):
+                    log.info(f"📦 Imported {store.append(legacy)} records from {LEGACY_CACHE_FILE} into {store.root}/")
+            except Exception as e:
+                log.warning(f"⚠️ Ignoring unreadable {LEGACY_CACHE_FILE}: {e}")
+        data = store.latest(self.max_records)
+        if data:
+            sync = self.get_sync()
+            sync.seed(data)
+            # Treat stored data as stale so the first request triggers a background sync
+            self.data_cache.seed(DATA_CACHE_KEY, sync.records(), fetched_at=0)
+            log.info(f"📊 Loaded {len(data)} telemetry records from {store.root}/ (watermark {sync.watermark})",
+                     extra=fields(tenant=self.name))
+
+    def warm(self):
+        """Load local data and build every in-memory view of it."""
+        self.load_local_data()
+        self.get_rollups()
+        self.get_index()
+        self.get_reach_engine()
+        self.get_detector()
+        self.get_live_updates()
+
+    def idle(self):
+        """True when no stream is open and no data request came in for PREFETCH_IDLE seconds."""
+        if self.live_updates is not None and len(self.live_updates):
+            return False
+        return time.monotonic() - self.last_request > PREFETCH_IDLE
+
+    def prefetch_telemetry(self):
+        """Sync new telemetry when streams are open or the held data is getting stale."""
+        if self.idle():
+            return
+        streaming = self.live_updates is not None and len(self.live_updates)
+        _, age = self.data_cache.peek(DATA_CACHE_KEY)
+        if not streaming and age is not None and age < PREFETCH_DATA_INTERVAL:
+            return
+        failed = []
+
+        def load():
+            records = self.fetch_telemetry()
+            if records is None:
+                failed.append(True)
+            return records
+        self.data_cache.refresh(DATA_CACHE_KEY, load)
+        if failed:
+            raise QueryError('telemetry refresh returned no data')
+
+    def prefetch_reachability_summary(self):
+        if self.idle():
+            return
+        if self.reach_engine is not None and len(self.reach_engine):
+            return  # answered from memory
+        self.cached_query('reachability_summary', REACH_SUMMARY_TTL, refresh=True, days=REACH_SUMMARY_DAYS)
+
+    def prefetch_hot_sites(self):
+        """Refresh the most requested drill-downs, then decay the counts so interest fades."""
+        if self.idle():
+            return
+        with self.site_requests_lock:
+            hot = [url for url, _ in self.site_requests.most_common(PREFETCH_HOT_SITES)]
+            for url in list(self.site_requests):
+                self.site_requests[url] //= 2
+                if not self.site_requests[url]:
+                    del self.site_requests[url]
+        for url in hot:
+            self.cached_query('reachability_site', REACH_SITE_TTL, refresh=True, **site_params(url))
+
+    def prefetch_rollup_tables(self):
+        """Aggregate newly completed hours into the rollup tables, once rows have been synced into them."""
+        if self.idle():
+            return
+        tables = self.get_rollup_tables()
+        watermark = self.sync.watermark if self.sync is not None else None
+        synced_until = parse_timestamp(watermark[0]).replace(tzinfo=timezone.utc) if watermark else None
+        if not tables.due(synced_until=synced_until):
+            return
+        building = not tables.ready
+        try:
+            refreshed = tables.refresh()
+        except QueryError:
+            BACKEND_ERRORS.inc(tenant=self.name, query='rollup_refresh')
+            raise
+        if building and refreshed is not None:
+            log.info(f"🧮 Rollup tables ready for {refreshed[0]} to {refreshed[1]}", extra=fields(tenant=self.name))
+
+    def cache_lookups(self):
+        """(labels, count) of the tenant's cache lookups by outcome, for /metrics."""
+        query = self.result_cache.stats()
+        payloads = self.payload_cache.stats()
+        counts = (
+            ('query', 'hit', query['hits']),
+            ('query', 'miss', query['misses']),
+            ('payload', 'hit', payloads['hits']),
+            ('payload', 'miss', payloads['misses']),
+            ('telemetry', 'hit', self.data_cache.hits),
+            ('telemetry', 'stale', self.data_cache.stale),
+            ('telemetry', 'miss', self.data_cache.misses),
+        )
+        return [({'tenant': self.name, 'cache': cache, 'result': result}, n) for cache, result, n in counts]
+
+    def stats(self):
+        return dict(self.result_cache.stats(), payloads=self.payload_cache.stats(),
+                    streams=self.get_live_updates().stats(),
+                    reachability=self.reach_engine.stats() if self.reach_engine is not None else None,
+                    anomalies=self.detector.stats() if self.detector is not None else None,
+                    rollup_tables=self.rollup_tables.stats() if self.rollup_tables is not None else None)
+
+    def close(self):
+        if self.live_updates is not None:
+            self.live_updates.close()
+        if self.backend is not None:
+            self.backend.close()
+        if self.store is not None:
+            self.store.close()
+
+
+def configure_tenants(configs, total_queries, stream_slots):
+    """Create the tenants and their shares of the query budget; the first one is the default.
+
+    All tenants draw their /api/stream connections from one pool of
+    stream_slots (which may be 0, turning streams off). With several
+    tenants, each gets its own store directory and SQLite file unless
+    configured; raises ValueError if two sqlite tenants share a file.
+    """
+    global tenants, default_tenant, query_budget
+    for config in configs:
+        if len(configs) > 1:
+            # Keep each tenant's records apart; a lone tenant keeps the old locations
+            if config.store_dir is None:
+                config.store_dir = os.path.join(os.environ.get('DASHBOARD_STORE_DIR', DEFAULT_STORE_DIR), config.name)
+            if config.sqlite_path is None:
+                base, ext = os.path.splitext(os.environ.get('DASHBOARD_SQLITE_PATH', DEFAULT_SQLITE_PATH))
+                config.sqlite_path = f'{base}-{config.name}{ext}'
+    sqlite_paths = [config.sqlite_path for config in configs if (config.backend or backend_name) == 'sqlite']
+    if len(sqlite_paths) != len(set(sqlite_paths)):
+        raise ValueError('tenants on the sqlite backend need their own sqlite_path')
+    query_budget = QueryBudget(total_queries)
+    streams = StreamSlots(stream_slots)
+    share = query_budget.fair_share(len(configs))
+    tenants = {}
+    for config in configs:
+        query_budget.register(config.name, config.max_queries or share)
+        tenants[config.name] = Tenant(config, query_budget, streams)
+    default_tenant = tenants[configs[0].name]
+    return tenants
+
+
+def resolve_tenant(path, header=None):
+    """Return (tenant, path without the /t/<name> prefix, prefix), or (None, path, '') for an unknown tenant."""
+    if path.startswith(TENANT_PREFIX):
+        name, _, rest = path[len(TENANT_PREFIX):].partition('/')
+        name = name.split('?')[0]
+        return tenants.get(name), '/' + rest, TENANT_PREFIX + name
+    if header:
+        return tenants.get(header), path, ''
+    return default_tenant, path, ''
+
+
+def all_cache_lookups():
+    return [sample for tenant in tenants.values() for sample in tenant.cache_lookups()]
+
+
+def stream_subscribers():
+    return [({'tenant': name}, len(tenant.live_updates) if tenant.live_updates is not None else 0)
+            for name, tenant in tenants.items()]
+
+
+REGISTRY.collect('dashboard_cache_lookups', 'Cache lookups by tenant, cache and outcome.', all_cache_lookups, 'counter')
+REGISTRY.collect('dashboard_stream_subscribers', 'Connected /api/stream clients by tenant.', stream_subscribers)
+
+
+def route_of(path):
+    path = urlparse(path).path
+    for route in ROUTES:
+        if path == route or path.startswith(route + '/'):
+            return route
+    return 'static'
+
+
+def site_params(url, limit=REACH_SITE_LIMIT, before_ts='', before_id=''):
+    """Parameters of the reachability_site query, shared by the handler and the prefetcher."""
+    return dict(url=url, limit=limit, before_ts=before_ts, before_id=before_id)
+
+
+def start_prefetch(concurrency=PREFETCH_CONCURRENCY, enabled=True):
+    """Load local data, then keep every tenant's caches warm in the background.
+
+    With enabled=False only the local data is loaded; the returned scheduler never runs.
+    """
+    global prefetcher
+    scheduler = PrefetchScheduler(concurrency)
+    for name, tenant in tenants.items():
+        scheduler.add(f'{name}/telemetry', tenant.prefetch_telemetry, LIVE_INTERVAL, max_backoff=CACHE_TTL * 5)
+        scheduler.add(f'{name}/reachability_summary', tenant.prefetch_reachability_summary,
+                      PREFETCH_REACH_INTERVAL)
+        scheduler.add(f'{name}/reachability_sites', tenant.prefetch_hot_sites, PREFETCH_REACH_INTERVAL,
+                      initial_delay=PREFETCH_REACH_INTERVAL)
+        if ROLLUP_TABLES:
+            scheduler.add(f'{name}/rollup_tables', tenant.prefetch_rollup_tables, ROLLUP_INTERVAL)
+    prefetcher = scheduler
+
+    def warm_start():
+        for name, tenant in tenants.items():
+            try:
+                tenant.warm()
+            except Exception as e:
+                log.warning(f"⚠️  Could not load local data: {e}", extra=fields(tenant=name))
+        if enabled:
+            scheduler.start()
+    threading.Thread(target=warm_start, name='warm-start', daemon=True).start()
+    return scheduler
+
 
 class DashboardHandler(SimpleHTTPRequestHandler):
     
     def serve_data(self):
-        """Fetch data from BigQuery and return as JSON"""
+        """Return the latest telemetry as JSON.
+
+        Any filter (?isp_provider=, city, device_type, trigger, version,
+        failed=1) or ?cursor= returns one bounded page instead; see
+        serve_data_page. Otherwise ?since=&until= (timestamps, until
+        exclusive) stream a time range from the local store, as a JSON array or, with ?format=ndjson, one record
+        per line; ?limit=N caps the rows. Otherwise fresh cached data is served
+        directly. Stale data is served while a single background refresh runs;
+        ?fresh=1 waits for a refresh, joining one already in flight rather than
+        starting another.
+        """
         try:
-            print("[serve_data] entered path=", self.path)
-            # Cache TTL (seconds)
-            CACHE_TTL = 60
             # Allow bypassing cache with ?fresh=1
             parsed = urlparse(self.path)
             qs = parse_qs(parsed.query)
             force_fresh = qs.get('fresh', ['0'])[0] == '1'
-            print(f"[serve_data] force_fresh={force_fresh}")
-            if not force_fresh and os.path.exists('telemetry_data.json'):
-                age = (int(__import__('time').time()) - int(os.path.getmtime('telemetry_data.json')))
-                if age < CACHE_TTL:
-                    print(f"📊 Loading cached telemetry data (age {age}s < {CACHE_TTL}s)...")
-                    with open('telemetry_data.json', 'r') as f:
-                        data = json.load(f)
-                        if data:
-                            print(f"✅ Serving {len(data)} cached telemetry records")
-                            self.send_json_response(data)
-                            return
-            
-            # Try to fetch fresh data from BigQuery
-            print("🔍 Fetching fresh data from BigQuery...")
-            query = """
-            SELECT 
-                ingestReceivedAt AS publish_time,
-                timestamp AS test_timestamp,
-                trigger,
-                durationMs,
-                version,
-                speed,
-                reachability,
-                device,
-                ingestSourceIp,
-                requestId
-            FROM `test-email-467802.telemetry.pubsub_raw`
-            ORDER BY ingestReceivedAt DESC
-            LIMIT 500
-            """
-            print("[serve_data] running bq query len=", len(query))
-            
-            # Execute BigQuery query (requires gcloud auth)
-            env = os.environ.copy()
-            sdk_bin = '/Users/jwilder/google-cloud-sdk/bin'
-            env['PATH'] = f"{sdk_bin}:{env.get('PATH','')}"
-            env.setdefault('CLOUDSDK_ROOT_DIR', '/Users/jwilder/google-cloud-sdk')
-            result = subprocess.run([
-                '/Users/jwilder/google-cloud-sdk/bin/bq', 'query', '--use_legacy_sql=false', '--format=json', '--max_rows=100', query
-            ], capture_output=True, text=True, timeout=30, env=env)
-            print("[serve_data] bq returncode=", result.returncode)
-            if result.stderr:
-                print("[serve_data] stderr=", result.stderr[:300])
-            if result.stdout:
-                print("[serve_data] stdout snippet=", result.stdout[:120])
-            
-            if result.returncode == 0:
-                rows = json.loads(result.stdout)
-                if isinstance(rows, list) and rows:
-                    enriched = []
-                    for r in rows:
-                        if not isinstance(r, dict):
-                            continue
-                        # Skip records with null publish_time (essential for dashboard)
-                        if not r.get('publish_time'):
-                            continue
-                        def parse_or_none(raw):
-                            if not raw or not isinstance(raw, str):
-                                return None
-                            try:
-                                return json.loads(raw)
-                            except Exception:
-                                return None
-                        speed_obj = parse_or_none(r.get('speed')) or {}
-                        reach_obj = parse_or_none(r.get('reachability')) or {}
-                        device_obj = parse_or_none(r.get('device')) or {}
-                        dev_meta = {}
-                        isp_meta = {}
-                        if isinstance(device_obj, dict):
-                            inner_dev = device_obj.get('device')
-                            if isinstance(inner_dev, dict):
-                                dev_meta = inner_dev
-                            isp = device_obj.get('isp')
-                            if isinstance(isp, dict):
-                                isp_meta = isp
-                        reach_results_raw = reach_obj.get('results') if isinstance(reach_obj, dict) else []
-                        reach_results = reach_results_raw if isinstance(reach_results_raw, list) else []
-                        sites_total = len(reach_results)
-                        sites_ok = sum(1 for x in reach_results if isinstance(x, dict) and ((x.get('ok') is True) or (x.get('status') == 200 and x.get('error') is None)))
-                        # Coerce numeric speed metrics
-                        def num(val):
-                            try:
-                                if val is None: return None
-                                if isinstance(val, (int,float)): return val
-                                return float(val)
-                            except Exception:
-                                return None
-                        download_speed = num(speed_obj.get('downloadMbps'))
-                        upload_speed = num(speed_obj.get('uploadMbps'))
-                        ping_ms = num(speed_obj.get('pingMs') or speed_obj.get('pingMs'.lower()))
-                        
-                        # Check for failed tests and mark appropriately
-                        download_failed = speed_obj.get('downloadError') or speed_obj.get('downloadErrorFallback')
-                        ping_failed = speed_obj.get('pingError')
-                        
-                        # Extract OS info if available
-                        os_name = dev_meta.get('os') if isinstance(dev_meta, dict) else None
-                        os_version = dev_meta.get('osVersion') if isinstance(dev_meta, dict) else None
-                        # Extract user if present inside device_obj.user or device_obj.device.user
-                        user_email = None
-                        if isinstance(device_obj, dict):
-                            possible_user = device_obj.get('user')
-                            if isinstance(possible_user, dict):
-                                user_email = possible_user.get('email')
-                        enriched.append({
-                            'publish_time': r.get('publish_time'),
-                            'trigger': r.get('trigger'),
-                            'version': r.get('version'),
-                            'duration_ms': r.get('durationMs'),
-                            'user_email': user_email,
-                            'device_make': dev_meta.get('make') if isinstance(dev_meta, dict) and dev_meta.get('make') else 'Unknown',
-                            'device_type': dev_meta.get('type') if isinstance(dev_meta, dict) and dev_meta.get('type') else 'Unknown',
-                            'device_os': os_name or 'Unknown',
-                            'device_os_version': os_version or 'Unknown',
-                            'isp_provider': isp_meta.get('provider') if isinstance(isp_meta, dict) and isp_meta.get('provider') else 'Unknown',
-                            'city': isp_meta.get('city') if isinstance(isp_meta, dict) and isp_meta.get('city') else 'Unknown',
-                            'download_speed': download_speed if download_speed is not None and not download_failed else ('Failed' if download_failed else 0),
-                            'upload_speed': upload_speed if upload_speed is not None else 0,
-                            'ping_ms': ping_ms if ping_ms is not None and not ping_failed else ('Failed' if ping_failed else 0),
-                            'sites_ok': sites_ok,
-                            'sites_total': sites_total,
-                            'request_id': r.get('requestId')
-                        })
-                    if enriched:
-                        print(f"✅ Fetched {len(enriched)} real records (newest publish_time={enriched[0].get('publish_time')})")
-                    else:
-                        print("⚠️ Query succeeded but returned 0 rows")
-                    with open('telemetry_data.json', 'w') as f:
-                        json.dump(enriched, f, indent=2, default=str)
-                    self.send_json_response(enriched)
+            try:
+                limit = int(qs['limit'][0]) if 'limit' in qs else None
+            except ValueError:
+                self.send_error_json('limit must be an integer', 400)
+                return
+            if 'cursor' in qs or 'failed' in qs or any(name in qs for name in FILTER_FIELDS):
+                self.serve_data_page(qs, force_fresh)
+                return
+            since = qs.get('since', [None])[0]
+            until = qs.get('until', [None])[0]
+            if since or until:
+                # Historical ranges are streamed straight from the local store
+                try:
+                    records = self.tenant.get_store().iter_scan(since, until)
+                    first = next(records, None)
+                except ValueError:
+                    self.send_error_json('since/until must be timestamps like 2025-08-13 05:47:48', 400)
                     return
+                if first is not None:
+                    records = itertools.chain((first,), records)
+                    if limit is not None:
+                        records = itertools.islice(records, max(0, limit))
                 else:
-                    print("❌ BigQuery returned empty results")
-            else:
-                print(f"❌ BigQuery query failed: {result.stderr}")
-                
+                    records = ()
+                log.info(f"✅ Streaming stored telemetry records for {since}..{until}")
+                self.send_json_stream(records, ndjson=qs.get('format', [''])[0] == 'ndjson')
+                return
+            data = self.tenant.telemetry(fresh=force_fresh)
+            if data:
+                log.debug(f"✅ Serving {len(data) if limit is None else min(len(data), max(0, limit))} telemetry records")
+                if limit is None:
+                    self.send_cached_json(('data',), data)
+                else:
+                    self.send_cached_json(('data', limit), data, lambda: data[:max(0, limit)])
+                return
         except Exception as e:
-            print(f"❌ Error fetching data: {e}")
+            log.exception(f"❌ Error fetching data: {e}")
         
         # Fallback to sample data with clear warning
-        print("⚠️  No real data available - using sample data")
+        log.warning("⚠️  No real data available - using sample data")
         self.send_sample_data()
 
+    def serve_data_page(self, qs, force_fresh=False):
+        """Return one filtered page of records, newest first.
+
+        Pages that the held records can fill are answered from the in-memory
+        index; pages reaching further back are read from the local store,
+        examining at most MAX_SCAN_ROWS stored rows per request (a page cut
+        short by that cap may hold fewer than limit records). The cursor for
+        the next page is sent in X-Next-Cursor (absent on the last page).
+        """
+        try:
+            record_filter = RecordFilter.from_query(qs)
+            cursor = decode_cursor(qs['cursor'][0]) if 'cursor' in qs else None
+            limit = page_size(qs.get('limit', [None])[0])
+        except ValueError as e:
+            self.send_error_json(str(e), 400)
+            return
+        index = self.tenant.get_index()
+        self.tenant.telemetry(fresh=force_fresh)
+        records, next_cursor = index.page(record_filter, cursor, limit)
+        oldest = index.oldest()
+        if next_cursor is None and (oldest is None or record_filter.since is None or record_filter.since < oldest):
+            # The range reaches past the held records; the store holds everything synced
+            until = record_filter.until
+            if cursor is not None:
+                # Rows sharing the cursor's timestamp are skipped by page_records
+                until = cursor[0] + 1 if until is None else min(until, cursor[0] + 1)
+            records, next_cursor = page_records(self.tenant.get_store(), record_filter, cursor, limit, until)
+        log.debug(f"✅ Serving page of {len(records)} telemetry records")
+        self.send_json_response(records, headers=self.next_page_headers(next_cursor))
+
+    def next_page_headers(self, next_cursor):
+        if not next_cursor:
+            return None
+        parsed = urlparse(self.path)
+        qs = {k: v for k, v in parse_qs(parsed.query).items() if k != 'cursor'}
+        qs['cursor'] = [next_cursor]
+        link = self.tenant_prefix + parsed.path + '?' + urlencode(qs, doseq=True)
+        return {'X-Next-Cursor': next_cursor, 'Link': f'<{link}>; rel="next"'}
+
+    def serve_stream(self):
+        """Server-sent events: the current state, then new records and rollups as they arrive.
+
+        Events are `agg` (the /api/agg payload), `records` (newly synced
+        records, newest first) and `resync` (this client fell behind and
+        should reload). Returns 503 when all stream slots are taken.
+        """
+        updates = self.tenant.get_live_updates()
+        subscription = updates.subscribe()
+        if subscription is None:
+            self.send_response(503)
+            self.send_header('Retry-After', str(LIVE_INTERVAL))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            dashboard = self.tenant.get_rollups().dashboard()
+            self.wfile.write(b'retry: %d\n\n' % (LIVE_INTERVAL * 1000))
+            self.wfile.write(sse_frame('agg', dashboard, event_id=dashboard['version']))
+            self.wfile.write(sse_frame('records', self.tenant.get_sync().records()[:LIVE_TABLE_ROWS]))
+            self.wfile.flush()
+            while True:
+                frame = subscription.next(STREAM_KEEPALIVE)
+                if frame is None:
+                    break
+                self.wfile.write(frame or b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            subscription.close()
+
+    def serve_aggregates(self):
+        """Return precomputed rollups instead of raw rows.
+
+        /api/agg returns everything the dashboard tiles and charts need;
+        /api/agg/<name> returns one report (see Rollups.report). Data is
+        refreshed the same way as /api/data, including ?fresh=1.
+        With --rollup-tables, the reports in ROLLUP_REPORTS are answered
+        from the hourly rollup tables instead of the held records, over
+        their dashboard-queries.sql window or the last ?days=N days.
+        """
+        parsed = urlparse(self.path)
+        qs = parse_qs(parsed.query)
+        name = parsed.path[len('/api/agg'):].strip('/')
+        try:
+            min_tests = int(qs.get('min_tests', ['1'])[0])
+            days = int(qs['days'][0]) if 'days' in qs else None
+        except ValueError:
+            self.send_error_json('min_tests and days must be integers', 400)
+            return
+        try:
+            if days is not None and not (ROLLUP_TABLES and name in ROLLUP_REPORTS):
+                self.send_error_json(f'days needs --rollup-tables and one of {", ".join(ROLLUP_REPORTS)}', 400)
+                return
+            if ROLLUP_TABLES and name in ROLLUP_REPORTS:
+                report = self.tenant.get_rollup_tables().report(name, days, min_tests=min_tests)
+                self.send_json_response(report)
+                return
+            aggregates = self.tenant.get_rollups()
+            self.tenant.telemetry(fresh=qs.get('fresh', ['0'])[0] == '1')
+            if not name:
+                self.send_cached_json(('agg',), aggregates.dashboard())
+                return
+            try:
+                report = aggregates.report(name, min_tests=min_tests)
+            except KeyError:
+                self.send_error_json(f'unknown report: {name}', 404)
+                return
+            self.send_json_response(report)
+        except Exception as e:
+            self.send_error_json(str(e))
+
     # --- New helper methods for reachability drill-down ---
-    def run_bq(self, query):
-        env = os.environ.copy()
-        sdk_bin = '/Users/jwilder/google-cloud-sdk/bin'
-        env['PATH'] = f"{sdk_bin}:{env.get('PATH','')}"
-        env.setdefault('CLOUDSDK_ROOT_DIR', '/Users/jwilder/google-cloud-sdk')
-        result = subprocess.run([
-            '/Users/jwilder/google-cloud-sdk/bin/bq', 'query', '--use_legacy_sql=false', '--format=json', query
-        ], capture_output=True, text=True, timeout=30, env=env)
-        if result.returncode != 0:
-            raise RuntimeError(result.stderr.strip())
-        return json.loads(result.stdout)
-
-    def do_GET(self):  # override to add new endpoints
+    def run_bq(self, name, ttl, **params):
+        """Run a named backend query through the tenant's result cache."""
+        return self.tenant.cached_query(name, ttl, **params)
+
+    def do_GET(self):
+        """Route the request, timing it into /metrics and the access log."""
+        self.tenant, self.path, self.tenant_prefix = resolve_tenant(self.path, self.headers.get('X-Tenant'))
+        route = route_of(self.path)
+        self.response_status = None
+        trace = begin_trace()
+        profiler = self.start_profile()
+        started = time.perf_counter()
+        try:
+            if self.tenant is None:
+                self.send_error_json('unknown tenant', 404)
+            else:
+                if route not in IDLE_ROUTES:
+                    self.tenant.last_request = time.monotonic()
+                self.route_get()
+        finally:
+            elapsed = time.perf_counter() - started
+            end_trace()
+            tenant = self.tenant.name if self.tenant is not None else ''
+            REQUEST_SECONDS.observe(elapsed, tenant=tenant, route=route, status=self.response_status or 0)
+            extra = {}
+            if profiler is not None:
+                extra['profile'] = self.finish_profile(profiler, route)
+            log.info(f'{self.command} {self.path} {self.response_status}',
+                     extra=fields(tenant=tenant, route=route, status=self.response_status, ms=round(elapsed * 1000, 2),
+                                  client=self.client_address[0], spans=summarize_spans(trace), **extra))
+
+    def start_profile(self):
+        if not PROFILE_DIR or parse_qs(urlparse(self.path).query).get('profile') != ['1']:
+            return None
+        if not profile_lock.acquire(blocking=False):
+            return None  # another request is being profiled
+        return SamplingProfiler().start()
+
+    def finish_profile(self, profiler, route):
+        """Stop sampling and write the folded stacks; returns the file written."""
+        try:
+            profiler.stop()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            name = route.strip('/').replace('/', '-') or 'root'
+            path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{profiler.samples}.folded")
+            profiler.write_folded(path)
+            return path
+        finally:
+            profile_lock.release()
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    def log_request(self, code='-', size='-'):
+        pass  # do_GET logs every request with its timings
+
+    def log_message(self, format, *args):
+        log.warning(format % args, extra=fields(client=self.client_address[0]))
+
+    def route_get(self):
         if self.path == '/api/data' or self.path.startswith('/api/data?'):
             self.serve_data()
             return
+        if self.path == '/api/agg' or self.path.startswith(('/api/agg/', '/api/agg?')):
+            self.serve_aggregates()
+            return
+        if self.path == '/api/stream' or self.path.startswith('/api/stream?'):
+            self.serve_stream()
+            return
+        if self.path == '/metrics':
+            # Only the requested tenant's series, plus the process-wide ones
+            body = REGISTRY.render(where={'tenant': self.tenant.name}).encode()
+            self.send_payload(Payload(body, CONTENT_TYPE))
+            return
+        if self.path.startswith('/api/cache/stats'):
+            prefetch = prefetcher.stats(prefix=f'{self.tenant.name}/') if prefetcher else None
+            self.send_json_response(dict(self.tenant.stats(), tenant=self.tenant.name, prefetch=prefetch))
+            return
+        if self.path == '/api/tenants':
+            self.serve_tenants()
+            return
+        if self.path == '/api/alerts' or self.path.startswith('/api/alerts?'):
+            self.serve_alerts()
+            return
         if self.path.startswith('/api/raw'):
             self.serve_raw()
             return
         if self.path.startswith('/api/reachability/summary'):
             self.serve_reachability_summary()
             return
+        if self.path.startswith('/api/reachability/site/stats'):
+            self.serve_reachability_site_stats()
+            return
         if self.path.startswith('/api/reachability/site'):
             self.serve_reachability_site()
             return
         super().do_GET()
 
+    def serve_tenants(self):
+        """The requested tenant's configuration, query budget use and cache memory.
+
+        Other tenants' settings are never shown, so one district cannot read
+        another's table, paths or budget.
+        """
+        tenant = self.tenant
+        self.send_json_response(dict(
+            tenant.config.to_dict(), default=tenant is default_tenant,
+            queries=query_budget.stats()['tenants'].get(tenant.name),
+            cache_bytes=tenant.result_cache.bytes + tenant.payload_cache.bytes,
+            records=tenant.sync.count() if tenant.sync is not None else 0))
+
+    def serve_alerts(self):
+        """Degradation alerts, newest first (?open=1, ?kind=isp_city|site, ?limit=).
+
+        With ?segment= (and ?kind=) returns that segment's current baselines instead.
+        """
+        try:
+            qs = parse_qs(urlparse(self.path).query)
+            kind = qs.get('kind', [None])[0]
+            if kind not in (None, 'isp_city', 'site'):
+                self.send_error_json('kind must be isp_city or site', 400)
+                return
+            try:
+                limit = page_size(qs.get('limit', [None])[0], ALERTS_LIMIT)
+            except ValueError as e:
+                self.send_error_json(str(e), 400)
+                return
+            self.tenant.telemetry()
+            detector = self.tenant.get_detector()
+            segment = qs.get('segment', [None])[0]
+            if segment:
+                baselines = detector.segment(kind or 'isp_city', segment)
+                if baselines is None:
+                    self.send_error_json(f'segment {segment} is not tracked', 404)
+                    return
+                self.send_json_response({'segment': segment, 'kind': kind or 'isp_city', 'metrics': baselines})
+                return
+            alerts = detector.alerts(open_only=qs.get('open', [''])[0] == '1', kind=kind, limit=limit)
+            self.send_json_response({'alerts': alerts, 'stats': detector.stats()})
+        except Exception as e:
+            self.send_error_json(str(e))
+
+    def reach_days(self, qs):
+        """Parse ?days=, clamped to 1..REACH_SUMMARY_DAYS; raises ValueError."""
+        return max(1, min(int(qs.get('days', [REACH_SUMMARY_DAYS])[0]), REACH_SUMMARY_DAYS))
+
     def serve_reachability_summary(self):
+        """Per-site availability and latency over the last ?days= (default 7).
+
+        Answered from the in-memory reachability engine once it has seen site
+        checks; ?source=bigquery (or an empty engine) runs the BigQuery scan.
+        """
         try:
-            query = """
-            WITH expanded AS (
-              SELECT 
-                JSON_VALUE(r,'$.url') AS url,
-                JSON_VALUE(r,'$.ok') = 'true' AS ok,
-                CAST(JSON_VALUE(r,'$.latencyMs') AS FLOAT64) AS latency_ms,
-                ingestReceivedAt AS ts
-              FROM `test-email-467802.telemetry.pubsub_raw`,
-              UNNEST(JSON_QUERY_ARRAY(reachability, '$.results')) r
-              WHERE ingestReceivedAt >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)
-            )
-            SELECT 
-              url,
-              COUNT(*) total_checks,
-              SUM(CASE WHEN ok THEN 1 ELSE 0 END) ok_checks,
-              ROUND(100 * SUM(CASE WHEN ok THEN 1 ELSE 0 END)/COUNT(*),2) AS availability_pct,
-              ROUND(AVG(latency_ms),2) AS avg_latency_ms,
-              ROUND(MAX(latency_ms),2) AS max_latency_ms,
-              ROUND(MIN(latency_ms),2) AS min_latency_ms,
-              MAX(ts) AS last_seen
-            FROM expanded
-            GROUP BY url
-            ORDER BY availability_pct ASC, url
-            """
-            data = self.run_bq(query)
-            self.send_json_response(data)
+            qs = parse_qs(urlparse(self.path).query)
+            try:
+                days = self.reach_days(qs)
+            except ValueError:
+                self.send_error_json('days must be an integer', 400)
+                return
+            engine = self.tenant.get_reach_engine()
+            if len(engine) and qs.get('source', [''])[0] != 'bigquery':
+                self.tenant.telemetry()
+                self.send_json_response(engine.summary(days))
+                return
+            data = self.run_bq('reachability_summary', REACH_SUMMARY_TTL, days=days)
+            self.send_cached_json(('reachability_summary', days), data)
+        except Exception as e:
+            self.send_error_json(str(e))
+
+    def serve_reachability_site_stats(self):
+        """Availability, latency percentiles, status/error breakdown and hourly series of one site."""
+        try:
+            qs = parse_qs(urlparse(self.path).query)
+            url = qs.get('url', [None])[0]
+            if not url:
+                self.send_error_json('missing url param')
+                return
+            try:
+                days = self.reach_days(qs)
+            except ValueError:
+                self.send_error_json('days must be an integer', 400)
+                return
+            stats = self.tenant.get_reach_engine().site(url, days)
+            if stats is None:
+                self.send_error_json(f'no checks recorded for {url}', 404)
+                return
+            self.send_json_response(stats)
         except Exception as e:
             self.send_error_json(str(e))
 
     def serve_reachability_site(self):
+        """Checks of one site, newest first, paged with ?limit= and ?cursor=."""
         try:
             parsed = urlparse(self.path)
             qs = parse_qs(parsed.query)
@@ -233,56 +949,114 @@ class DashboardHandler(SimpleHTTPRequestHandler):
             if not url:
                 self.send_error_json('missing url param')
                 return
-            # Parameter embedding with simple escaping (trusted internal tool usage)
-            safe_url = url.replace('"', '')
-            query = f"""
-            SELECT 
-              ingestReceivedAt AS ts,
-              requestId,
-              JSON_VALUE(r,'$.url') AS url,
-              JSON_VALUE(r,'$.ok') = 'true' AS ok,
-              JSON_VALUE(r,'$.error') AS error,
-              CAST(JSON_VALUE(r,'$.status') AS INT64) AS status,
-              CAST(JSON_VALUE(r,'$.latencyMs') AS FLOAT64) AS latency_ms
-            FROM `test-email-467802.telemetry.pubsub_raw`,
-            UNNEST(JSON_QUERY_ARRAY(reachability, '$.results')) r
-            WHERE JSON_VALUE(r,'$.url') = '{safe_url}'
-            ORDER BY ts DESC
-            LIMIT 200
-            """
-            data = self.run_bq(query)
-            self.send_json_response(data)
+            try:
+                limit = page_size(qs.get('limit', [None])[0], REACH_SITE_LIMIT)
+                before_ts, before_id = decode_cursor(qs['cursor'][0], (str, str)) if 'cursor' in qs else ('', '')
+            except ValueError as e:
+                self.send_error_json(str(e), 400)
+                return
+            if 'cursor' not in qs and limit == REACH_SITE_LIMIT:
+                with self.tenant.site_requests_lock:
+                    self.tenant.site_requests[url] += 1
+            data = self.run_bq('reachability_site', REACH_SITE_TTL, **site_params(url, limit, before_ts, before_id))
+            next_cursor = None
+            if len(data) == limit:
+                next_cursor = encode_cursor(str(data[-1]['ts']), data[-1].get('requestId') or '')
+            self.send_cached_json(('reachability_site', url, limit, before_ts, before_id), data,
+                                  headers=self.next_page_headers(next_cursor))
         except Exception as e:
             self.send_error_json(str(e))
 
     def serve_raw(self):
-        """Return raw latest rows from BigQuery for debugging."""
+        """Return raw rows from BigQuery for debugging, newest first.
+
+        Accepts the same filters as /api/data paging (time range, ISP, city,
+        device type, trigger, version), bound as query parameters, plus
+        ?limit= and ?cursor=.
+        """
         try:
-            query = """
-            SELECT ingestReceivedAt, trigger, speed, reachability, device, requestId
-            FROM `test-email-467802.telemetry.pubsub_raw`
-            ORDER BY ingestReceivedAt DESC
-            LIMIT 50
-            """
-            data = self.run_bq(query)
-            self.send_json_response(data)
+            qs = parse_qs(urlparse(self.path).query)
+            try:
+                limit = page_size(qs.get('limit', [None])[0], RAW_LIMIT)
+                before_ts, before_id = decode_cursor(qs['cursor'][0], (str, str)) if 'cursor' in qs else ('', '')
+            except ValueError as e:
+                self.send_error_json(str(e), 400)
+                return
+            params = {name: qs.get(name, [''])[0] for name in FILTER_FIELDS}
+            params.update(limit=limit, before_ts=before_ts, before_id=before_id,
+                          since_ts=qs.get('since', [''])[0], until_ts=qs.get('until', [''])[0])
+            data = self.run_bq('raw_rows', RAW_TTL, **params)
+            next_cursor = None
+            if len(data) == limit:
+                next_cursor = encode_cursor(str(data[-1]['ingestReceivedAt']), data[-1].get('requestId') or '')
+            self.send_cached_json(('raw',) + tuple(sorted(params.items())), data,
+                                  headers=self.next_page_headers(next_cursor))
         except Exception as e:
             self.send_error_json(str(e))
 
     def send_error_json(self, message, code=500):
+        self.send_json_response({'error': message}, code)
+
+    def send_json_response(self, data, code=200, headers=None):
+        """Send JSON response with proper headers"""
+        self.send_payload(Payload.from_data(data), code, headers)
+
+    def send_cached_json(self, key, data, build=None, headers=None):
+        """Send data (or build()) as JSON, reusing the serialized body while data is the same object."""
+        self.send_payload(self.tenant.payload_cache.get(key, data, build), headers=headers)
+
+    def send_payload(self, payload, code=200, headers=None):
+        """Send a serialized payload: compressed per Accept-Encoding, 304 when the ETag matches."""
+        accepted = negotiate_encoding(self.headers.get('Accept-Encoding'))
+        etag = payload.etag_for(accepted)
+        if code == 200 and etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+        body, encoding = payload.encoded(accepted)
         self.send_response(code)
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', payload.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if code == 200:
+            # Let browsers keep the body but revalidate it on every poll
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', 'ETag, X-Next-Cursor, Link')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(json.dumps({ 'error': message }).encode())
-    
-    def send_json_response(self, data):
-        """Send JSON response with proper headers"""
+        with span('write'):
+            self.wfile.write(body)
+
+    def send_json_stream(self, records, ndjson=False):
+        """Stream records as a JSON array or NDJSON, compressing on the fly.
+
+        The body is delimited by closing the connection, so no row count or
+        full body is ever held in memory.
+        """
+        encoder = StreamEncoder(negotiate_encoding(self.headers.get('Accept-Encoding')))
         self.send_response(200)
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', 'application/x-ndjson' if ndjson else 'application/json')
+        if encoder.encoding:
+            self.send_header('Content-Encoding', encoder.encoding)
+        self.send_header('Vary', 'Accept-Encoding')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(json.dumps(data, default=str).encode())
+        self.close_connection = True
+        with span('stream'):
+            for chunk in json_chunks(records, ndjson=ndjson):
+                self.wfile.write(encoder.encode(chunk))
+            self.wfile.write(encoder.finish())
     
     def send_sample_data(self):
         """Send sample data for demonstration"""
@@ -311,33 +1085,122 @@ class DashboardHandler(SimpleHTTPRequestHandler):
             }
         ]
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(sample_data, default=str).encode())
+        SAMPLE_FALLBACKS.inc()
+        self.send_json_response(sample_data)
 
-def main():
-    port = 8000
-    
-    print(f"🌐 Starting K-12 Network Telemetry Dashboard")
-    print(f"📊 Dashboard will be available at: http://localhost:{port}/dashboard.html")
-    print(f"🔄 Data API available at: http://localhost:{port}/api/data")
-    print(f"📂 Serving from: {os.getcwd()}")
-    print(f"⏹️  Press Ctrl+C to stop the server")
-    print()
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that handles each connection on a bounded worker pool.
+
+    A slow BigQuery call only ties up one worker; static files and other API
+    calls keep being served by the rest. When every worker is busy the accept
+    loop waits for a free slot, so excess connections queue in the listen
+    backlog instead of spawning unbounded threads.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS):
+        self.workers = max(1, int(workers))
+        # Allow a short backlog of accepted connections per worker
+        self.request_queue_size = max(self.request_queue_size, self.workers * 4)
+        # Created before binding: a failed bind calls server_close()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='dashboard-worker')
+        self._slots = threading.BoundedSemaphore(self.workers)
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self._pool.submit(self._process_request_worker, request, client_address)
+        except Exception:
+            self._slots.release()
+            self.shutdown_request(request)
+            raise
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='K-12 Network Telemetry dashboard server')
+    parser.add_argument('--host', default=os.environ.get('DASHBOARD_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('DASHBOARD_PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('DASHBOARD_WORKERS', DEFAULT_WORKERS)),
+                        help='maximum number of requests served concurrently')
+    parser.add_argument('--max-records', type=int, default=DATA_MAX_RECORDS,
+                        help='maximum number of telemetry records held and served by /api/data')
+    parser.add_argument('--backend', default=os.environ.get('DASHBOARD_BACKEND', 'auto'),
+                        help='query backend: auto, bigquery, bq-cli, sqlite (local stand-in) '
+                             'or synthetic (generated rows, for load tests)')
+    parser.add_argument('--tenants', default=os.environ.get('DASHBOARD_TENANTS'),
+                        help='JSON file of tenants (districts) to serve; see tenants.py')
+    parser.add_argument('--max-queries', type=int,
+                        default=int(os.environ.get('DASHBOARD_MAX_QUERIES', DEFAULT_TOTAL_QUERIES)),
+                        help='backend queries in flight across all tenants')
+    parser.add_argument('--rollup-tables', action='store_true', default=ROLLUP_TABLES,
+                        help='keep hourly rollup tables in the backend and answer the heavy /api/agg/<name> '
+                             'reports from them (creates <table>_hourly; needs write access)')
+    parser.add_argument('--no-prefetch', action='store_true',
+                        help='do not refresh caches in the background; requests fetch on demand')
+    parser.add_argument('--no-browser', action='store_true', help='do not open the dashboard in a browser')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global backend_name, backend_pool_size, max_streams, DATA_MAX_RECORDS, ROLLUP_TABLES
+    args = parse_args(argv)
+    ROLLUP_TABLES = args.rollup_tables
+    port = args.port
+    backend_name = args.backend
+    backend_pool_size = args.workers
+    max_streams = args.workers // 2
+    DATA_MAX_RECORDS = args.max_records
     
-    # Start server
-    httpd = HTTPServer(('localhost', port), DashboardHandler)
+    log_listener = configure_logging()
+    try:
+        configs = load_tenants(args.tenants)
+        configure_tenants(configs, args.max_queries, max_streams)
+    except (OSError, ValueError) as e:
+        log.error(f"❌ Could not load tenants: {e}")
+        log_listener.stop()
+        raise SystemExit(2)
+    log.info(f"🌐 Starting K-12 Network Telemetry Dashboard")
+    log.info(f"📊 Dashboard will be available at: http://{args.host}:{port}/dashboard.html")
+    log.info(f"🔄 Data API available at: http://{args.host}:{port}/api/data")
+    log.info(f"📈 Metrics available at: http://{args.host}:{port}/metrics")
+    log.info(f"📂 Serving from: {os.getcwd()}")
+    log.info(f"🧵 Worker threads: {args.workers}")
+    if len(tenants) > 1:
+        log.info(f"🏫 Tenants: {', '.join(tenants)} (under /t/<tenant>/; {default_tenant.name} also at /)")
+    log.info(f"⏹️  Press Ctrl+C to stop the server")
+
+    # Bind the port first; local data loads and caches warm in the background
+    httpd = PooledHTTPServer((args.host, port), DashboardHandler, workers=args.workers)
+    scheduler = start_prefetch(enabled=not args.no_prefetch)
     
     # Open browser automatically
-    webbrowser.open(f'http://localhost:{port}/dashboard.html')
+    if not args.no_browser:
+        webbrowser.open(f'http://{args.host}:{port}/dashboard.html')
     
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print(f"\n🛑 Dashboard server stopped")
-        httpd.shutdown()
+        log.info(f"🛑 Dashboard server stopped")
+    finally:
+        scheduler.stop()
+        httpd.server_close()
+        for tenant in tenants.values():
+            tenant.close()
+        log_listener.stop()
 
 if __name__ == '__main__':
     main()
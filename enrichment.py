@@ -0,0 +1,292 @@
+"""
+Batched enrichment of raw pubsub_raw rows into dashboard records.
+
+enrich_batch() walks a batch of raw rows once and fills one column per field:
+numeric metrics go into array('d') columns, site counts into array('l'), and
+failed download/ping tests are tracked as flags rather than mixed into the
+numeric columns. Metrics that arrived as integers (or were missing, which the
+API reports as 0) are flagged too, so records serialize exactly as before:
+0 rather than 0.0. The dict records the dashboard API has always returned are
+produced from the columns on demand, either one at a time via RecordView or
+all at once with EnrichedBatch.to_dicts().
+
+Individual site checks are not part of the records: the batch keeps each
+row's raw reachability column on the side, and site_checks() decodes it into
+[url, ok, status, latency_ms, error] lists for the reachability engine and
+the anomaly detector only when asked. Records stay the size /api/data serves.
+"""
+
+from array import array
+from collections.abc import Mapping
+import json
+
+try:  # optional fast JSON decoder
+    import orjson
+    _loads = orjson.loads
+    _DECODE_ERRORS = (orjson.JSONDecodeError, TypeError)
+except ImportError:
+    _loads = json.JSONDecoder().decode
+    _DECODE_ERRORS = (ValueError, TypeError)
+
+# Output field order of an enriched record
+FIELDS = (
+    'publish_time', 'trigger', 'version', 'duration_ms', 'user_email',
+    'device_make', 'device_type', 'device_os', 'device_os_version',
+    'isp_provider', 'city', 'download_speed', 'upload_speed', 'ping_ms',
+    'sites_ok', 'sites_total', 'request_id',
+)
+
+# Plain per-row columns copied into the record as-is
+_OBJECT_COLUMNS = (
+    'publish_time', 'trigger', 'version', 'duration_ms', 'user_email',
+    'device_make', 'device_type', 'device_os', 'device_os_version',
+    'isp_provider', 'city', 'request_id',
+)
+
+FAILED = 'Failed'
+UNKNOWN = 'Unknown'
+_EMPTY = {}
+
+
+def _decode(raw):
+    """Decode a JSON object column; already-decoded dicts pass through."""
+    if isinstance(raw, dict):
+        return raw
+    if not raw or not isinstance(raw, str):
+        return _EMPTY
+    try:
+        value = _loads(raw)
+    except _DECODE_ERRORS:
+        return _EMPTY
+    return value if isinstance(value, dict) else _EMPTY
+
+
+def _number(value):
+    """Coerce a speed metric to a number (ints stay ints), or None when it is not numeric."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class EnrichedBatch:
+    """Column-oriented batch of enriched telemetry records."""
+
+    def __init__(self):
+        for name in _OBJECT_COLUMNS:
+            setattr(self, name, [])
+        self.download_speed = array('d')
+        self.upload_speed = array('d')
+        self.ping_ms = array('d')
+        self.download_failed = bytearray()
+        self.ping_failed = bytearray()
+        # Set where the metric is an int in the API shape
+        self.download_int = bytearray()
+        self.upload_int = bytearray()
+        self.ping_int = bytearray()
+        self.sites_ok = array('l')
+        self.sites_total = array('l')
+        # Raw reachability column of each row, decoded by site_checks() on demand
+        self.reachability = []
+
+    def __len__(self):
+        return len(self.publish_time)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('record index out of range')
+        return RecordView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield RecordView(self, index)
+
+    def value(self, field, index):
+        """Return one field of one record in the API's JSON shape."""
+        if field == 'download_speed':
+            if self.download_failed[index]:
+                return FAILED
+            return _metric(self.download_speed[index], self.download_int[index])
+        if field == 'ping_ms':
+            if self.ping_failed[index]:
+                return FAILED
+            return _metric(self.ping_ms[index], self.ping_int[index])
+        if field == 'upload_speed':
+            return _metric(self.upload_speed[index], self.upload_int[index])
+        if field in ('sites_ok', 'sites_total'):
+            return getattr(self, field)[index]
+        if field in _OBJECT_COLUMNS:
+            return getattr(self, field)[index]
+        raise KeyError(field)
+
+    def to_dicts(self):
+        """Materialize every record as the dict shape /api/data returns."""
+        download = [FAILED if failed else int(value) if integral else value
+                    for value, failed, integral in zip(self.download_speed, self.download_failed, self.download_int)]
+        upload = [int(value) if integral else value
+                  for value, integral in zip(self.upload_speed, self.upload_int)]
+        ping = [FAILED if failed else int(value) if integral else value
+                for value, failed, integral in zip(self.ping_ms, self.ping_failed, self.ping_int)]
+        columns = (
+            self.publish_time, self.trigger, self.version, self.duration_ms, self.user_email,
+            self.device_make, self.device_type, self.device_os, self.device_os_version,
+            self.isp_provider, self.city, download, upload, ping,
+            self.sites_ok, self.sites_total, self.request_id,
+        )
+        return [dict(zip(FIELDS, row)) for row in zip(*columns)]
+
+    def site_checks(self):
+        """Per record, its site checks as [url, ok, status, latency_ms, error] lists."""
+        return [site_checks(raw) for raw in self.reachability]
+
+
+def site_checks(reachability):
+    """Decode a raw reachability column into [url, ok, status, latency_ms, error] lists."""
+    results = _decode(reachability).get('results')
+    if not isinstance(results, list):
+        return []
+    checks = []
+    for x in results:
+        if not isinstance(x, dict):
+            continue
+        status = x.get('status')
+        error = x.get('error')
+        ok = x.get('ok') is True or (status == 200 and error is None)
+        checks.append([x.get('url'), ok, status, _number(x.get('latencyMs')), error])
+    return checks
+
+
+def _metric(value, integral):
+    return int(value) if integral else value
+
+
+class RecordView(Mapping):
+    """Read-only dict-like view of one record in an EnrichedBatch."""
+
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch, index):
+        self._batch = batch
+        self._index = index
+
+    def __getitem__(self, field):
+        return self._batch.value(field, self._index)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __repr__(self):
+        return f'RecordView({dict(self)!r})'
+
+
+def enrich_batch(rows):
+    """Enrich raw rows (as returned by the query backend) into an EnrichedBatch.
+
+    Rows without a publish_time are skipped, as the dashboard cannot place them.
+    """
+    batch = EnrichedBatch()
+    _enrich_into(batch, rows)
+    return batch
+
+
+def _enrich_into(batch, rows):
+    # Bind column appends once instead of looking them up per row
+    add_publish_time = batch.publish_time.append
+    add_trigger = batch.trigger.append
+    add_version = batch.version.append
+    add_duration = batch.duration_ms.append
+    add_user = batch.user_email.append
+    add_make = batch.device_make.append
+    add_type = batch.device_type.append
+    add_os = batch.device_os.append
+    add_os_version = batch.device_os_version.append
+    add_isp = batch.isp_provider.append
+    add_city = batch.city.append
+    add_request_id = batch.request_id.append
+    add_download = batch.download_speed.append
+    add_upload = batch.upload_speed.append
+    add_ping = batch.ping_ms.append
+    add_download_failed = batch.download_failed.append
+    add_ping_failed = batch.ping_failed.append
+    add_download_int = batch.download_int.append
+    add_upload_int = batch.upload_int.append
+    add_ping_int = batch.ping_int.append
+    add_sites_ok = batch.sites_ok.append
+    add_sites_total = batch.sites_total.append
+    add_reachability = batch.reachability.append
+
+    for r in rows:
+        if not isinstance(r, dict):
+            continue
+        publish_time = r.get('publish_time')
+        if not publish_time:
+            continue
+        speed = _decode(r.get('speed'))
+        reach = _decode(r.get('reachability'))
+        device = _decode(r.get('device'))
+
+        dev_meta = device.get('device')
+        if not isinstance(dev_meta, dict):
+            dev_meta = _EMPTY
+        isp_meta = device.get('isp')
+        if not isinstance(isp_meta, dict):
+            isp_meta = _EMPTY
+        user = device.get('user')
+
+        results = reach.get('results')
+        if isinstance(results, list):
+            ok = 0
+            for x in results:
+                if isinstance(x, dict) and (x.get('ok') is True or (x.get('status') == 200 and x.get('error') is None)):
+                    ok += 1
+            add_sites_total(len(results))
+            add_sites_ok(ok)
+        else:
+            add_sites_total(0)
+            add_sites_ok(0)
+
+        if speed:
+            download = _number(speed.get('downloadMbps'))
+            upload = _number(speed.get('uploadMbps'))
+            ping = _number(speed.get('pingMs') or speed.get('pingms'))
+            download_failed = bool(speed.get('downloadError') or speed.get('downloadErrorFallback'))
+            ping_failed = bool(speed.get('pingError'))
+        else:
+            download = upload = ping = None
+            download_failed = ping_failed = False
+
+        add_publish_time(publish_time)
+        add_trigger(r.get('trigger'))
+        add_version(r.get('version'))
+        add_duration(r.get('durationMs'))
+        add_user(user.get('email') if isinstance(user, dict) else None)
+        add_make(dev_meta.get('make') or UNKNOWN)
+        add_type(dev_meta.get('type') or UNKNOWN)
+        add_os(dev_meta.get('os') or UNKNOWN)
+        add_os_version(dev_meta.get('osVersion') or UNKNOWN)
+        add_isp(isp_meta.get('provider') or UNKNOWN)
+        add_city(isp_meta.get('city') or UNKNOWN)
+        add_request_id(r.get('requestId'))
+        add_reachability(r.get('reachability'))
+        add_download(download if download is not None else 0.0)
+        add_upload(upload if upload is not None else 0.0)
+        add_ping(ping if ping is not None else 0.0)
+        add_download_failed(download_failed)
+        add_ping_failed(ping_failed)
+        add_download_int(type(download) is not float)
+        add_upload_int(type(upload) is not float)
+        add_ping_int(type(ping) is not float)
+
+
+def enrich_rows(rows):
+    """Enrich raw rows into a list of record dicts (the /api/data shape)."""
+    return enrich_batch(rows).to_dicts()
@@ -4,92 +4,139 @@ BigQuery Data Fetcher for K-12 Network Telemetry Dashboard
 Fetches real data from your BigQuery table and serves it to the dashboard
 """
 
-import json
-import subprocess
+import argparse
 import sys
 from datetime import datetime, timedelta
 
-def run_bq_query(query):
-    """Execute a BigQuery query and return results as JSON"""
+import backfill
+from query_backend import QueryError, create_backend
+from rollup_tables import BUILD_DAYS, RollupTables
+from telemetry_store import TelemetryStore, day_range
+from telemetry_sync import IncrementalSync
+
+# Query backend shared by every query in this run; set up in main()
+backend = None
+
+def run_bq_query(name, **params):
+    """Run a named query on the configured backend and return its rows"""
     try:
-        # Run BigQuery command
-        result = subprocess.run([
-            '/Users/jwilder/google-cloud-sdk/bin/bq', 'query', 
-            '--use_legacy_sql=false', 
-            '--format=json',
-            '--max_rows=1000',
-            query
-        ], capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0:
-            return json.loads(result.stdout)
-        else:
-            print(f"BigQuery Error: {result.stderr}")
-            return None
-            
-    except subprocess.TimeoutExpired:
-        print("BigQuery query timed out")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
+        return backend.run(name, **params)
+    except QueryError as e:
+        print(f"BigQuery Error: {e}")
         return None
     except Exception as e:
         print(f"Error running BigQuery query: {e}")
         return None
 
-def get_telemetry_data():
-    """Fetch recent telemetry data from BigQuery"""
-    query = """SELECT ingestReceivedAt as publish_time, 
-                      device as device_info,
-                      trigger 
-               FROM `test-email-467802.telemetry.pubsub_raw`
-               WHERE DATE(ingestReceivedAt) >= DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
-               ORDER BY ingestReceivedAt DESC
-               LIMIT 100"""
-    
-    print("🔍 Querying BigQuery for telemetry data...")
-    result = run_bq_query(query)
-    if result and len(result) > 0:
-        print(f"✅ Found {len(result)} telemetry records")
+def get_telemetry_data(days=7):
+    """Sync new telemetry from BigQuery into the local store and return the last few days"""
+    store = TelemetryStore()
+    sync = IncrementalSync(backend)
+    sync.seed(store.latest(sync.max_records))
+    print(f"🔍 Querying BigQuery for telemetry newer than {sync.watermark}...")
+    try:
+        added, site_checks = sync.sync()
+    except QueryError as e:
+        print(f"BigQuery Error: {e}")
+        added, site_checks = [], []
+    if added:
+        store.append(added, site_checks)
+        print(f"💾 Stored {len(added)} new records in {store.root}/")
+    result = store.scan(*day_range(days))
+    store.close()
+    if result:
+        print(f"✅ Found {len(result)} telemetry records from the last {days} days")
         return result
     else:
         print("❌ No telemetry data returned from query")
 
 def get_summary_stats():
     """Get summary statistics"""
-    query = """
-    SELECT 
-        COUNT(*) as total_tests,
-        AVG(CAST(JSON_EXTRACT_SCALAR(speed, '$.downloadMbps') AS FLOAT64)) as avg_download,
-        AVG(CAST(JSON_EXTRACT_SCALAR(speed, '$.uploadMbps') AS FLOAT64)) as avg_upload,
-        AVG(CAST(JSON_EXTRACT_SCALAR(speed, '$.pingMs') AS FLOAT64)) as avg_ping,
-        COUNT(DISTINCT ingestSourceIp) as unique_devices
-    FROM `test-email-467802.telemetry.pubsub_raw`
-    WHERE DATE(ingestReceivedAt) >= DATE_SUB(CURRENT_DATE(), INTERVAL 1 DAY)
-        AND speed IS NOT NULL
-    """
-    
     print("📊 Getting summary statistics...")
-    return run_bq_query(query)
+    return run_bq_query('summary_stats', days=1)
 
 def check_bigquery_access():
     """Check if BigQuery is accessible"""
+    ok, message = backend.check_access()
+    if ok:
+        print(f"✅ BigQuery access confirmed ({backend.name}: {message})")
+    else:
+        print(f"❌ BigQuery access failed: {message}")
+    return ok
+
+def positive_int(value):
+    """argparse type: an integer of at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive integer')
+    return number
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Fetch K-12 Network Telemetry data for the dashboard')
+    parser.add_argument('--backend', default=None,
+                        help='query backend: auto, bigquery, bq-cli or sqlite (defaults to DASHBOARD_BACKEND or auto)')
+    parser.add_argument('--backfill', nargs=2, metavar=('START', 'END'), type=backfill.parse_day,
+                        help='bulk-fetch every day from START to END (YYYY-MM-DD, inclusive) instead')
+    parser.add_argument('--format', choices=backfill.FORMATS, default='ndjson',
+                        help='backfill output: one NDJSON file per day, or the local columnar store')
+    parser.add_argument('--output', default=None,
+                        help='backfill directory (default: backfill/ for ndjson, the local store for store)')
+    parser.add_argument('--workers', type=int, default=backfill.DEFAULT_WORKERS,
+                        help='days fetched in parallel during a backfill')
+    parser.add_argument('--page-size', type=int, default=backfill.DEFAULT_PAGE_SIZE,
+                        help='rows per backfill query')
+    parser.add_argument('--retries', type=int, default=backfill.DEFAULT_RETRIES,
+                        help='retries of a failed backfill query before its day is skipped')
+    parser.add_argument('--rollups', nargs='?', type=positive_int, const=BUILD_DAYS, metavar='DAYS',
+                        help='build or bring up to date the hourly rollup table (<table>_hourly) '
+                             f'over the last DAYS days (default {BUILD_DAYS}) instead')
+    return parser.parse_args(argv)
+
+def run_backfill(args):
+    """Bulk-fetch the requested days; returns True when every day completed"""
+    start, end = args.backfill
+    if end < start:
+        print("❌ Backfill END must not be before START")
+        return False
+    if args.output:
+        output = args.output
+    elif args.format == 'store':
+        output = TelemetryStore().root
+    else:
+        output = 'backfill'
+    print(f"📥 Backfilling {start} to {end} into {output}/ ({args.format}, {args.workers} workers)...")
+    summary = backfill.backfill(backend, start, end, output, fmt=args.format, workers=args.workers,
+                                page_size=args.page_size, retries=args.retries)
+    print(f"\n✅ Fetched {summary['rows']} rows for {summary['done']} days in {summary['seconds']}s"
+          f" ({summary['skipped']} already done)")
+    if summary['failed']:
+        print(f"❌ {len(summary['failed'])} days failed: {', '.join(summary['failed'])}")
+        print("💡 Run the same command again to resume them")
+        return False
+    return True
+
+def run_rollups(days):
+    """Build or refresh the hourly rollup table; returns True on success"""
+    print(f"🧮 Updating {backend.table}_hourly (up to {days} days)...")
+    tables = RollupTables(backend, build_days=days)
     try:
-        result = subprocess.run(['/Users/jwilder/google-cloud-sdk/bin/bq', 'ls', 'test-email-467802:telemetry'], 
-                              capture_output=True, text=True, timeout=10)
-        if result.returncode == 0:
-            print("✅ BigQuery access confirmed")
-            return True
-        else:
-            print(f"❌ BigQuery access failed: {result.stderr}")
-            return False
-    except Exception as e:
-        print(f"❌ BigQuery check failed: {e}")
+        refreshed = tables.refresh()
+    except QueryError as e:
+        print(f"❌ Rollup refresh failed: {e}")
         return False
+    if refreshed is None:
+        print("✅ Rollup table already holds every completed hour")
+        return True
+    start, end = refreshed
+    print(f"✅ Rolled up {start} to {end} in {tables.last_duration}s")
+    return True
 
-def main():
+def main(argv=None):
+    global backend
+    args = parse_args(argv)
     print("🌐 K-12 Network Telemetry Data Fetcher")
     print("=" * 50)
+    backend = create_backend(args.backend, pool_size=max(args.workers, 1))
     
     # Check BigQuery access
     if not check_bigquery_access():
@@ -98,6 +145,16 @@ def main():
         print("2. You have access to the test-email-467802 project")
         print("3. Run: gcloud auth application-default login")
         return
+
+    if args.backfill:
+        if not run_backfill(args):
+            sys.exit(1)
+        return
+
+    if args.rollups is not None:
+        if not run_rollups(args.rollups):
+            sys.exit(1)
+        return
     
     # Fetch data
     print("\n📥 Fetching real telemetry data...")
@@ -106,11 +163,6 @@ def main():
     if telemetry_data:
         print(f"✅ Found {len(telemetry_data)} telemetry records")
         
-        # Save to file for dashboard
-        with open('telemetry_data.json', 'w') as f:
-            json.dump(telemetry_data, f, indent=2, default=str)
-        print("💾 Data saved to telemetry_data.json")
-        
         # Get summary stats
         stats = get_summary_stats()
         if stats and len(stats) > 0:
@@ -144,10 +196,12 @@ def main():
         # Show sample records
         print(f"\n📋 Recent Records:")
         for i, record in enumerate(telemetry_data[:3]):
+            download = record.get('download_speed', 0)
+            download = f"{download:.1f} Mbps" if isinstance(download, (int, float)) else download
             print(f"   {i+1}. {record.get('publish_time', 'Unknown')} - "
                   f"{record.get('device_make', 'Unknown')} "
                   f"{record.get('device_type', 'Unknown')} - "
-                  f"{record.get('download_speed', 0):.1f} Mbps")
+                  f"{download}")
     else:
         print("❌ No telemetry data found. Possible issues:")
         print("1. No data has been collected yet")
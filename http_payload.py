@@ -0,0 +1,235 @@
+"""
+Serialized, compressed and conditional JSON responses for the dashboard server.
+
+A Payload is a JSON body serialized once, with lazily built gzip/brotli
+variants. Each variant gets its own strong ETag (the body hash, suffixed
+with -gz or -br for compressed ones), and If-None-Match compares tags with
+the suffix stripped, so a cached variant revalidates under any encoding. PayloadCache keeps the Payload for each cached result
+object, so repeat requests for data that has not changed skip serialization
+and compression entirely. json_chunks() serializes large record sequences a
+batch at a time as a JSON array or NDJSON, and StreamEncoder compresses such a
+stream incrementally, so memory stays flat regardless of row count.
+"""
+
+from collections import OrderedDict
+import gzip
+import hashlib
+from itertools import islice
+import json
+import threading
+import zlib
+
+from compact_records import json_default
+from metrics import span
+
+try:  # optional brotli support
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Records serialized per streamed chunk
+STREAM_BATCH = 500
+DEFAULT_PAYLOAD_ENTRIES = 64
+# ETag suffix of each compressed representation
+ETAG_SUFFIXES = {'gzip': '-gz', 'br': '-br'}
+
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick 'br', 'gzip' or None from an Accept-Encoding header, honouring q-values."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, *params = part.split(';')
+        name = name.strip().lower()
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _base_etag(etag):
+    """Strip the weak prefix and any encoding suffix from an entity tag."""
+    etag = etag.removeprefix('W/')
+    for suffix in ETAG_SUFFIXES.values():
+        if etag.endswith(suffix + '"'):
+            return etag[:-len(suffix) - 1] + '"'
+    return etag
+
+
+def etag_matches(if_none_match, etag):
+    """True when an If-None-Match header matches etag (weak comparison, any encoding)."""
+    if not if_none_match:
+        return False
+    etag = _base_etag(etag)
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or _base_etag(candidate) == etag:
+            return True
+    return False
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class Payload:
+    """A serialized JSON body with its ETag and cached compressed variants.
+
+    etag is the tag of the identity body; etag_for() gives each encoding's.
+    """
+
+    __slots__ = ('body', 'etag', 'content_type', '_encoded', '_lock')
+
+    def __init__(self, body, content_type='application/json'):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.content_type = content_type
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_data(cls, data):
+        with span('serialize'):
+            return cls(json.dumps(data, default=json_default).encode())
+
+    def encoding_for(self, encoding):
+        """The encoding actually used for a negotiated one; small bodies stay identity."""
+        if encoding is None or len(self.body) < MIN_COMPRESS_BYTES:
+            return None
+        return encoding
+
+    def etag_for(self, encoding):
+        """Strong ETag of the representation sent for a negotiated encoding."""
+        encoding = self.encoding_for(encoding)
+        if encoding is None:
+            return self.etag
+        return self.etag[:-1] + ETAG_SUFFIXES[encoding] + '"'
+
+    def encoded(self, encoding):
+        """Return (body, encoding) for the negotiated encoding; small bodies stay identity."""
+        encoding = self.encoding_for(encoding)
+        if encoding is None:
+            return self.body, None
+        with self._lock:
+            body = self._encoded.get(encoding)
+            if body is None:
+                with span('compress'):
+                    body = self._encoded[encoding] = _compress(self.body, encoding)
+        return body, encoding
+
+
+class PayloadCache:
+    """LRU of Payloads, each valid while its source object is unchanged.
+
+    Entries are keyed by the caller's key and remember the object they were
+    built from; a lookup with the same object (identity, not equality) reuses
+    the serialized payload.
+    """
+
+    def __init__(self, max_entries=DEFAULT_PAYLOAD_ENTRIES, max_bytes=None):
+        self.max_entries = max_entries
+        # Bounds the uncompressed bodies held; compressed variants are smaller
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, source, build=None):
+        """Return the Payload for source, serializing build() (or source) on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is source:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        payload = Payload.from_data(build() if build is not None else source)
+        size = len(payload.body)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[1].body)
+            if self.max_bytes and size > self.max_bytes:
+                return payload
+            self._entries[key] = (source, payload)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted.body)
+        return payload
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def json_chunks(records, ndjson=False, batch=STREAM_BATCH):
+    """Yield encoded chunks of records as a JSON array or NDJSON, batch records at a time."""
+    dumps = json.JSONEncoder(default=json_default).encode
+    records = iter(records)
+    if not ndjson:
+        yield b'['
+    first = True
+    while True:
+        encoded = [dumps(record) for record in islice(records, batch)]
+        if not encoded:
+            break
+        if ndjson:
+            yield ('\n'.join(encoded) + '\n').encode()
+        else:
+            yield (('' if first else ',') + ','.join(encoded)).encode()
+        first = False
+    if not ndjson:
+        yield b']'
+
+
+class StreamEncoder:
+    """Incremental gzip/brotli (or identity) compressor for streamed bodies."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        else:
+            self._compressor = None
+
+    def encode(self, chunk):
+        if self._compressor is None:
+            return chunk
+        if self.encoding == 'br':
+            return self._compressor.process(chunk)
+        return self._compressor.compress(chunk)
+
+    def finish(self):
+        if self._compressor is None:
+            return b''
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
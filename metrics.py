@@ -0,0 +1,350 @@
+"""
+Instrumentation for the dashboard server: metrics, timing spans, a sampling
+profiler and non-blocking structured logging.
+
+Counters and histograms live in REGISTRY and are rendered in the Prometheus
+text format for /metrics. span() times one hot-path stage (bq subprocess,
+BigQuery execution, JSON parsing, enrichment, serialization, compression,
+socket writes) into the dashboard_stage_seconds histogram, and also onto the
+current request's trace so the access log shows where its time went.
+
+SamplingProfiler snapshots one thread's stack every millisecond or so and
+counts folded stacks (the flame graph input format); the server runs it for
+single requests on demand. configure_logging() routes log records through a
+queue to a background writer, so request threads never block on stdout.
+"""
+
+from bisect import bisect_left
+from collections import Counter as _StackCounter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds; covers cache hits (sub-millisecond) to slow BigQuery scans
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PROFILE_INTERVAL = 0.001
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample_line(name, labels, value):
+    if labels:
+        name += '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        value = int(value)
+    return f'{name} {value}'
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name + '_total', dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield self.name + '_bucket', dict(labels, le=le), cumulative
+            yield self.name + '_sum', labels, round(series[-1], 6)
+            yield self.name + '_count', labels, cumulative
+
+
+class Collected:
+    """Metric whose samples are read from fn() at scrape time.
+
+    fn returns a number, or an iterable of (labels dict, number) pairs.
+    Used to export counters other components already keep, at no cost on
+    the request path.
+    """
+
+    def __init__(self, name, documentation, fn, kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if value is None:
+            return
+        name = self.name + '_total' if self.kind == 'counter' else self.name
+        if isinstance(value, (int, float)):
+            yield name, {}, value
+            return
+        for labels, number in value:
+            if number is not None:
+                yield name, labels, number
+
+
+class Registry:
+    """Ordered set of metrics rendered together."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collect(self, name, documentation, fn, kind='gauge'):
+        return self.register(Collected(name, documentation, fn, kind))
+
+    def render(self, where=None):
+        """All metrics in the Prometheus text exposition format.
+
+        where maps label names to values; samples carrying one of those
+        labels with another value are left out (samples without it are kept).
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+                if where:
+                    samples = [sample for sample in samples
+                               if all(sample[1].get(label, value) == value for label, value in where.items())]
+            except Exception as e:  # one broken collector must not hide the rest
+                logging.getLogger(__name__).warning('metric %s failed: %s', metric.name, e)
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(_sample_line(name, labels, value) for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('dashboard_stage_seconds', 'Time spent in each hot-path stage.', ('stage',))
+
+
+def _process_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak, in KiB on Linux; the best available elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _process_cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+REGISTRY.collect('process_cpu_seconds', 'User and system CPU time of the server process.', _process_cpu, 'counter')
+REGISTRY.collect('process_resident_memory_bytes', 'Resident memory of the server process.', _process_rss)
+REGISTRY.collect('process_threads', 'Threads in the server process.', threading.active_count)
+
+
+# --- spans ---
+_trace = threading.local()
+
+
+def begin_trace():
+    """Start collecting this thread's spans (one request); returns the list they go into."""
+    _trace.spans = []
+    return _trace.spans
+
+
+def end_trace():
+    spans = getattr(_trace, 'spans', None)
+    _trace.spans = None
+    return spans or []
+
+
+@contextmanager
+def span(stage):
+    """Time a block into dashboard_stage_seconds{stage=...} and the current request's trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        spans = getattr(_trace, 'spans', None)
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def summarize_spans(spans):
+    """Total milliseconds per stage, e.g. {'query': 812.4, 'serialize': 3.1}."""
+    totals = {}
+    for stage, elapsed in spans:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return {stage: round(seconds * 1000, 2) for stage, seconds in totals.items()}
+
+
+# --- profiler ---
+class SamplingProfiler:
+    """Counts folded stacks of one thread, sampled from another thread every interval seconds."""
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = _StackCounter()
+        self.samples = 0
+        self._done = threading.Event()
+        self._thread = None
+
+    def _folded(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[self._folded(frame)] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def write_folded(self, path):
+        """Write `stack count` lines, the input format of flamegraph.pl and speedscope."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+# --- logging ---
+class StructuredFormatter(logging.Formatter):
+    """`time level logger message key=value...` lines, or one JSON object per line.
+
+    Extra fields are passed as extra={'fields': {...}} (see fields()).
+    """
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        extra = getattr(record, 'fields', None) or {}
+        timestamp = datetime.fromtimestamp(record.created, timezone.utc)
+        if self.json_lines:
+            entry = {'ts': timestamp.isoformat(timespec='milliseconds'), 'level': record.levelname,
+                     'logger': record.name, 'msg': record.getMessage()}
+            entry.update(extra)
+            if record.exc_info:
+                entry['exc'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str, ensure_ascii=False)
+        line = f"{timestamp.strftime('%Y-%m-%d %H:%M:%S')} {record.levelname:<7} {record.getMessage()}"
+        if extra:
+            line += ' ' + ' '.join(f'{key}={json.dumps(value, default=str, ensure_ascii=False)}'
+                                   for key, value in extra.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def fields(**values):
+    """extra= argument carrying structured fields, e.g. log.info('...', extra=fields(route='/api/data'))."""
+    return {'fields': values}
+
+
+def configure_logging(level=None, json_lines=None, stream=None):
+    """Send all logging through a queue to a background writer; returns the started QueueListener.
+
+    level and format default to DASHBOARD_LOG_LEVEL (INFO) and
+    DASHBOARD_LOG_FORMAT ('text' or 'json').
+    """
+    level = level or os.environ.get('DASHBOARD_LOG_LEVEL', 'INFO').upper()
+    if json_lines is None:
+        json_lines = os.environ.get('DASHBOARD_LOG_FORMAT', 'text').lower() == 'json'
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(StructuredFormatter(json_lines))
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    return listener
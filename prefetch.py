@@ -0,0 +1,140 @@
+"""
+Background prefetch scheduler for the dashboard server.
+
+Jobs refresh caches on their own interval so request handlers find them warm
+instead of paying BigQuery latency after a TTL expires. Every run is spread
+by random jitter so jobs (and several servers) do not fire in lockstep. A job
+that raises is retried with exponential backoff, capped at max_backoff, and
+at most max_concurrency jobs run at once so prefetching never crowds out
+queries made on behalf of users.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import logging
+import random
+import threading
+import time
+
+DEFAULT_CONCURRENCY = 2
+DEFAULT_JITTER = 0.1
+DEFAULT_MAX_BACKOFF = 600
+
+log = logging.getLogger('dashboard.prefetch')
+
+
+class Job:
+    """A named refresh function and its schedule state."""
+
+    def __init__(self, name, fn, interval, jitter=DEFAULT_JITTER, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max(max_backoff, interval)
+        self.failures = 0
+        self.runs = 0
+        self.running = False
+        self.last_error = None
+        self.last_success = None
+        self.last_duration = None
+
+    def next_delay(self, rng):
+        """Seconds until the next run: the interval on success, exponential backoff after failures."""
+        if self.failures:
+            # Full jitter over the backoff window, never sooner than 1s
+            ceiling = min(self.max_backoff, self.interval * 2 ** self.failures)
+            return max(1.0, rng.uniform(ceiling / 2, ceiling))
+        return self.interval * (1 + rng.uniform(-self.jitter, self.jitter))
+
+    def to_dict(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'running': self.running,
+            'last_success': self.last_success,
+            'last_duration': self.last_duration,
+            'last_error': self.last_error,
+        }
+
+
+class PrefetchScheduler:
+    """Runs registered jobs periodically on a small bounded pool."""
+
+    def __init__(self, max_concurrency=DEFAULT_CONCURRENCY, rng=None):
+        self.max_concurrency = max(1, max_concurrency)
+        self._rng = rng or random.Random()
+        self._lock = threading.Condition()
+        self._queue = []  # (due, seq, job)
+        self._seq = 0
+        self._jobs = {}
+        self._pool = None
+        self._thread = None
+        self._stopped = False
+
+    def add(self, name, fn, interval, initial_delay=0.0, **options):
+        """Register fn() to run every interval seconds, first after initial_delay (plus jitter)."""
+        job = Job(name, fn, interval, **options)
+        with self._lock:
+            self._jobs[name] = job
+            self._push(job, initial_delay + self._rng.uniform(0, job.jitter * interval))
+        return job
+
+    def _push(self, job, delay):
+        self._seq += 1
+        heapq.heappush(self._queue, (time.monotonic() + delay, self._seq, job))
+        self._lock.notify()
+
+    def start(self):
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='prefetch')
+        self._thread = threading.Thread(target=self._loop, name='prefetch-scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _loop(self):
+        with self._lock:
+            while not self._stopped:
+                if not self._queue:
+                    self._lock.wait()
+                    continue
+                due, _, job = self._queue[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._lock.wait(wait)
+                    continue
+                heapq.heappop(self._queue)
+                job.running = True
+                self._pool.submit(self._run, job)
+
+    def _run(self, job):
+        started = time.monotonic()
+        try:
+            job.fn()
+        except Exception as e:
+            job.failures += 1
+            job.last_error = f'{type(e).__name__}: {e}'
+            log.warning(f"⚠️  Prefetch {job.name} failed ({job.failures}x): {e}")
+        else:
+            job.failures = 0
+            job.last_error = None
+            job.last_success = time.time()
+        finally:
+            job.runs += 1
+            job.running = False
+            job.last_duration = round(time.monotonic() - started, 3)
+            with self._lock:
+                if not self._stopped:
+                    self._push(job, job.next_delay(self._rng))
+
+    def stats(self, prefix=''):
+        """State of every job, or of those whose name starts with prefix."""
+        with self._lock:
+            return {name: job.to_dict() for name, job in self._jobs.items() if name.startswith(prefix)}
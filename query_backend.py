@@ -0,0 +1,945 @@
+"""
+Query backends for the K-12 Network Telemetry dashboard tools.
+
+dashboard-server.py and fetch-data.py run the same named queries through a
+QueryBackend instead of forking the bq CLI themselves:
+
+- BigQueryClientBackend keeps one long-lived google-cloud-bigquery client
+  (and its pooled HTTP connections) for the whole process.
+- BqCliBackend shells out to whichever `bq` is on PATH (or BQ_BIN) and is only
+  used when the client library is not installed.
+- SQLiteBackend is a local stand-in seeded from telemetry_data.json so the
+  dashboard can be run, tested and benchmarked offline.
+- SyntheticBackend serves generated rows from memory with a simulated query
+  latency, for load tests (benchmarks/bench_server.py).
+
+Pick one with create_backend() or the DASHBOARD_BACKEND environment variable.
+"""
+
+from datetime import date, datetime
+import json
+import math
+import os
+import queue
+import random
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+import uuid
+
+from metrics import span
+from synthetic_data import table_rows
+
+DEFAULT_TABLE = 'test-email-467802.telemetry.pubsub_raw'
+DEFAULT_SQLITE_PATH = 'telemetry_local.db'
+DEFAULT_SEED_FILE = 'telemetry_data.json'
+QUERY_TIMEOUT = 30
+# Size and simulated per-query latency of the synthetic backend's table
+DEFAULT_SYNTHETIC_ROWS = 5000
+DEFAULT_SYNTHETIC_LATENCY_MS = 0
+
+
+class QueryError(RuntimeError):
+    """Raised when a backend fails to run a query."""
+
+
+# Named queries in BigQuery standard SQL. {table} is the fully qualified
+# source table; @name placeholders are bound as query parameters.
+BIGQUERY_QUERIES = {
+    'latest_rows': """
+        SELECT
+            ingestReceivedAt AS publish_time,
+            timestamp AS test_timestamp,
+            trigger,
+            durationMs,
+            version,
+            speed,
+            reachability,
+            device,
+            ingestSourceIp,
+            requestId
+        FROM `{table}`
+        ORDER BY ingestReceivedAt DESC
+        LIMIT @limit
+    """,
+    'rows_since': """
+        SELECT
+            ingestReceivedAt AS publish_time,
+            timestamp AS test_timestamp,
+            trigger,
+            durationMs,
+            version,
+            speed,
+            reachability,
+            device,
+            ingestSourceIp,
+            requestId
+        FROM `{table}`
+        WHERE ingestReceivedAt > TIMESTAMP(@since_ts)
+           OR (ingestReceivedAt = TIMESTAMP(@since_ts) AND IFNULL(requestId, '') > @since_id)
+        ORDER BY ingestReceivedAt, requestId
+        LIMIT @limit
+    """,
+    'rows_between': """
+        SELECT
+            ingestReceivedAt AS publish_time,
+            timestamp AS test_timestamp,
+            trigger,
+            durationMs,
+            version,
+            speed,
+            reachability,
+            device,
+            ingestSourceIp,
+            requestId
+        FROM `{table}`
+        WHERE ingestReceivedAt >= TIMESTAMP(@start_ts)
+          AND ingestReceivedAt < TIMESTAMP(@end_ts)
+          AND (@after_ts = '' OR ingestReceivedAt > SAFE_CAST(@after_ts AS TIMESTAMP)
+               OR (ingestReceivedAt = SAFE_CAST(@after_ts AS TIMESTAMP) AND IFNULL(requestId, '') > @after_id))
+        ORDER BY ingestReceivedAt, requestId
+        LIMIT @limit
+    """,
+    'raw_rows': """
+        SELECT ingestReceivedAt, trigger, speed, reachability, device, requestId
+        FROM `{table}`
+        WHERE (@since_ts = '' OR ingestReceivedAt >= SAFE_CAST(@since_ts AS TIMESTAMP))
+          AND (@until_ts = '' OR ingestReceivedAt < SAFE_CAST(@until_ts AS TIMESTAMP))
+          AND (@before_ts = '' OR ingestReceivedAt < SAFE_CAST(@before_ts AS TIMESTAMP)
+               OR (ingestReceivedAt = SAFE_CAST(@before_ts AS TIMESTAMP) AND IFNULL(requestId, '') < @before_id))
+          AND (@trigger = '' OR trigger = @trigger)
+          AND (@version = '' OR version = @version)
+          AND (@isp_provider = '' OR JSON_VALUE(device, '$.isp.provider') = @isp_provider)
+          AND (@city = '' OR JSON_VALUE(device, '$.isp.city') = @city)
+          AND (@device_type = '' OR JSON_VALUE(device, '$.device.type') = @device_type)
+        ORDER BY ingestReceivedAt DESC, requestId DESC
+        LIMIT @limit
+    """,
+    'reachability_summary': """
+        WITH expanded AS (
+          SELECT
+            JSON_VALUE(r,'$.url') AS url,
+            JSON_VALUE(r,'$.ok') = 'true' AS ok,
+            CAST(JSON_VALUE(r,'$.latencyMs') AS FLOAT64) AS latency_ms,
+            ingestReceivedAt AS ts
+          FROM `{table}`,
+          UNNEST(JSON_QUERY_ARRAY(reachability, '$.results')) r
+          WHERE ingestReceivedAt >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+        )
+        SELECT
+          url,
+          COUNT(*) total_checks,
+          SUM(CASE WHEN ok THEN 1 ELSE 0 END) ok_checks,
+          ROUND(100 * SUM(CASE WHEN ok THEN 1 ELSE 0 END)/COUNT(*),2) AS availability_pct,
+          ROUND(AVG(latency_ms),2) AS avg_latency_ms,
+          ROUND(MAX(latency_ms),2) AS max_latency_ms,
+          ROUND(MIN(latency_ms),2) AS min_latency_ms,
+          MAX(ts) AS last_seen
+        FROM expanded
+        GROUP BY url
+        ORDER BY availability_pct ASC, url
+    """,
+    'reachability_site': """
+        SELECT
+          ingestReceivedAt AS ts,
+          requestId,
+          JSON_VALUE(r,'$.url') AS url,
+          JSON_VALUE(r,'$.ok') = 'true' AS ok,
+          JSON_VALUE(r,'$.error') AS error,
+          CAST(JSON_VALUE(r,'$.status') AS INT64) AS status,
+          CAST(JSON_VALUE(r,'$.latencyMs') AS FLOAT64) AS latency_ms
+        FROM `{table}`,
+        UNNEST(JSON_QUERY_ARRAY(reachability, '$.results')) r
+        WHERE JSON_VALUE(r,'$.url') = @url
+          AND (@before_ts = '' OR ingestReceivedAt < SAFE_CAST(@before_ts AS TIMESTAMP)
+               OR (ingestReceivedAt = SAFE_CAST(@before_ts AS TIMESTAMP) AND IFNULL(requestId, '') < @before_id))
+        ORDER BY ts DESC, requestId DESC
+        LIMIT @limit
+    """,
+    'recent_devices': """
+        SELECT ingestReceivedAt as publish_time,
+               device as device_info,
+               trigger
+        FROM `{table}`
+        WHERE DATE(ingestReceivedAt) >= DATE_SUB(CURRENT_DATE(), INTERVAL @days DAY)
+        ORDER BY ingestReceivedAt DESC
+        LIMIT @limit
+    """,
+    'summary_stats': """
+        SELECT
+            COUNT(*) as total_tests,
+            AVG(CAST(JSON_EXTRACT_SCALAR(speed, '$.downloadMbps') AS FLOAT64)) as avg_download,
+            AVG(CAST(JSON_EXTRACT_SCALAR(speed, '$.uploadMbps') AS FLOAT64)) as avg_upload,
+            AVG(CAST(JSON_EXTRACT_SCALAR(speed, '$.pingMs') AS FLOAT64)) as avg_ping,
+            COUNT(DISTINCT ingestSourceIp) as unique_devices
+        FROM `{table}`
+        WHERE DATE(ingestReceivedAt) >= DATE_SUB(CURRENT_DATE(), INTERVAL @days DAY)
+            AND speed IS NOT NULL
+    """,
+    # Hourly rollup table ({table}_hourly) maintained by rollup_tables.py
+    'rollup_create': """
+        CREATE TABLE IF NOT EXISTS `{table}_hourly` (
+            hour TIMESTAMP NOT NULL,
+            isp_provider STRING,
+            city STRING,
+            device_make STRING,
+            device_type STRING,
+            device_os STRING,
+            tests INT64,
+            download_sum FLOAT64,
+            download_n INT64,
+            upload_sum FLOAT64,
+            upload_n INT64,
+            ping_sum FLOAT64,
+            ping_n INT64,
+            download_failed INT64,
+            ping_failed INT64,
+            sites_ok INT64,
+            sites_total INT64,
+            download_sketch ARRAY<STRUCT<bucket INT64, n INT64>>,
+            upload_sketch ARRAY<STRUCT<bucket INT64, n INT64>>,
+            ping_sketch ARRAY<STRUCT<bucket INT64, n INT64>>
+        )
+        PARTITION BY DATE(hour)
+        CLUSTER BY isp_provider, city, device_type
+    """,
+    'rollup_watermark': """
+        SELECT MAX(hour) AS hour FROM `{table}_hourly`
+    """,
+    # Replaces the rollup rows of [start_ts, end_ts) in one atomic statement
+    'rollup_refresh': """
+        MERGE `{table}_hourly` T
+        USING (
+          WITH tests AS (
+            SELECT
+              TIMESTAMP_TRUNC(ingestReceivedAt, HOUR) AS hour,
+              COALESCE(NULLIF(JSON_VALUE(device, '$.isp.provider'), ''), 'Unknown') AS isp_provider,
+              COALESCE(NULLIF(JSON_VALUE(device, '$.isp.city'), ''), 'Unknown') AS city,
+              COALESCE(NULLIF(JSON_VALUE(device, '$.device.make'), ''), 'Unknown') AS device_make,
+              COALESCE(NULLIF(JSON_VALUE(device, '$.device.type'), ''), 'Unknown') AS device_type,
+              COALESCE(NULLIF(JSON_VALUE(device, '$.device.os'), ''), 'Unknown') AS device_os,
+              IF(COALESCE(JSON_VALUE(speed, '$.downloadError'), JSON_VALUE(speed, '$.downloadErrorFallback')) IS NOT NULL,
+                 NULL, IFNULL(SAFE_CAST(JSON_VALUE(speed, '$.downloadMbps') AS FLOAT64), 0)) AS download,
+              IFNULL(SAFE_CAST(JSON_VALUE(speed, '$.uploadMbps') AS FLOAT64), 0) AS upload,
+              IF(JSON_VALUE(speed, '$.pingError') IS NOT NULL, NULL,
+                 IFNULL(SAFE_CAST(COALESCE(JSON_VALUE(speed, '$.pingMs'), JSON_VALUE(speed, '$.pingms')) AS FLOAT64), 0)) AS ping,
+              (SELECT COUNTIF(JSON_VALUE(r, '$.ok') = 'true'
+                              OR (JSON_VALUE(r, '$.status') = '200' AND JSON_VALUE(r, '$.error') IS NULL))
+               FROM UNNEST(JSON_QUERY_ARRAY(reachability, '$.results')) r) AS sites_ok,
+              IFNULL(ARRAY_LENGTH(JSON_QUERY_ARRAY(reachability, '$.results')), 0) AS sites_total
+            FROM `{table}`
+            WHERE ingestReceivedAt >= TIMESTAMP(@start_ts) AND ingestReceivedAt < TIMESTAMP(@end_ts)
+          ),
+          groups AS (
+            SELECT
+              hour, isp_provider, city, device_make, device_type, device_os,
+              COUNT(*) AS tests,
+              IFNULL(SUM(download), 0) AS download_sum,
+              COUNT(download) AS download_n,
+              IFNULL(SUM(upload), 0) AS upload_sum,
+              COUNT(upload) AS upload_n,
+              IFNULL(SUM(ping), 0) AS ping_sum,
+              COUNT(ping) AS ping_n,
+              COUNTIF(download IS NULL) AS download_failed,
+              COUNTIF(ping IS NULL) AS ping_failed,
+              SUM(sites_ok) AS sites_ok,
+              SUM(sites_total) AS sites_total
+            FROM tests
+            GROUP BY hour, isp_provider, city, device_make, device_type, device_os
+          ),
+          -- QuantileSketch buckets of the positive measurements
+          bins AS (
+            SELECT
+              hour, isp_provider, city, device_make, device_type, device_os, m.metric,
+              CAST(CEIL(SAFE.LN(m.value) / @log_gamma) AS INT64) AS bucket,
+              COUNT(*) AS n
+            FROM tests,
+            UNNEST([STRUCT('download_speed' AS metric, download AS value),
+                    ('upload_speed', upload), ('ping_ms', ping)]) m
+            WHERE m.value > 0
+            GROUP BY hour, isp_provider, city, device_make, device_type, device_os, metric, bucket
+          ),
+          sketches AS (
+            SELECT
+              hour, isp_provider, city, device_make, device_type, device_os,
+              ARRAY_AGG(STRUCT(metric, bucket, n)) AS bins
+            FROM bins
+            GROUP BY hour, isp_provider, city, device_make, device_type, device_os
+          )
+          SELECT
+            g.*,
+            ARRAY(SELECT AS STRUCT bucket, n FROM UNNEST(s.bins) WHERE metric = 'download_speed') AS download_sketch,
+            ARRAY(SELECT AS STRUCT bucket, n FROM UNNEST(s.bins) WHERE metric = 'upload_speed') AS upload_sketch,
+            ARRAY(SELECT AS STRUCT bucket, n FROM UNNEST(s.bins) WHERE metric = 'ping_ms') AS ping_sketch
+          FROM groups g
+          LEFT JOIN sketches s USING (hour, isp_provider, city, device_make, device_type, device_os)
+        ) S
+        ON FALSE
+        WHEN NOT MATCHED BY SOURCE AND T.hour >= TIMESTAMP(@start_ts) AND T.hour < TIMESTAMP(@end_ts) THEN DELETE
+        WHEN NOT MATCHED BY TARGET THEN INSERT ROW
+    """,
+    'rollup_sketches': """
+        SELECT device_type, m.metric, b.bucket, SUM(b.n) AS n
+        FROM `{table}_hourly`,
+        UNNEST([STRUCT('download_speed' AS metric, download_sketch AS bins),
+                ('upload_speed', upload_sketch), ('ping_ms', ping_sketch)]) m,
+        UNNEST(m.bins) b
+        WHERE hour >= TIMESTAMP(@since_ts)
+        GROUP BY device_type, metric, bucket
+    """,
+}
+
+# The same named queries in SQLite's dialect (JSON1 functions, :name params).
+SQLITE_QUERIES = {
+    'latest_rows': """
+        SELECT
+            ingestReceivedAt AS publish_time,
+            timestamp AS test_timestamp,
+            trigger,
+            durationMs,
+            version,
+            speed,
+            reachability,
+            device,
+            ingestSourceIp,
+            requestId
+        FROM {table}
+        ORDER BY ingestReceivedAt DESC
+        LIMIT :limit
+    """,
+    'rows_since': """
+        SELECT
+            ingestReceivedAt AS publish_time,
+            timestamp AS test_timestamp,
+            trigger,
+            durationMs,
+            version,
+            speed,
+            reachability,
+            device,
+            ingestSourceIp,
+            requestId
+        FROM {table}
+        WHERE ingestReceivedAt > :since_ts
+           OR (ingestReceivedAt = :since_ts AND COALESCE(requestId, '') > :since_id)
+        ORDER BY ingestReceivedAt, requestId
+        LIMIT :limit
+    """,
+    'rows_between': """
+        SELECT
+            ingestReceivedAt AS publish_time,
+            timestamp AS test_timestamp,
+            trigger,
+            durationMs,
+            version,
+            speed,
+            reachability,
+            device,
+            ingestSourceIp,
+            requestId
+        FROM {table}
+        WHERE ingestReceivedAt >= :start_ts
+          AND ingestReceivedAt < :end_ts
+          AND (:after_ts = '' OR ingestReceivedAt > :after_ts
+               OR (ingestReceivedAt = :after_ts AND COALESCE(requestId, '') > :after_id))
+        ORDER BY ingestReceivedAt, requestId
+        LIMIT :limit
+    """,
+    'raw_rows': """
+        SELECT ingestReceivedAt, trigger, speed, reachability, device, requestId
+        FROM {table}
+        WHERE (:since_ts = '' OR ingestReceivedAt >= :since_ts)
+          AND (:until_ts = '' OR ingestReceivedAt < :until_ts)
+          AND (:before_ts = '' OR ingestReceivedAt < :before_ts
+               OR (ingestReceivedAt = :before_ts AND COALESCE(requestId, '') < :before_id))
+          AND (:trigger = '' OR trigger = :trigger)
+          AND (:version = '' OR version = :version)
+          AND (:isp_provider = '' OR (json_valid(device) AND json_extract(device, '$.isp.provider') = :isp_provider))
+          AND (:city = '' OR (json_valid(device) AND json_extract(device, '$.isp.city') = :city))
+          AND (:device_type = '' OR (json_valid(device) AND json_extract(device, '$.device.type') = :device_type))
+        ORDER BY ingestReceivedAt DESC, requestId DESC
+        LIMIT :limit
+    """,
+    'reachability_summary': """
+        WITH expanded AS (
+          SELECT
+            json_extract(r.value, '$.url') AS url,
+            json_extract(r.value, '$.ok') = 1 AS ok,
+            CAST(json_extract(r.value, '$.latencyMs') AS REAL) AS latency_ms,
+            p.ingestReceivedAt AS ts
+          FROM {table} p,
+          json_each(CASE WHEN json_valid(p.reachability) THEN p.reachability END, '$.results') r
+          WHERE p.ingestReceivedAt >= datetime('now', '-' || :days || ' days')
+        )
+        SELECT
+          url,
+          COUNT(*) AS total_checks,
+          SUM(CASE WHEN ok THEN 1 ELSE 0 END) AS ok_checks,
+          ROUND(100.0 * SUM(CASE WHEN ok THEN 1 ELSE 0 END) / COUNT(*), 2) AS availability_pct,
+          ROUND(AVG(latency_ms), 2) AS avg_latency_ms,
+          ROUND(MAX(latency_ms), 2) AS max_latency_ms,
+          ROUND(MIN(latency_ms), 2) AS min_latency_ms,
+          MAX(ts) AS last_seen
+        FROM expanded
+        GROUP BY url
+        ORDER BY availability_pct ASC, url
+    """,
+    'reachability_site': """
+        SELECT
+          p.ingestReceivedAt AS ts,
+          p.requestId,
+          json_extract(r.value, '$.url') AS url,
+          json_extract(r.value, '$.ok') = 1 AS ok,
+          json_extract(r.value, '$.error') AS error,
+          CAST(json_extract(r.value, '$.status') AS INTEGER) AS status,
+          CAST(json_extract(r.value, '$.latencyMs') AS REAL) AS latency_ms
+        FROM {table} p,
+        json_each(CASE WHEN json_valid(p.reachability) THEN p.reachability END, '$.results') r
+        WHERE json_extract(r.value, '$.url') = :url
+          AND (:before_ts = '' OR p.ingestReceivedAt < :before_ts
+               OR (p.ingestReceivedAt = :before_ts AND COALESCE(p.requestId, '') < :before_id))
+        ORDER BY ts DESC, p.requestId DESC
+        LIMIT :limit
+    """,
+    'recent_devices': """
+        SELECT ingestReceivedAt AS publish_time,
+               device AS device_info,
+               trigger
+        FROM {table}
+        WHERE date(ingestReceivedAt) >= date('now', '-' || :days || ' days')
+        ORDER BY ingestReceivedAt DESC
+        LIMIT :limit
+    """,
+    'summary_stats': """
+        SELECT
+            COUNT(*) AS total_tests,
+            AVG(CAST(json_extract(speed, '$.downloadMbps') AS REAL)) AS avg_download,
+            AVG(CAST(json_extract(speed, '$.uploadMbps') AS REAL)) AS avg_upload,
+            AVG(CAST(json_extract(speed, '$.pingMs') AS REAL)) AS avg_ping,
+            COUNT(DISTINCT ingestSourceIp) AS unique_devices
+        FROM {table}
+        WHERE date(ingestReceivedAt) >= date('now', '-' || :days || ' days')
+            AND speed IS NOT NULL
+            AND json_valid(speed)
+    """,
+    # Local rollup table; CEIL/LN are registered by SQLiteBackend when SQLite lacks them
+    'rollup_create': """
+        CREATE TABLE IF NOT EXISTS {table}_hourly (
+            hour TEXT NOT NULL,
+            isp_provider TEXT NOT NULL,
+            city TEXT NOT NULL,
+            device_make TEXT NOT NULL,
+            device_type TEXT NOT NULL,
+            device_os TEXT NOT NULL,
+            tests INTEGER,
+            download_sum REAL,
+            download_n INTEGER,
+            upload_sum REAL,
+            upload_n INTEGER,
+            ping_sum REAL,
+            ping_n INTEGER,
+            download_failed INTEGER,
+            ping_failed INTEGER,
+            sites_ok INTEGER,
+            sites_total INTEGER,
+            download_sketch TEXT,
+            upload_sketch TEXT,
+            ping_sketch TEXT,
+            PRIMARY KEY (hour, isp_provider, city, device_make, device_type, device_os)
+        )
+    """,
+    'rollup_watermark': """
+        SELECT MAX(hour) AS hour FROM {table}_hourly
+    """,
+    # Rows are only ever added to the local table, so replacing the groups
+    # found in [start_ts, end_ts) brings those hours up to date
+    'rollup_refresh': """
+        INSERT OR REPLACE INTO {table}_hourly
+        WITH tests AS (
+          SELECT
+            strftime('%Y-%m-%d %H:00:00', ingestReceivedAt) AS hour,
+            COALESCE(NULLIF(json_extract(d.device, '$.isp.provider'), ''), 'Unknown') AS isp_provider,
+            COALESCE(NULLIF(json_extract(d.device, '$.isp.city'), ''), 'Unknown') AS city,
+            COALESCE(NULLIF(json_extract(d.device, '$.device.make'), ''), 'Unknown') AS device_make,
+            COALESCE(NULLIF(json_extract(d.device, '$.device.type'), ''), 'Unknown') AS device_type,
+            COALESCE(NULLIF(json_extract(d.device, '$.device.os'), ''), 'Unknown') AS device_os,
+            CASE WHEN COALESCE(json_extract(d.speed, '$.downloadError'),
+                               json_extract(d.speed, '$.downloadErrorFallback')) IS NOT NULL THEN NULL
+                 ELSE COALESCE(CAST(json_extract(d.speed, '$.downloadMbps') AS REAL), 0) END AS download,
+            COALESCE(CAST(json_extract(d.speed, '$.uploadMbps') AS REAL), 0) AS upload,
+            CASE WHEN json_extract(d.speed, '$.pingError') IS NOT NULL THEN NULL
+                 ELSE COALESCE(CAST(COALESCE(json_extract(d.speed, '$.pingMs'),
+                                             json_extract(d.speed, '$.pingms')) AS REAL), 0) END AS ping,
+            (SELECT COUNT(*) FROM json_each(d.reachability, '$.results') r
+             WHERE json_extract(r.value, '$.ok') = 1
+                OR (json_extract(r.value, '$.status') = 200 AND json_extract(r.value, '$.error') IS NULL)) AS sites_ok,
+            COALESCE(json_array_length(d.reachability, '$.results'), 0) AS sites_total
+          FROM (
+            SELECT ingestReceivedAt,
+                   CASE WHEN json_valid(device) THEN device END AS device,
+                   CASE WHEN json_valid(speed) THEN speed END AS speed,
+                   CASE WHEN json_valid(reachability) THEN reachability END AS reachability
+            FROM {table}
+            WHERE ingestReceivedAt >= :start_ts AND ingestReceivedAt < :end_ts
+          ) d
+        ),
+        groups AS (
+          SELECT
+            hour, isp_provider, city, device_make, device_type, device_os,
+            COUNT(*) AS tests,
+            TOTAL(download) AS download_sum,
+            COUNT(download) AS download_n,
+            TOTAL(upload) AS upload_sum,
+            COUNT(upload) AS upload_n,
+            TOTAL(ping) AS ping_sum,
+            COUNT(ping) AS ping_n,
+            SUM(download IS NULL) AS download_failed,
+            SUM(ping IS NULL) AS ping_failed,
+            SUM(sites_ok) AS sites_ok,
+            SUM(sites_total) AS sites_total
+          FROM tests
+          GROUP BY hour, isp_provider, city, device_make, device_type, device_os
+        ),
+        -- QuantileSketch buckets of the positive measurements, as JSON objects of bucket: n
+        bins AS (
+          SELECT hour, isp_provider, city, device_make, device_type, device_os, metric,
+                 CAST(CEIL(LN(value) / :log_gamma) AS INTEGER) AS bucket, COUNT(*) AS n
+          FROM (
+            SELECT hour, isp_provider, city, device_make, device_type, device_os,
+                   'download_speed' AS metric, download AS value FROM tests
+            UNION ALL
+            SELECT hour, isp_provider, city, device_make, device_type, device_os, 'upload_speed', upload FROM tests
+            UNION ALL
+            SELECT hour, isp_provider, city, device_make, device_type, device_os, 'ping_ms', ping FROM tests
+          )
+          WHERE value > 0
+          GROUP BY hour, isp_provider, city, device_make, device_type, device_os, metric, bucket
+        ),
+        sketches AS (
+          SELECT
+            hour, isp_provider, city, device_make, device_type, device_os,
+            MAX(CASE WHEN metric = 'download_speed' THEN bins END) AS download_sketch,
+            MAX(CASE WHEN metric = 'upload_speed' THEN bins END) AS upload_sketch,
+            MAX(CASE WHEN metric = 'ping_ms' THEN bins END) AS ping_sketch
+          FROM (
+            SELECT hour, isp_provider, city, device_make, device_type, device_os, metric,
+                   json_group_object(bucket, n) AS bins
+            FROM bins
+            GROUP BY hour, isp_provider, city, device_make, device_type, device_os, metric
+          )
+          GROUP BY hour, isp_provider, city, device_make, device_type, device_os
+        )
+        SELECT g.*, s.download_sketch, s.upload_sketch, s.ping_sketch
+        FROM groups g
+        LEFT JOIN sketches s USING (hour, isp_provider, city, device_make, device_type, device_os)
+    """,
+    'rollup_sketches': """
+        SELECT h.device_type, m.metric, CAST(b.key AS INTEGER) AS bucket, SUM(b.value) AS n
+        FROM {table}_hourly h,
+        (SELECT 'download_speed' AS metric UNION ALL SELECT 'upload_speed' UNION ALL SELECT 'ping_ms') m,
+        json_each(CASE m.metric WHEN 'download_speed' THEN h.download_sketch
+                                WHEN 'upload_speed' THEN h.upload_sketch
+                                ELSE h.ping_sketch END) b
+        WHERE h.hour >= :since_ts
+        GROUP BY h.device_type, m.metric, bucket
+    """,
+}
+
+# Summed columns of the hourly rollup table, in table order
+ROLLUP_SUMS = ('tests', 'download_sum', 'download_n', 'upload_sum', 'upload_n', 'ping_sum', 'ping_n',
+               'download_failed', 'ping_failed', 'sites_ok', 'sites_total')
+# Report queries over the rollup table: name -> grouping columns
+ROLLUP_GROUPINGS = {
+    'rollup_isp_city': ('isp_provider', 'city'),
+    'rollup_devices': ('device_make', 'device_type', 'device_os'),
+    'rollup_isp_device_type': ('isp_provider', 'device_type'),
+    'rollup_hours': ('hour',),
+}
+
+
+def _rollup_grouping_query(columns, table, since):
+    """SQL summing the rollup rows since a start hour, grouped by columns."""
+    groups = ', '.join(columns)
+    sums = ', '.join(f'SUM({column}) AS {column}' for column in ROLLUP_SUMS)
+    return f"""
+        SELECT {groups}, {sums}
+        FROM {table}
+        WHERE hour >= {since}
+        GROUP BY {groups}
+    """
+
+
+for _name, _columns in ROLLUP_GROUPINGS.items():
+    BIGQUERY_QUERIES[_name] = _rollup_grouping_query(_columns, '`{table}_hourly`', 'TIMESTAMP(@since_ts)')
+    SQLITE_QUERIES[_name] = _rollup_grouping_query(_columns, '{table}_hourly', ':since_ts')
+
+
+
+def _format_value(value):
+    """Render values the way `bq --format=json` does, so every backend agrees."""
+    if isinstance(value, datetime):
+        return str(value.replace(tzinfo=None))
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+class QueryBackend:
+    """Base class: runs named queries against the telemetry table."""
+
+    name = 'base'
+    queries = {}
+
+    def __init__(self, table=None):
+        self.table = table or os.environ.get('TELEMETRY_TABLE', DEFAULT_TABLE)
+
+    def render(self, name):
+        """Return the SQL text of a named query for this backend."""
+        try:
+            return self.queries[name].format(table=self.table)
+        except KeyError:
+            raise QueryError(f'unknown query {name!r}') from None
+
+    def run(self, name, **params):
+        """Run a named query and return its rows as a list of dicts."""
+        return self.query(self.render(name), params)
+
+    def query(self, sql, params=None):
+        raise NotImplementedError
+
+    def check_access(self):
+        """Return (ok, message) describing whether the table is reachable."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _bq_type(value):
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, int):
+        return 'INT64'
+    if isinstance(value, float):
+        return 'FLOAT64'
+    if isinstance(value, datetime):
+        return 'TIMESTAMP'
+    return 'STRING'
+
+
+class BigQueryClientBackend(QueryBackend):
+    """Runs queries through one shared google-cloud-bigquery client.
+
+    The client authenticates once and reuses its HTTP connection pool for
+    every query, so there is no per-query process or auth startup cost.
+    """
+
+    name = 'bigquery'
+    queries = BIGQUERY_QUERIES
+
+    def __init__(self, table=None, pool_size=16, project=None):
+        super().__init__(table)
+        from google.cloud import bigquery  # optional dependency
+        self._bigquery = bigquery
+        self.client = bigquery.Client(project=project or self.table.split('.')[0])
+        self._size_connection_pool(pool_size)
+
+    def _size_connection_pool(self, pool_size):
+        # The client's AuthorizedSession defaults to 10 pooled connections;
+        # match it to the number of threads that may query at once.
+        session = getattr(self.client, '_http', None)
+        if session is None or not hasattr(session, 'mount'):
+            return
+        try:
+            from requests.adapters import HTTPAdapter
+        except ImportError:
+            return
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+
+    def _job_config(self, params):
+        bq = self._bigquery
+        return bq.QueryJobConfig(query_parameters=[
+            bq.ScalarQueryParameter(name, _bq_type(value), value)
+            for name, value in (params or {}).items()
+        ])
+
+    def query(self, sql, params=None):
+        try:
+            with span('query'):
+                job = self.client.query(sql, job_config=self._job_config(params))
+                rows = list(job.result(timeout=QUERY_TIMEOUT))
+            with span('decode'):
+                return [{key: _format_value(value) for key, value in row.items()} for row in rows]
+        except Exception as e:
+            raise QueryError(str(e)) from e
+
+    def check_access(self):
+        try:
+            self.client.get_table(self.table)
+            return True, f'table {self.table} is accessible'
+        except Exception as e:
+            return False, str(e)
+
+    def close(self):
+        self.client.close()
+
+
+class BqCliBackend(QueryBackend):
+    """Runs queries with the `bq` command-line tool, one process per query."""
+
+    name = 'bq-cli'
+    queries = BIGQUERY_QUERIES
+
+    def __init__(self, table=None, bq_bin=None, max_rows=10000):
+        super().__init__(table)
+        self.bq_bin = bq_bin or os.environ.get('BQ_BIN') or shutil.which('bq') or 'bq'
+        self.max_rows = max_rows
+
+    def query(self, sql, params=None):
+        cmd = [self.bq_bin, 'query', '--use_legacy_sql=false', '--format=json',
+               f'--max_rows={self.max_rows}']
+        for name, value in (params or {}).items():
+            cmd.append(f'--parameter={name}:{_bq_type(value)}:{value}')
+        cmd.append(sql)
+        try:
+            with span('subprocess'):
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=QUERY_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise QueryError(str(e)) from e
+        if result.returncode != 0:
+            raise QueryError(result.stderr.strip())
+        try:
+            with span('json_parse'):
+                return json.loads(result.stdout) if result.stdout.strip() else []
+        except json.JSONDecodeError as e:
+            raise QueryError(f'unreadable bq output: {e}') from e
+
+    def check_access(self):
+        project, dataset = self.table.split('.')[:2]
+        try:
+            result = subprocess.run([self.bq_bin, 'ls', f'{project}:{dataset}'],
+                                    capture_output=True, text=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return False, str(e)
+        if result.returncode != 0:
+            return False, result.stderr.strip()
+        return True, f'dataset {project}:{dataset} is accessible'
+
+
+def _raw_row_from_record(record):
+    """Rebuild a pubsub_raw-shaped row from an enriched dashboard record."""
+    def known(value):
+        return None if value in (None, 'Unknown') else value
+
+    speed = {}
+    for key, field, error_key in (('downloadMbps', 'download_speed', 'downloadError'),
+                                  ('uploadMbps', 'upload_speed', 'uploadError'),
+                                  ('pingMs', 'ping_ms', 'pingError')):
+        value = record.get(field)
+        if value == 'Failed':
+            speed[error_key] = 'Failed'
+        elif value is not None:
+            speed[key] = value
+    device = {
+        'device': {
+            'make': known(record.get('device_make')),
+            'type': known(record.get('device_type')),
+            'os': known(record.get('device_os')),
+            'osVersion': known(record.get('device_os_version')),
+        },
+        'isp': {
+            'provider': known(record.get('isp_provider')),
+            'city': known(record.get('city')),
+        },
+    }
+    if record.get('user_email'):
+        device['user'] = {'email': record['user_email']}
+    return {
+        'ingestReceivedAt': record.get('publish_time'),
+        'timestamp': record.get('publish_time'),
+        'trigger': record.get('trigger'),
+        'durationMs': record.get('duration_ms'),
+        'version': record.get('version'),
+        'speed': speed,
+        # Enriched records only keep site counts; per-site results cannot be rebuilt
+        'reachability': {'results': []},
+        'device': device,
+        'ingestSourceIp': None,
+        'requestId': record.get('request_id'),
+    }
+
+
+def _add_math_functions(conn):
+    """Register LN and CEIL (used by rollup_refresh) when SQLite was built without them."""
+    try:
+        conn.execute('SELECT CEIL(LN(2))')
+    except sqlite3.OperationalError:
+        conn.create_function('ln', 1, math.log, deterministic=True)
+        conn.create_function('ceil', 1, math.ceil, deterministic=True)
+
+
+class SQLiteBackend(QueryBackend):
+    """Local stand-in for the BigQuery table, backed by a SQLite file.
+
+    Connections come from a small fixed pool shared by all threads. An empty
+    database is seeded from seed_file, which may hold raw pubsub_raw rows or
+    the enriched records written by the dashboard.
+    """
+
+    name = 'sqlite'
+    queries = SQLITE_QUERIES
+    COLUMNS = ('ingestReceivedAt', 'timestamp', 'trigger', 'durationMs', 'version',
+               'speed', 'reachability', 'device', 'ingestSourceIp', 'requestId')
+
+    def __init__(self, path=None, seed_file=DEFAULT_SEED_FILE, pool_size=4, table='pubsub_raw'):
+        super().__init__(table)
+        self.path = path or os.environ.get('DASHBOARD_SQLITE_PATH', DEFAULT_SQLITE_PATH)
+        self._pool = queue.Queue()
+        self._all = []
+        self._pool_lock = threading.Lock()
+        for _ in range(max(1, pool_size)):
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=QUERY_TIMEOUT,
+                                   uri=self.path.startswith('file:'))
+            conn.row_factory = sqlite3.Row
+            _add_math_functions(conn)
+            self._all.append(conn)
+            self._pool.put(conn)
+        self._create_schema()
+        if seed_file and os.path.exists(seed_file) and self.count() == 0:
+            with open(seed_file, 'r') as f:
+                self.insert_rows(json.load(f))
+
+    def _acquire(self):
+        return self._pool.get(timeout=QUERY_TIMEOUT)
+
+    def _release(self, conn):
+        self._pool.put(conn)
+
+    def _create_schema(self):
+        conn = self._acquire()
+        try:
+            cols = ', '.join(f'{c} TEXT' for c in self.COLUMNS)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} ({cols})')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_received ON {self.table} (ingestReceivedAt)')
+            conn.commit()
+        finally:
+            self._release(conn)
+
+    def insert_rows(self, rows):
+        """Insert raw rows or enriched records into the local table."""
+        values = []
+        for row in rows:
+            if not isinstance(row, dict):
+                continue
+            if 'ingestReceivedAt' not in row and 'publish_time' in row:
+                row = _raw_row_from_record(row)
+            values.append(tuple(
+                json.dumps(row.get(c)) if isinstance(row.get(c), (dict, list)) else row.get(c)
+                for c in self.COLUMNS
+            ))
+        conn = self._acquire()
+        try:
+            placeholders = ', '.join('?' for _ in self.COLUMNS)
+            conn.executemany(f'INSERT INTO {self.table} VALUES ({placeholders})', values)
+            conn.commit()
+        finally:
+            self._release(conn)
+        return len(values)
+
+    def count(self):
+        return self.query(f'SELECT COUNT(*) AS n FROM {self.table}')[0]['n']
+
+    def query(self, sql, params=None):
+        conn = self._acquire()
+        try:
+            with span('query'):
+                return self._execute(conn, sql, params)
+        except sqlite3.Error as e:
+            raise QueryError(str(e)) from e
+        finally:
+            self._release(conn)
+
+    def _execute(self, conn, sql, params):
+        cursor = conn.execute(sql, params or {})
+        rows = [{key: row[key] for key in row.keys()} for row in cursor.fetchall()]
+        if conn.in_transaction:
+            conn.commit()  # rollup_create / rollup_refresh write to the database
+        return rows
+
+    def check_access(self):
+        try:
+            return True, f'{self.count()} rows in {self.path}'
+        except QueryError as e:
+            return False, str(e)
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
+
+
+class SyntheticBackend(SQLiteBackend):
+    """Offline backend serving synthetic pubsub_raw rows with a simulated query latency.
+
+    Rows come from synthetic_data.py and live in a private in-memory SQLite
+    database, so every named query works. Each query then waits latency
+    seconds (spread by +/- jitter) to stand in for a BigQuery round trip.
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, rows=None, latency=None, jitter=0.2, pool_size=4, table='pubsub_raw', seed=0):
+        if rows is None:
+            rows = int(os.environ.get('DASHBOARD_SYNTHETIC_ROWS', DEFAULT_SYNTHETIC_ROWS))
+        if latency is None:
+            latency = float(os.environ.get('DASHBOARD_SYNTHETIC_LATENCY_MS', DEFAULT_SYNTHETIC_LATENCY_MS)) / 1000
+        self.latency = latency
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        path = f'file:synthetic-{uuid.uuid4().hex}?mode=memory&cache=shared'
+        super().__init__(path=path, seed_file=None, pool_size=pool_size, table=table)
+        self.insert_rows(table_rows(rows, seed=seed))
+        self.rows = rows
+
+    def _execute(self, conn, sql, params):
+        if self.latency > 0:
+            time.sleep(self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+        return super()._execute(conn, sql, params)
+
+    def check_access(self):
+        return True, f'{self.rows} synthetic rows, {self.latency * 1000:.0f} ms simulated latency'
+
+
+BACKENDS = {
+    'bigquery': BigQueryClientBackend,
+    'bq-cli': BqCliBackend,
+    'sqlite': SQLiteBackend,
+    'synthetic': SyntheticBackend,
+}
+
+
+def create_backend(name=None, table=None, pool_size=16, sqlite_path=None):
+    """Create the query backend called name (or DASHBOARD_BACKEND).
+
+    'auto' prefers the pooled BigQuery client and falls back to the bq CLI
+    when google-cloud-bigquery is not installed. pool_size bounds the number
+    of pooled connections for backends that keep them; sqlite_path overrides
+    DASHBOARD_SQLITE_PATH.
+    """
+    name = name or os.environ.get('DASHBOARD_BACKEND', 'auto')
+    if name == 'auto':
+        try:
+            return BigQueryClientBackend(table=table, pool_size=pool_size)
+        except ImportError:
+            return BqCliBackend(table=table)
+    if name == 'bigquery':
+        return BigQueryClientBackend(table=table, pool_size=pool_size)
+    if name == 'bq-cli':
+        return BqCliBackend(table=table)
+    if name == 'sqlite':
+        return SQLiteBackend(path=sqlite_path, pool_size=min(pool_size, 8))
+    if name == 'synthetic':
+        return SyntheticBackend(pool_size=min(pool_size, 8))
+    raise ValueError(f'unknown backend {name!r}; choose from auto, {", ".join(BACKENDS)}')
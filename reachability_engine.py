@@ -0,0 +1,228 @@
+"""
+In-memory reachability analytics over the per-site checks of enriched records.
+
+ReachabilityEngine keeps, for every checked URL, one bucket per hour with the
+number of checks, how many succeeded, a breakdown by HTTP status and error,
+the latency range and a mergeable QuantileSketch of latencies. Any window is
+answered by merging its buckets, so the reachability panel gets availability,
+p50/p95/p99 latency and last_seen without scanning the raw checks again.
+
+The engine is fed from the store's site_checks column on startup and then
+incrementally as a site-check listener of the sync. Records leaving the
+sync's in-memory window stay counted here: buckets expire by age instead,
+once older than the retention period. Records already counted (by
+request_id) are skipped, so overlapping feeds are safe.
+"""
+
+from collections import Counter
+from datetime import datetime, timezone
+import threading
+import time
+
+from sketches import QuantileSketch
+from telemetry_store import to_epoch
+from telemetry_sync import record_key
+
+BUCKET_SECONDS = 3600
+DEFAULT_RETENTION_DAYS = 7
+# Most frequent errors listed per site
+TOP_ERRORS = 10
+QUANTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+class SiteBucket:
+    """Check counts and latency distribution of one site over one bucket."""
+
+    __slots__ = ('total', 'ok', 'statuses', 'errors', 'latency', 'latency_min', 'latency_max',
+                 'last_seen', 'last_seen_at')
+
+    def __init__(self):
+        self.total = 0
+        self.ok = 0
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.latency = QuantileSketch()
+        self.latency_min = None
+        self.latency_max = None
+        self.last_seen = None     # epoch of the newest check
+        self.last_seen_at = None  # its publish_time, as served by the API
+
+    def add(self, ok, status, latency, error, epoch, publish_time):
+        self.total += 1
+        if ok:
+            self.ok += 1
+        self.statuses[status] += 1
+        if error is not None:
+            self.errors[str(error)] += 1
+        if latency is not None:
+            self.latency.add(latency)
+            self.latency_min = latency if self.latency_min is None else min(self.latency_min, latency)
+            self.latency_max = latency if self.latency_max is None else max(self.latency_max, latency)
+        if self.last_seen is None or epoch > self.last_seen:
+            self.last_seen = epoch
+            self.last_seen_at = publish_time
+
+    def merge(self, other):
+        """Fold another bucket into this one."""
+        self.total += other.total
+        self.ok += other.ok
+        self.statuses.update(other.statuses)
+        self.errors.update(other.errors)
+        self.latency.merge(other.latency)
+        for value in (other.latency_min, other.latency_max):
+            if value is None:
+                continue
+            self.latency_min = value if self.latency_min is None else min(self.latency_min, value)
+            self.latency_max = value if self.latency_max is None else max(self.latency_max, value)
+        if other.last_seen is not None and (self.last_seen is None or other.last_seen > self.last_seen):
+            self.last_seen = other.last_seen
+            self.last_seen_at = other.last_seen_at
+        return self
+
+    def to_dict(self):
+        """Availability and latency figures, in the reachability_summary shape plus percentiles."""
+        out = {
+            'total_checks': self.total,
+            'ok_checks': self.ok,
+            'availability_pct': round(100 * self.ok / self.total, 2) if self.total else None,
+            'avg_latency_ms': _round(self.latency.mean()),
+            'max_latency_ms': _round(self.latency_max),
+            'min_latency_ms': _round(self.latency_min),
+        }
+        for name, q in QUANTILES:
+            out[f'{name}_latency_ms'] = _round(self.latency.quantile(q))
+        out['last_seen'] = self.last_seen_at
+        return out
+
+
+class ReachabilityEngine:
+    """Per-URL rolling buckets of site checks, updated from sync changes."""
+
+    def __init__(self, bucket_seconds=BUCKET_SECONDS, retention_days=DEFAULT_RETENTION_DAYS):
+        self.bucket_seconds = bucket_seconds
+        self.retention = retention_days * 86400
+        self._lock = threading.Lock()
+        self._sites = {}  # url -> {bucket start: SiteBucket}
+        self._seen = {}   # bucket start -> keys of the records counted in it
+        self._expired_before = None
+        self.version = 0
+
+    def __len__(self):
+        return len(self._sites)
+
+    def _bucket_of(self, epoch):
+        return int(epoch // self.bucket_seconds * self.bucket_seconds)
+
+    def update(self, added, site_checks):
+        """Count the site checks of new records (site_checks[i] belongs to added[i]).
+
+        Usable as a sync site-check listener. Records keep counting after
+        they leave the sync's window, until their bucket expires.
+        """
+        self.add(zip(added, site_checks))
+
+    def add(self, checked):
+        """Count (record, site checks) pairs, e.g. from TelemetryStore.iter_site_checks()."""
+        horizon = time.time() - self.retention
+        with self._lock:
+            changed = False
+            for record, checks in checked:
+                publish_time = record.get('publish_time')
+                if not checks or not publish_time:
+                    continue
+                epoch = to_epoch(publish_time)
+                if epoch < horizon:
+                    continue
+                start = self._bucket_of(epoch)
+                seen = self._seen.setdefault(start, set())
+                key = record_key(record)
+                if key in seen:
+                    continue
+                seen.add(key)
+                for url, ok, status, latency, error in checks:
+                    if url is None:
+                        continue
+                    buckets = self._sites.setdefault(url, {})
+                    bucket = buckets.get(start)
+                    if bucket is None:
+                        bucket = buckets[start] = SiteBucket()
+                    bucket.add(ok, status, latency, error, epoch, publish_time)
+                changed = True
+            self._expire(horizon)
+            if changed:
+                self.version += 1
+
+    def _expire(self, horizon):
+        """Drop buckets that ended before horizon; runs at most once per bucket period."""
+        cutoff = self._bucket_of(horizon)
+        if self._expired_before == cutoff:
+            return
+        self._expired_before = cutoff
+        for start in [s for s in self._seen if s < cutoff]:
+            del self._seen[start]
+        for url in list(self._sites):
+            buckets = self._sites[url]
+            for start in [s for s in buckets if s < cutoff]:
+                del buckets[start]
+            if not buckets:
+                del self._sites[url]
+
+    def _window(self, buckets, since):
+        """Merge the buckets overlapping [since, now)."""
+        total = SiteBucket()
+        for start, bucket in buckets.items():
+            if start + self.bucket_seconds > since:
+                total.merge(bucket)
+        return total
+
+    def summary(self, days=DEFAULT_RETENTION_DAYS, now=None):
+        """Per-URL availability and latency over the last `days`, least available first.
+
+        Windows are aligned to whole buckets, so they may reach up to one
+        bucket further back than requested.
+        """
+        since = (now or time.time()) - days * 86400
+        with self._lock:
+            rows = []
+            for url, buckets in self._sites.items():
+                window = self._window(buckets, since)
+                if window.total:
+                    rows.append(dict(url=url, **window.to_dict()))
+        rows.sort(key=lambda row: (row['availability_pct'], row['url']))
+        return rows
+
+    def site(self, url, days=DEFAULT_RETENTION_DAYS, now=None):
+        """Totals, status/error breakdown and an hourly series for one URL, or None if unseen."""
+        since = (now or time.time()) - days * 86400
+        with self._lock:
+            buckets = self._sites.get(url)
+            if buckets is None:
+                return None
+            window = self._window(buckets, since)
+            series = []
+            for start in sorted(buckets):
+                if start + self.bucket_seconds <= since:
+                    continue
+                bucket = buckets[start]
+                entry = {'start': datetime.fromtimestamp(start, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')}
+                entry.update(bucket.to_dict())
+                series.append(entry)
+        out = dict(url=url, days=days, **window.to_dict())
+        out['statuses'] = {'none' if status is None else str(status): n
+                           for status, n in window.statuses.most_common()}
+        out['errors'] = [{'error': error, 'count': n} for error, n in window.errors.most_common(TOP_ERRORS)]
+        out['series'] = series
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sites': len(self._sites),
+                'buckets': sum(len(buckets) for buckets in self._sites.values()),
+                'records': sum(len(keys) for keys in self._seen.values()),
+                'version': self.version,
+            }
@@ -0,0 +1,209 @@
+"""
+In-memory index over the held telemetry records for filtered, paged reads.
+
+RecordIndex keeps the records the incremental sync holds ordered by
+(publish_time, request_id) together with one posting list per value of the
+filterable fields, so /api/data can answer "failed tests on COMCAST in
+Bloomington, newest first" by walking the smallest matching posting list from
+a keyset cursor instead of scanning every record. Pages are bounded by the
+requested limit, whatever the number of records held.
+
+Pages older than the index are read from the local store by page_records(),
+which pushes the equality filters down to the store's columns and examines
+at most MAX_SCAN_ROWS rows per request. A page that hits that cap comes back
+short (possibly empty) with a cursor to continue from, so a filter that
+rarely matches never makes one request walk the whole history.
+"""
+
+import base64
+from bisect import bisect_left, insort
+import json
+import threading
+
+from telemetry_store import FAILED, to_epoch
+from telemetry_sync import record_key
+
+# Fields that can be filtered on with ?field=value
+FILTER_FIELDS = ('isp_provider', 'city', 'device_type', 'trigger', 'version')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Store rows examined per page read beyond the index
+MAX_SCAN_ROWS = 50000
+
+
+def encode_cursor(*parts):
+    """Opaque, URL-safe keyset cursor from the sort key of the last row served."""
+    return base64.urlsafe_b64encode(json.dumps(parts, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(text, types=(float, str)):
+    """Inverse of encode_cursor, coercing each part with `types`; raises ValueError if malformed."""
+    try:
+        parts = json.loads(base64.urlsafe_b64decode(text + '=' * (-len(text) % 4)))
+        if not isinstance(parts, list) or len(parts) != len(types):
+            raise ValueError('wrong shape')
+        return tuple(kind(part) for kind, part in zip(types, parts))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'invalid cursor: {e}') from None
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a ?limit= value, clamped to 1..MAX_PAGE_SIZE."""
+    if value is None:
+        return default
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+
+def sort_key(record):
+    """(epoch, request_id, record_key): newest-first order with request_id tie-break."""
+    return (to_epoch(record['publish_time']), record.get('request_id') or '', record_key(record))
+
+
+def is_failed(record):
+    return record.get('download_speed') == FAILED or record.get('ping_ms') == FAILED
+
+
+class RecordFilter:
+    """Time range, field equality and failed-only conditions on records."""
+
+    def __init__(self, since=None, until=None, fields=None, failed_only=False):
+        self.since = to_epoch(since) if since else None
+        self.until = to_epoch(until) if until else None
+        self.fields = dict(fields or {})
+        self.failed_only = failed_only
+
+    @classmethod
+    def from_query(cls, qs):
+        """Build a filter from parse_qs() output; raises ValueError on bad timestamps."""
+        fields = {name: qs[name][0] for name in FILTER_FIELDS if qs.get(name, [''])[0]}
+        failed = qs.get('failed', ['0'])[0].lower() in ('1', 'true', 'yes')
+        return cls(qs.get('since', [None])[0], qs.get('until', [None])[0], fields, failed)
+
+    def matches(self, record, epoch=None):
+        if epoch is None:
+            epoch = to_epoch(record['publish_time'])
+        if self.since is not None and epoch < self.since:
+            return False
+        if self.until is not None and epoch >= self.until:
+            return False
+        for name, value in self.fields.items():
+            if record.get(name) != value:
+                return False
+        return not self.failed_only or is_failed(record)
+
+
+class RecordIndex:
+    """Sorted keys, records and posting lists, updated from sync changes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []      # ascending sort keys
+        self._records = {}   # sort key -> record
+        self._postings = {name: {} for name in FILTER_FIELDS}  # field -> value -> ascending keys
+        self._failed = []    # ascending keys of records with a failed download or ping
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, added, dropped=()):
+        """Index added records and forget dropped ones. Usable as a sync listener."""
+        with self._lock:
+            for record in added:
+                if not record.get('publish_time'):
+                    continue
+                key = sort_key(record)
+                if key in self._records:
+                    continue
+                self._records[key] = record
+                insort(self._keys, key)
+                for name in FILTER_FIELDS:
+                    insort(self._postings[name].setdefault(record.get(name), []), key)
+                if is_failed(record):
+                    insort(self._failed, key)
+            for record in dropped:
+                if not record.get('publish_time'):
+                    continue
+                key = sort_key(record)
+                if self._records.pop(key, None) is None:
+                    continue
+                _discard(self._keys, key)
+                for name in FILTER_FIELDS:
+                    postings = self._postings[name].get(record.get(name))
+                    if postings is not None:
+                        _discard(postings, key)
+                        if not postings:
+                            del self._postings[name][record.get(name)]
+                if is_failed(record):
+                    _discard(self._failed, key)
+
+    def oldest(self):
+        """Epoch of the oldest indexed record, or None when empty."""
+        with self._lock:
+            return self._keys[0][0] if self._keys else None
+
+    def page(self, record_filter, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """Return (records, next_cursor) for one newest-first page.
+
+        cursor is the (epoch, request_id) of the last row of the previous
+        page; next_cursor is None on the last page.
+        """
+        with self._lock:
+            candidates = self._keys
+            for name, value in record_filter.fields.items():
+                postings = self._postings[name].get(value, [])
+                if len(postings) < len(candidates):
+                    candidates = postings
+            if record_filter.failed_only and len(self._failed) < len(candidates):
+                candidates = self._failed
+            bounds = []
+            if cursor is not None:
+                bounds.append(tuple(cursor))
+            if record_filter.until is not None:
+                bounds.append((record_filter.until,))
+            hi = bisect_left(candidates, min(bounds)) if bounds else len(candidates)
+            out = []
+            last = None
+            for i in range(hi - 1, -1, -1):
+                key = candidates[i]
+                if record_filter.since is not None and key[0] < record_filter.since:
+                    break
+                record = self._records[key]
+                if not record_filter.matches(record, key[0]):
+                    continue
+                if len(out) == limit:
+                    return out, encode_cursor(last[0], last[1])
+                out.append(record)
+                last = key
+            return out, None
+
+
+def page_records(store, record_filter, cursor=None, limit=DEFAULT_PAGE_SIZE, until=None, max_scan=MAX_SCAN_ROWS):
+    """Page over a TelemetryStore newest first; used for ranges older than the index.
+
+    Same contract as RecordIndex.page(), except that once max_scan rows
+    have been examined the page ends early, with a cursor at the last of
+    them. until, when given, replaces the filter's end of range for the scan.
+    """
+    rows = store.iter_rows(record_filter.since, record_filter.until if until is None else until,
+                           fields=record_filter.fields, failed_only=record_filter.failed_only)
+    out = []
+    last = None  # key of the last row examined
+    scanned = 0
+    for key, record in rows:
+        if cursor is not None and key >= tuple(cursor):
+            continue
+        if record is not None and record_filter.matches(record, key[0]):
+            if len(out) == limit:
+                return out, encode_cursor(*last)
+            out.append(record)
+        last = key
+        scanned += 1
+        if scanned >= max_scan:
+            return out, encode_cursor(*last)
+    return out, None
+
+
+def _discard(keys, key):
+    i = bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
@@ -0,0 +1,104 @@
+"""
+In-process result cache for BigQuery-backed dashboard endpoints.
+
+Entries expire after a per-entry TTL and the cache evicts least recently used
+entries once it holds max_entries, or once their estimated size exceeds
+max_bytes. Hit/miss/eviction counters are kept so the server can report how
+effective the cache is.
+"""
+
+from collections import OrderedDict
+import json
+import re
+import threading
+import time
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def estimate_size(value, sample=20):
+    """Approximate size in bytes of a cached result: the JSON size of a sample of rows, scaled up."""
+    if isinstance(value, list) and len(value) > sample:
+        rows = value[::len(value) // sample][:sample]
+        return len(json.dumps(rows, default=str)) * len(value) // len(rows)
+    return len(json.dumps(value, default=str))
+
+
+def cache_key(query, params=None):
+    """Build a cache key from a query and its parameters.
+
+    Whitespace differences in the SQL text do not produce different keys.
+    """
+    normalized = _WHITESPACE.sub(' ', query).strip()
+    if not params:
+        return normalized
+    return normalized + '|' + json.dumps(params, sort_keys=True, default=str)
+
+
+class ResultCache:
+    """Thread-safe TTL cache with size-bounded LRU eviction."""
+
+    def __init__(self, max_entries=256, max_bytes=None):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (True, value) on a live hit, (False, None) otherwise."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                    self.bytes -= entry[2]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def set(self, key, value, ttl):
+        size = estimate_size(value) if self.max_bytes else 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            if self.max_bytes and size > self.max_bytes:
+                return  # larger than the whole quota; not worth evicting everything for
+            self._entries[key] = (value, time.time() + ttl, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted[2]
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self.bytes = 0
+            else:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self.bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,227 @@
+"""
+Hourly rollup tables of the telemetry table, kept in the query backend.
+
+The reports in dashboard-queries.sql scan 7-30 days of pubsub_raw and run
+JSON extraction on every row. RollupTables keeps `<table>_hourly` next to the
+source table instead (in BigQuery, or in the SQLite stand-in when offline):
+one row per UTC hour and ISP / city / device make / type / OS, holding the
+same running sums as rollups.Group plus QuantileSketch buckets of download,
+upload and ping. Sketch buckets use the sketch's log-gamma indices, so
+buckets of any hours and segments add up into one QuantileSketch.
+
+refresh() brings the table up to date with the completed hours. The first
+run builds the last BUILD_DAYS days; later runs re-aggregate only the hours
+since the previous one (rollup_refresh replaces those hours atomically), and
+nothing at all runs until another hour has completed. Each refresh selects
+the source rows by ingestReceivedAt, so the source table must be partitioned
+(or at least clustered) on it; otherwise every refresh scans the whole table.
+report() answers the /api/agg reports over the last N days from grouped sums
+of the rollup table, folded into a Rollups instance, so responses have exactly
+the shape of the in-memory reports while the query reads a few small columns
+instead of the raw JSON. REPORT_DAYS are the windows dashboard-queries.sql
+uses for the same reports.
+"""
+
+from datetime import datetime, timedelta, timezone
+import math
+import threading
+
+from rollups import Group, Rollups, day_of_week_of
+from sketches import DEFAULT_RELATIVE_ACCURACY, QuantileSketch
+
+# Days aggregated by the first refresh, and the longest report window
+BUILD_DAYS = 30
+# Hours before the last refreshed one that are aggregated again, for rows that land late
+REFRESH_OVERLAP_HOURS = 1
+
+LOG_GAMMA = math.log((1 + DEFAULT_RELATIVE_ACCURACY) / (1 - DEFAULT_RELATIVE_ACCURACY))
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# report -> rollup queries it is built from
+REPORTS = {
+    'isp': ('rollup_isp_city',),
+    'isp-totals': ('rollup_isp_city',),
+    'geo': ('rollup_isp_city',),
+    'devices': ('rollup_devices',),
+    'reachability': ('rollup_isp_device_type',),
+    'hourly': ('rollup_hours',),
+    'heatmap': ('rollup_hours',),
+    'percentiles': ('rollup_sketches',),
+    'device-categories': ('rollup_devices', 'rollup_sketches'),
+}
+
+# report -> days it covers in dashboard-queries.sql
+REPORT_DAYS = {
+    'isp': 7,
+    'isp-totals': 7,
+    'geo': 30,
+    'devices': 30,
+    'reachability': 7,
+    'hourly': 14,
+    'heatmap': 14,
+    'percentiles': 7,
+    'device-categories': 7,
+}
+
+
+def _hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _format(dt):
+    return dt.strftime(TIMESTAMP_FORMAT)
+
+
+def _bump(table, key, group):
+    existing = table.get(key)
+    if existing is None:
+        existing = table[key] = Group()
+    existing.merge(group)
+
+
+def _fold_isp_city(rollups, rows):
+    for row in rows:
+        group = Group.from_row(row)
+        rollups.by_isp_city[(row['isp_provider'], row['city'])] = group
+        _bump(rollups.by_isp, row['isp_provider'], group)
+        _bump(rollups.by_city, row['city'], group)
+
+
+def _fold_devices(rollups, rows):
+    for row in rows:
+        group = Group.from_row(row)
+        device_type = row['device_type']
+        rollups.by_device[(row['device_make'], device_type, row['device_os'])] = group
+        _bump(rollups.by_device_type, device_type, group)
+        _bump(rollups.by_device_category, 'Chromebook' if device_type == 'chromebook' else 'Other Devices', group)
+
+
+def _fold_isp_device_type(rollups, rows):
+    for row in rows:
+        rollups.by_isp_device_type[(row['isp_provider'], row['device_type'])] = Group.from_row(row)
+
+
+def _fold_hours(rollups, rows):
+    for row in rows:
+        group = Group.from_row(row)
+        when = rollups.local_time(row['hour'])
+        _bump(rollups.by_hour, when.hour, group)
+        _bump(rollups.heatmap, (day_of_week_of(when), when.hour), group)
+
+
+def _fold_sketches(rollups, rows):
+    for row in rows:
+        key, n = int(row['bucket']), int(row['n'])
+        rollups.sketches[row['metric']].add_bin(key, n)
+        if row['metric'] == 'download_speed':
+            category = 'Chromebook' if row['device_type'] == 'chromebook' else 'Other Devices'
+            sketch = rollups.category_sketches.get(category)
+            if sketch is None:
+                sketch = rollups.category_sketches[category] = QuantileSketch()
+            sketch.add_bin(key, n)
+
+
+_FOLDS = {
+    'rollup_isp_city': _fold_isp_city,
+    'rollup_devices': _fold_devices,
+    'rollup_isp_device_type': _fold_isp_device_type,
+    'rollup_hours': _fold_hours,
+    'rollup_sketches': _fold_sketches,
+}
+
+
+class RollupTables:
+    """Maintains `<table>_hourly` through a query backend and answers reports from it.
+
+    DDL and refreshes go straight to the backend; report queries go through
+    run(name, **params), which defaults to backend.run but may be a cached
+    runner. Hours and weekdays of reports are computed in tz, like Rollups.
+    """
+
+    def __init__(self, backend, tz=None, run=None, build_days=BUILD_DAYS):
+        self.backend = backend
+        self.tz = tz
+        self.run = run or backend.run
+        self.build_days = build_days
+        self._lock = threading.Lock()
+        self.created = False
+        self.built_until = None  # exclusive end hour of the last refresh
+        self.refreshes = 0
+        self.last_refresh = None
+        self.last_duration = None
+
+    @property
+    def ready(self):
+        return self.built_until is not None
+
+    def due(self, now=None, synced_until=None):
+        """True when a completed hour is missing from the table.
+
+        synced_until is the newest publish time the caller has seen (UTC);
+        while it is older than the table, no new rows exist to aggregate.
+        """
+        if self.built_until is None:
+            return True
+        if _hour(now or datetime.now(timezone.utc)) <= self.built_until:
+            return False
+        return synced_until is None or synced_until >= self.built_until
+
+    def refresh(self, now=None):
+        """Aggregate newly completed hours into the rollup table.
+
+        Returns (start_ts, end_ts) refreshed, or None when no hour has
+        completed since the last refresh. The first call resumes after the
+        newest hour already in the table, or builds the last build_days days.
+        Raises QueryError.
+        """
+        with self._lock:
+            started = datetime.now(timezone.utc)
+            now = now or started
+            end = _hour(now)
+            if self.built_until is not None and end <= self.built_until:
+                return None
+            if not self.created:
+                self.backend.run('rollup_create')
+                self.created = True
+            start = self.built_until
+            if start is None:
+                rows = self.backend.run('rollup_watermark')
+                latest = rows[0].get('hour') if rows else None
+                if latest:
+                    start = datetime.fromisoformat(str(latest)[:19]).replace(tzinfo=timezone.utc)
+                    start += timedelta(hours=1)
+                else:
+                    start = end - timedelta(days=self.build_days)
+            start = max(start - timedelta(hours=REFRESH_OVERLAP_HOURS), end - timedelta(days=self.build_days))
+            self.backend.run('rollup_refresh', start_ts=_format(start), end_ts=_format(end), log_gamma=LOG_GAMMA)
+            self.built_until = end
+            self.refreshes += 1
+            self.last_refresh = _format(now)
+            self.last_duration = round((datetime.now(timezone.utc) - started).total_seconds(), 3)
+            return _format(start), _format(end)
+
+    def report(self, name, days=None, min_tests=1, now=None):
+        """One /api/agg report over the last `days` days (1..build_days) of the rollup table.
+
+        days defaults to the report's window in REPORT_DAYS. Refreshes first
+        if the table has not been built yet. Raises KeyError
+        for reports the rollups cannot answer, QueryError on backend failures.
+        """
+        queries = REPORTS[name]
+        if not self.ready:
+            self.refresh(now)
+        days = max(1, min(days or REPORT_DAYS[name], self.build_days))
+        since = _hour(now or datetime.now(timezone.utc)) - timedelta(days=days)
+        rollups = Rollups(tz=self.tz)
+        for query in queries:
+            _FOLDS[query](rollups, self.run(query, since_ts=_format(since)))
+        return rollups.report(name, min_tests=min_tests)
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'built_until': _format(self.built_until) if self.built_until else None,
+            'refreshes': self.refreshes,
+            'last_refresh': self.last_refresh,
+            'last_duration': self.last_duration,
+        }
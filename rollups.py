@@ -0,0 +1,319 @@
+"""
+Incrementally maintained rollups over the enriched telemetry records.
+
+Rollups mirror the reports in dashboard-queries.sql (device distribution,
+speed by ISP/city, reachability by ISP/device, geography, peak usage heatmap
+and Chromebook vs other devices) plus the dashboard's KPI tiles and hourly
+speed chart. Records are folded in as they arrive and folded out again when
+they leave the held window, so nothing is recomputed from scratch and the
+browser receives a few kilobytes of aggregates instead of every raw row.
+"""
+
+from datetime import datetime, timezone
+import os
+import threading
+
+from sketches import QuantileSketch
+from telemetry_store import to_epoch
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def _metric(value):
+    """Numeric value of a speed field, or None for 'Failed'/missing."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def day_of_week_of(when):
+    """BigQuery's DAYOFWEEK: 1 = Sunday ... 7 = Saturday."""
+    return (when.weekday() + 1) % 7 + 1
+
+
+def _round(value, digits=2):
+    return round(value, digits) if value is not None else None
+
+
+class Group:
+    """Running sums for one rollup bucket."""
+
+    __slots__ = ('tests', 'download_sum', 'download_n', 'upload_sum', 'upload_n',
+                 'ping_sum', 'ping_n', 'download_failed', 'ping_failed', 'sites_ok', 'sites_total')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    @classmethod
+    def from_row(cls, row):
+        """Group holding the sums of one pre-aggregated row (an hourly rollup table row)."""
+        group = cls()
+        for name in cls.__slots__:
+            setattr(group, name, row.get(name) or 0)
+        return group
+
+    def merge(self, other):
+        """Add the sums of another group into this one."""
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def apply(self, record, sign):
+        self.tests += sign
+        download = _metric(record.get('download_speed'))
+        if download is None:
+            self.download_failed += sign
+        else:
+            self.download_sum += sign * download
+            self.download_n += sign
+        upload = _metric(record.get('upload_speed'))
+        if upload is not None:
+            self.upload_sum += sign * upload
+            self.upload_n += sign
+        ping = _metric(record.get('ping_ms'))
+        if ping is None:
+            self.ping_failed += sign
+        else:
+            self.ping_sum += sign * ping
+            self.ping_n += sign
+        self.sites_ok += sign * (record.get('sites_ok') or 0)
+        self.sites_total += sign * (record.get('sites_total') or 0)
+
+    def to_dict(self):
+        return {
+            'test_count': self.tests,
+            'avg_download_mbps': _round(self.download_sum / self.download_n) if self.download_n else None,
+            'avg_upload_mbps': _round(self.upload_sum / self.upload_n) if self.upload_n else None,
+            'avg_ping_ms': _round(self.ping_sum / self.ping_n) if self.ping_n else None,
+            'failed_downloads': self.download_failed,
+            'failed_pings': self.ping_failed,
+            'sites_ok': self.sites_ok,
+            'sites_total': self.sites_total,
+            'availability_pct': _round(100 * self.sites_ok / self.sites_total) if self.sites_total else None,
+        }
+
+
+def _sketch_summary(sketch):
+    out = {'count': sketch.count}
+    for q in PERCENTILES:
+        out[f'p{int(q * 100)}'] = _round(sketch.quantile(q))
+    return out
+
+
+class Rollups:
+    """All dashboard rollups, updated incrementally from record changes.
+
+    Hours and weekdays are computed in `tz` (default: the server's local
+    time zone, which is what the browser on the same machine uses).
+    """
+
+    def __init__(self, tz=None):
+        self.tz = tz
+        self._lock = threading.RLock()
+        self.version = 0
+        self.total = Group()
+        # Averages over tests where both download and ping succeeded (KPI tiles)
+        self.valid = Group()
+        self.by_isp_city = {}
+        self.by_isp = {}
+        self.by_city = {}
+        self.by_device = {}
+        self.by_device_type = {}
+        self.by_isp_device_type = {}
+        self.by_hour = {}
+        self.heatmap = {}
+        self.by_device_category = {}
+        self.sketches = {name: QuantileSketch() for name in ('download_speed', 'upload_speed', 'ping_ms')}
+        self.category_sketches = {}
+        self._dashboard = None
+
+    # --- updates ---
+    def update(self, added, dropped=()):
+        """Fold added records in and dropped records out. Usable as a sync listener."""
+        with self._lock:
+            for record in added:
+                self._apply(record, 1)
+            for record in dropped:
+                self._apply(record, -1)
+            self.version += 1
+
+    def local_time(self, publish_time):
+        """A UTC publish_time as a datetime in the rollups' time zone."""
+        epoch = to_epoch(publish_time)
+        if self.tz is None:
+            return datetime.fromtimestamp(epoch)
+        return datetime.fromtimestamp(epoch, timezone.utc).astimezone(self.tz)
+
+    @staticmethod
+    def _bump(table, key, record, sign):
+        group = table.get(key)
+        if group is None:
+            group = table[key] = Group()
+        group.apply(record, sign)
+        if group.tests <= 0:
+            del table[key]
+
+    def _apply(self, record, sign):
+        if not record.get('publish_time'):
+            return
+        isp = record.get('isp_provider') or 'Unknown'
+        city = record.get('city') or 'Unknown'
+        device_type = record.get('device_type') or 'Unknown'
+        device_key = (record.get('device_make') or 'Unknown', device_type, record.get('device_os') or 'Unknown')
+        category = 'Chromebook' if device_type == 'chromebook' else 'Other Devices'
+        when = self.local_time(record['publish_time'])
+        day_of_week = day_of_week_of(when)
+
+        self.total.apply(record, sign)
+        download = _metric(record.get('download_speed'))
+        ping = _metric(record.get('ping_ms'))
+        if download is not None and ping is not None:
+            self.valid.apply(record, sign)
+        self._bump(self.by_isp_city, (isp, city), record, sign)
+        self._bump(self.by_isp, isp, record, sign)
+        self._bump(self.by_city, city, record, sign)
+        self._bump(self.by_device, device_key, record, sign)
+        self._bump(self.by_device_type, device_type, record, sign)
+        self._bump(self.by_isp_device_type, (isp, device_type), record, sign)
+        self._bump(self.by_hour, when.hour, record, sign)
+        self._bump(self.heatmap, (day_of_week, when.hour), record, sign)
+        self._bump(self.by_device_category, category, record, sign)
+
+        for name, sketch in self.sketches.items():
+            value = _metric(record.get(name))
+            if value is not None and value > 0:
+                sketch.add(value, sign)
+        if download is not None and download > 0:
+            sketch = self.category_sketches.get(category)
+            if sketch is None:
+                sketch = self.category_sketches[category] = QuantileSketch()
+            sketch.add(download, sign)
+
+    # --- reports ---
+    def summary(self):
+        """KPI tiles: test count, averages over successful tests, site availability."""
+        with self._lock:
+            valid = self.valid.to_dict()
+            total = self.total.to_dict()
+            return {
+                'total_tests': self.total.tests,
+                'avg_download_mbps': valid['avg_download_mbps'],
+                'avg_upload_mbps': valid['avg_upload_mbps'],
+                'avg_ping_ms': valid['avg_ping_ms'],
+                'site_availability_pct': total['availability_pct'],
+                'failed_downloads': total['failed_downloads'],
+                'failed_pings': total['failed_pings'],
+            }
+
+    def isp(self, min_tests=1):
+        """Speed by ISP and city (dashboard-queries.sql #3)."""
+        with self._lock:
+            rows = [dict(isp_provider=isp, city=city, **g.to_dict())
+                    for (isp, city), g in self.by_isp_city.items() if g.tests >= min_tests]
+        return sorted(rows, key=lambda r: (r['avg_download_mbps'] is None, -(r['avg_download_mbps'] or 0)))
+
+    def isp_totals(self):
+        """Speed by ISP alone (the dashboard's ISP chart)."""
+        with self._lock:
+            rows = [dict(isp_provider=isp, **g.to_dict()) for isp, g in self.by_isp.items()]
+        return sorted(rows, key=lambda r: -r['test_count'])
+
+    def devices(self):
+        """Device distribution by make/type/OS (dashboard-queries.sql #2)."""
+        with self._lock:
+            rows = [dict(device_make=make, device_type=dtype, device_os=os_name, device_count=g.tests,
+                         avg_download_mbps=g.to_dict()['avg_download_mbps'])
+                    for (make, dtype, os_name), g in self.by_device.items()]
+            types = {dtype: g.tests for dtype, g in self.by_device_type.items()}
+        return {'devices': sorted(rows, key=lambda r: -r['device_count']), 'by_type': types}
+
+    def reachability(self, min_tests=1):
+        """Site availability by ISP and device type (dashboard-queries.sql #4, from per-test site counts)."""
+        with self._lock:
+            rows = [dict(isp_provider=isp, device_type=dtype, **g.to_dict())
+                    for (isp, dtype), g in self.by_isp_device_type.items() if g.tests >= min_tests]
+        return sorted(rows, key=lambda r: (r['availability_pct'] is None, r['availability_pct'] or 0))
+
+    def geo(self):
+        """Tests and speed by city (dashboard-queries.sql #5)."""
+        with self._lock:
+            rows = [dict(city=city, **g.to_dict()) for city, g in self.by_city.items()]
+        return sorted(rows, key=lambda r: -r['test_count'])
+
+    def hourly(self):
+        """Average speeds by hour of day (the dashboard's speed chart)."""
+        with self._lock:
+            rows = [dict(hour=hour, **g.to_dict()) for hour, g in self.by_hour.items()]
+        return sorted(rows, key=lambda r: r['hour'])
+
+    def heatmap_cells(self):
+        """Hour-of-day x day-of-week usage (dashboard-queries.sql #6)."""
+        with self._lock:
+            rows = [dict(day_of_week=dow, hour_of_day=hour, test_count=g.tests,
+                         avg_download_mbps=g.to_dict()['avg_download_mbps'])
+                    for (dow, hour), g in self.heatmap.items()]
+        return sorted(rows, key=lambda r: (r['hour_of_day'], r['day_of_week']))
+
+    def percentiles(self):
+        """p50/p90/p99 of download, upload and ping over successful measurements."""
+        with self._lock:
+            return {name: _sketch_summary(sketch) for name, sketch in self.sketches.items()}
+
+    def device_categories(self):
+        """Chromebook vs other devices, with median download (dashboard-queries.sql #7)."""
+        with self._lock:
+            rows = []
+            for category, g in self.by_device_category.items():
+                sketch = self.category_sketches.get(category)
+                row = dict(device_category=category, **g.to_dict())
+                row['median_download_mbps'] = _round(sketch.quantile(0.5)) if sketch else None
+                rows.append(row)
+        return sorted(rows, key=lambda r: -(r['avg_download_mbps'] or 0))
+
+    def report(self, name, **options):
+        """Return one named rollup, as served by /api/agg/<name>."""
+        reports = {
+            'summary': self.summary,
+            'isp': lambda: self.isp(options.get('min_tests', 1)),
+            'isp-totals': self.isp_totals,
+            'devices': self.devices,
+            'reachability': lambda: self.reachability(options.get('min_tests', 1)),
+            'geo': self.geo,
+            'hourly': self.hourly,
+            'heatmap': self.heatmap_cells,
+            'percentiles': self.percentiles,
+            'device-categories': self.device_categories,
+        }
+        if name not in reports:
+            raise KeyError(name)
+        return reports[name]()
+
+    def dashboard(self):
+        """Everything dashboard.html needs for its tiles and charts in one payload.
+
+        The same dict is returned until the rollups change, so callers can
+        cache its serialized form by identity.
+        """
+        with self._lock:  # one consistent snapshot, labelled with its own version
+            cached = self._dashboard
+            if cached is not None and cached['version'] == self.version:
+                return cached
+            self._dashboard = {
+                'version': self.version,
+                'summary': self.summary(),
+                'hourly': self.hourly(),
+                'isp': self.isp_totals(),
+                'devices': self.devices()['by_type'],
+                'geo': self.geo(),
+                'percentiles': self.percentiles(),
+            }
+            return self._dashboard
+
+
+def rollup_timezone():
+    """Time zone for hour/weekday buckets from DASHBOARD_TZ (IANA name), else local time."""
+    name = os.environ.get('DASHBOARD_TZ')
+    if not name:
+        return None
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(name)
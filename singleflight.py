@@ -0,0 +1,168 @@
+"""
+Single-flight request coalescing for the dashboard server.
+
+Concurrent callers asking for the same key share one in-flight call instead
+of each starting their own BigQuery query. StaleWhileRevalidate builds on it
+to hand out the last good value immediately while a refresh runs in the
+background.
+"""
+
+import threading
+import time
+
+# Background refreshes after a failed one wait RETRY_DELAY * 2**(failures - 1) seconds, up to MAX_RETRY_DELAY
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 300
+
+
+class _Call:
+    """One in-flight invocation that any number of callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError('timed out waiting for in-flight call')
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; everyone else joins it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _start(self, key):
+        """Return (call, is_leader) for key, registering a new call if needed."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            return call, True
+
+    def _run(self, key, call, fn):
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def do(self, key, fn, timeout=None):
+        """Call fn() for key, or wait for the call already running, and return its result."""
+        call, leader = self._start(key)
+        if leader:
+            self._run(key, call, fn)
+        return call.wait(timeout)
+
+    def do_async(self, key, fn):
+        """Start fn() for key on a background thread unless one is already running."""
+        call, leader = self._start(key)
+        if leader:
+            threading.Thread(target=self._run, args=(key, call, fn),
+                             name=f'singleflight-{key}', daemon=True).start()
+        return call
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+
+class StaleWhileRevalidate:
+    """Keyed value cache that serves stale values while one refresh runs.
+
+    Loaders return the new value, or None when nothing usable came back, in
+    which case the previous good value is kept. After a failed refresh (an
+    exception or None) stale values are served without starting another
+    background refresh until a backoff delay has passed, so an outage does
+    not turn every request into a new backend call.
+    """
+
+    def __init__(self, flight=None, retry_delay=RETRY_DELAY, max_retry_delay=MAX_RETRY_DELAY):
+        self.flight = flight or SingleFlight()
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (value, fetched_at)
+        self._failures = {}  # key -> (consecutive failed refreshes, no background refresh before)
+        # get() outcomes: served fresh, served stale (refreshing), waited for a load
+        self.hits = self.stale = self.misses = 0
+
+    def seed(self, key, value, fetched_at=None):
+        """Install an initial value, e.g. one loaded from a file on startup."""
+        with self._lock:
+            self._entries[key] = (value, time.time() if fetched_at is None else fetched_at)
+
+    def peek(self, key):
+        """Return (value, age_seconds) for key, or (None, None) when empty."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None, None
+        return entry[0], time.time() - entry[1]
+
+    def _refresh(self, key, loader):
+        try:
+            value = loader()
+        except BaseException:
+            self._failed(key)
+            raise
+        if value is not None:
+            with self._lock:
+                self._entries[key] = (value, time.time())
+                self._failures.pop(key, None)
+            return value
+        # Keep serving the last good value when a refresh comes back empty
+        self._failed(key)
+        return self.peek(key)[0]
+
+    def _failed(self, key):
+        with self._lock:
+            failures = self._failures.get(key, (0, 0))[0] + 1
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** (failures - 1))
+            self._failures[key] = (failures, time.time() + delay)
+
+    def retry_at(self, key):
+        """Time before which no background refresh of key starts, or None."""
+        with self._lock:
+            failure = self._failures.get(key)
+        return failure[1] if failure is not None else None
+
+    def refresh(self, key, loader, timeout=None):
+        """Reload key now (joining a refresh already in flight) and return the value."""
+        return self.flight.do(key, lambda: self._refresh(key, loader), timeout)
+
+    def get(self, key, loader, ttl, fresh=False, timeout=None):
+        """Return the value for key.
+
+        Fresh values are returned as-is. Stale values are returned at once
+        while a background refresh runs (unless one failed within the retry
+        backoff). With no value, or with fresh=True,
+        the caller waits for a refresh, joining one that is already in flight.
+        """
+        value, age = self.peek(key)
+        if fresh or value is None:
+            with self._lock:
+                self.misses += 1
+            return self.refresh(key, loader, timeout)
+        if age < ttl:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.stale += 1
+            failure = self._failures.get(key)
+            backing_off = failure is not None and time.time() < failure[1]
+        if not backing_off:
+            self.flight.do_async(key, lambda: self._refresh(key, loader))
+        return value
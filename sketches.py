@@ -0,0 +1,107 @@
+"""
+Mergeable quantile sketch for latency and speed percentiles.
+
+QuantileSketch follows the DDSketch scheme: positive values are counted in
+logarithmic buckets whose width guarantees every quantile estimate is within
+`relative_accuracy` of the true value. Sketches can be merged (for combining
+time buckets or segments) and values can be removed again, which lets
+rollups follow a sliding window without recomputing from scratch.
+"""
+
+import math
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+
+class QuantileSketch:
+    """Log-bucketed quantile sketch with bounded relative error."""
+
+    __slots__ = ('relative_accuracy', '_gamma', '_log_gamma', 'bins', 'zero_count', 'count', 'total')
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.bins = {}       # bucket index -> count
+        self.zero_count = 0  # values <= 0
+        self.count = 0
+        self.total = 0.0
+
+    def bucket(self, value):
+        """Bucket index holding a positive value."""
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def add(self, value, weight=1):
+        """Add value `weight` times; a negative weight removes it again."""
+        if value is None or value != value:  # None or NaN
+            return
+        if value <= 0:
+            self.zero_count += weight
+        else:
+            key = self.bucket(value)
+            remaining = self.bins.get(key, 0) + weight
+            if remaining > 0:
+                self.bins[key] = remaining
+            else:
+                self.bins.pop(key, None)
+        self.count += weight
+        self.total += value * weight
+
+    def add_bin(self, key, n):
+        """Add n values already bucketed elsewhere (e.g. by SQL); their total is not known."""
+        if n:
+            self.bins[key] = self.bins.get(key, 0) + n
+            self.count += n
+
+    def remove(self, value):
+        self.add(value, -1)
+
+    def merge(self, other):
+        """Fold another sketch with the same accuracy into this one."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('cannot merge sketches with different accuracy')
+        for key, n in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        return self
+
+    def _value_of(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0 <= q <= 1); None when empty."""
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return self._value_of(key)
+        return self._value_of(max(self.bins)) if self.bins else 0.0
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else None
+
+    def to_dict(self):
+        """Serializable form; bucket keys are log-gamma indices."""
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'total': self.total,
+            'bins': {str(k): v for k, v in self.bins.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data.get('relative_accuracy', DEFAULT_RELATIVE_ACCURACY))
+        sketch.bins = {int(k): v for k, v in data.get('bins', {}).items()}
+        sketch.zero_count = data.get('zero_count', 0)
+        sketch.count = data.get('count', 0)
+        sketch.total = data.get('total', 0.0)
+        return sketch
@@ -20,20 +20,10 @@ if [ ! -f "dashboard.html" ]; then
     exit 1
 fi
 
-# Check for BigQuery CLI and try to fetch real data
-if command -v bq &> /dev/null; then
-    echo "🔍 Checking for real telemetry data..."
-    python3 fetch-data.py
-    
-    if [ -f "telemetry_data.json" ]; then
-        echo "✅ Real telemetry data found - dashboard will show live data!"
-    else
-        echo "⚠️  No real data available - dashboard will show sample data"
-        echo "   Run a speed test in your Chrome extension to generate data"
-    fi
-else
-    echo "⚠️  BigQuery CLI not found - using sample data only"
-    echo "   To see real data: gcloud components install bq"
+# The server binds its port right away and loads/refreshes telemetry in the background
+if ! command -v bq &> /dev/null && ! python3 -c "import google.cloud.bigquery" &> /dev/null; then
+    echo "⚠️  Neither the BigQuery client library nor the bq CLI was found - using sample data only"
+    echo "   To see real data: pip install google-cloud-bigquery (or gcloud components install bq)"
 fi
 
 echo ""
@@ -0,0 +1,92 @@
+"""
+Synthetic pubsub_raw rows for offline benchmarks and load tests.
+
+Rows are shaped like the bq CLI output for the latest_rows query (see
+row.json and query_backend.BIGQUERY_QUERIES): JSON columns arrive as
+strings, timestamps as 'YYYY-MM-DD HH:MM:SS'.
+"""
+
+from datetime import datetime, timedelta, timezone
+import json
+import random
+import uuid
+
+ISPS = ('COMCAST-7922', 'VERIZON-BUSINESS', 'ATT-INTERNET4', 'SPECTRUM', 'FRONTIER', 'WINDSTREAM')
+CITIES = ('Bloomington', 'Indianapolis', 'Columbus', 'Springfield', 'Fairview', 'Madison', 'Franklin')
+DEVICES = (
+    ('Google', 'chromebook', 'ChromeOS', ('14541.0.0', '15359.58.0', '15633.69.0')),
+    ('Apple', 'desktop', 'macOS', ('10.15.7', '13.4.1', '14.2')),
+    ('Dell', 'laptop', 'Windows', ('10.0', '11.0')),
+    ('Lenovo', 'chromebook', 'ChromeOS', ('15359.58.0', '15633.69.0')),
+)
+SITES = (
+    'https://www.google.com', 'https://classroom.google.com', 'https://www.khanacademy.org',
+    'https://clever.com', 'https://www.youtube.com', 'https://docs.google.com',
+    'https://www.wikipedia.org', 'https://quizlet.com', 'https://www.canva.com',
+    'https://www.desmos.com', 'https://www.zoom.us', 'https://student.schoology.com',
+)
+TRIGGERS = ('alarm', 'manual', 'startup')
+VERSIONS = ('0.1.0', '0.1.1', '0.2.0')
+
+
+def _timestamp(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def raw_row(rng, received_at):
+    """Build one raw row received at the given datetime."""
+    make, dev_type, os_name, os_versions = rng.choice(DEVICES)
+    speed = {
+        'downloadMbps': round(rng.lognormvariate(3.5, 0.6), 2),
+        'uploadMbps': round(rng.lognormvariate(2.3, 0.5), 2),
+        'pingMs': round(rng.lognormvariate(3.3, 0.4), 1),
+    }
+    if rng.random() < 0.05:
+        speed.pop('downloadMbps')
+        speed['downloadError'] = 'timeout'
+    if rng.random() < 0.03:
+        speed.pop('pingMs')
+        speed['pingError'] = 'timeout'
+    results = []
+    for url in SITES:
+        ok = rng.random() > 0.04
+        results.append({
+            'url': url,
+            'ok': ok,
+            'status': 200 if ok else rng.choice((0, 403, 500, 503)),
+            'latencyMs': round(rng.lognormvariate(4.6, 0.5), 1),
+            'error': None if ok else 'fetch failed',
+        })
+    device = {
+        'device': {'make': make, 'type': dev_type, 'os': os_name, 'osVersion': rng.choice(os_versions)},
+        'isp': {'provider': rng.choice(ISPS), 'city': rng.choice(CITIES)},
+        'user': {'email': f'student{rng.randrange(5000)}@district.example.org'},
+    }
+    return {
+        'publish_time': _timestamp(received_at),
+        'test_timestamp': _timestamp(received_at - timedelta(seconds=1)),
+        'trigger': rng.choice(TRIGGERS),
+        'durationMs': str(rng.randrange(3000, 12000)),
+        'version': rng.choice(VERSIONS),
+        'speed': json.dumps(speed),
+        'reachability': json.dumps({'results': results}),
+        'device': json.dumps(device),
+        'ingestSourceIp': f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}',
+        'requestId': str(uuid.UUID(int=rng.getrandbits(128))),
+    }
+
+
+def raw_rows(count, end=None, spacing_seconds=30, seed=0):
+    """Return count raw rows, newest first, spaced spacing_seconds apart ending at end."""
+    rng = random.Random(seed)
+    end = end or datetime.now(timezone.utc).replace(microsecond=0)
+    return [raw_row(rng, end - timedelta(seconds=i * spacing_seconds)) for i in range(count)]
+
+
+def table_rows(count, end=None, spacing_seconds=30, seed=0):
+    """Like raw_rows(), but with the pubsub_raw column names of row.json (ingestReceivedAt, timestamp)."""
+    rows = raw_rows(count, end, spacing_seconds, seed)
+    for row in rows:
+        row['ingestReceivedAt'] = row.pop('publish_time')
+        row['timestamp'] = row.pop('test_timestamp')
+    return rows
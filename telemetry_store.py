@@ -0,0 +1,758 @@
+"""
+Local columnar storage for enriched telemetry records.
+
+Records are appended as immutable segment files, partitioned by UTC day:
+
+    telemetry_store/day=2025-08-13/seg-000001.tcol
+
+Each segment holds one column per field in a compact binary layout that is
+read through mmap without copying: numbers are packed float64/int32 arrays,
+failure flags are single bytes, low-cardinality strings (ISP, city, device,
+trigger, version...) are dictionary-encoded, and free text (publish_time,
+request_id, user_email) is stored as one UTF-8 blob plus offsets. Values read
+back with the types they were appended with: int metrics carry an int flag
+byte (as in EnrichedBatch), and duration_ms is a 'num' column that remembers
+whether each value was an int, a float or a numeric string. The per-site check
+results of each row sit beside the record columns in a site_checks column of
+compact JSON, read only by site_checks(); record reads never decode it. Rows
+inside a segment are sorted by publish time (then request_id), so a
+time-range read is a pair of binary searches per segment.
+
+Segments are written to a temp file and renamed into place, so readers never
+see a partial segment. Days that accumulate many small segments are compacted
+into one, again by atomic rename. Several processes may share a store (the
+dashboard server and fetch-data.py --format store, say): naming a new segment
+and compacting a day both happen under an flock on the day's .lock file, so
+two writers never pick the same segment name and compaction never removes a
+segment another writer is still producing. Readers keep the segments they are
+walking mapped; a segment compacted away is closed once the last of them is
+done with it.
+"""
+
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import heapq
+from itertools import repeat
+import json
+import mmap
+from operator import itemgetter
+import os
+import struct
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+DEFAULT_STORE_DIR = 'telemetry_store'
+SEGMENT_SUFFIX = '.tcol'
+# Per-day lock file taken by writers (segment naming, compaction)
+LOCK_FILE = '.lock'
+MAGIC = b'TCOL1\n'
+# Compact a day once it holds more than this many segments
+COMPACT_THRESHOLD = 16
+# Rows materialized per segment at a time by iter_scan()
+STREAM_BATCH = 1000
+_ALIGN = 8
+_NULL_CODE = 0xFFFFFFFF
+
+FAILED = 'Failed'
+
+# (field, storage type). 'cat' = dictionary-encoded string, 'str' = free text,
+# 'num' = number or numeric string (float64 plus a type byte per row),
+# 'json' = nested value stored as JSON text (only the site_checks side column).
+# Readers go by the type recorded in each segment, so segments written with
+# an older schema (duration_ms and user_email as 'cat') still read.
+SCHEMA = (
+    ('publish_time', 'str'),
+    ('trigger', 'cat'),
+    ('version', 'cat'),
+    ('duration_ms', 'num'),
+    ('user_email', 'str'),
+    ('device_make', 'cat'),
+    ('device_type', 'cat'),
+    ('device_os', 'cat'),
+    ('device_os_version', 'cat'),
+    ('isp_provider', 'cat'),
+    ('city', 'cat'),
+    ('download_speed', 'f8'),
+    ('download_failed', 'u1'),
+    ('download_int', 'u1'),
+    ('upload_speed', 'f8'),
+    ('upload_int', 'u1'),
+    ('ping_ms', 'f8'),
+    ('ping_failed', 'u1'),
+    ('ping_int', 'u1'),
+    ('sites_ok', 'i4'),
+    ('sites_total', 'i4'),
+    ('request_id', 'str'),
+)
+# Side column of per-row site checks, and its name in segments written before records dropped them
+SITE_CHECKS = 'site_checks'
+_LEGACY_SITE_CHECKS = 'site_results'
+
+# Order of fields in the dict records handed back to the API
+RECORD_FIELDS = (
+    'publish_time', 'trigger', 'version', 'duration_ms', 'user_email',
+    'device_make', 'device_type', 'device_os', 'device_os_version',
+    'isp_provider', 'city', 'download_speed', 'upload_speed', 'ping_ms',
+    'sites_ok', 'sites_total', 'request_id',
+)
+
+_TYPECODES = {'f8': 'd', 'i4': 'i', 'u1': 'B', 'str': 'B', 'json': 'B', 'cat': 'I', 'ts': 'd', 'off': 'q',
+              'num': 'd'}
+# Metric -> its int flag column
+_INT_FLAGS = {'download_speed': 'download_int', 'upload_speed': 'upload_int', 'ping_ms': 'ping_int'}
+# Metric -> its failure flag column
+_FAILED_FLAGS = {'download_speed': 'download_failed', 'ping_ms': 'ping_failed'}
+# Row types of a 'num' column, in its '.types' byte column
+_NUM_NULL, _NUM_INT, _NUM_FLOAT, _NUM_TEXT, _NUM_OTHER = range(5)
+
+
+def to_epoch(value):
+    """Convert a publish_time string or datetime to UTC epoch seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        text = str(value).strip().replace('T', ' ')
+        for suffix in (' UTC', 'Z', '+00:00'):
+            if text.endswith(suffix):
+                text = text[:-len(suffix)]
+        dt = datetime.fromisoformat(text)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _day_of(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _integral(value):
+    """Whether a metric is an int in the API shape; missing ones read as 0, like EnrichedBatch's."""
+    return value is None or (isinstance(value, int) and not isinstance(value, bool))
+
+
+def _num_type(value):
+    """(_NUM_* type, float64 to store) of a value of a 'num' column."""
+    if value is None:
+        return _NUM_NULL, 0.0
+    if isinstance(value, bool):
+        return _NUM_OTHER, 0.0
+    if isinstance(value, int):
+        return (_NUM_INT, float(value)) if abs(value) < 2 ** 53 else (_NUM_OTHER, 0.0)
+    if isinstance(value, float):
+        return _NUM_FLOAT, value
+    if isinstance(value, str):
+        try:
+            number = int(value)
+        except ValueError:
+            return _NUM_OTHER, 0.0
+        if str(number) == value and abs(number) < 2 ** 53:
+            return _NUM_TEXT, float(number)
+    return _NUM_OTHER, 0.0
+
+
+def _pad(buf):
+    buf.extend(b'\0' * (-len(buf) % _ALIGN))
+
+
+def encode_segment(records, site_checks=None):
+    """Serialize records (dicts in the API shape) into segment bytes.
+
+    site_checks, when given, holds each record's site checks (or None), in
+    the order of records.
+    """
+    items = sorted(
+        ((to_epoch(r['publish_time']), r, checks)
+         for r, checks in zip(records, repeat(None) if site_checks is None else site_checks)
+         if r.get('publish_time')),
+        key=lambda item: (item[0], item[1].get('request_id') or ''))
+    rows = [(ts, r) for ts, r, _ in items]
+    body = bytearray()
+    columns = []
+
+    def add_blob(name, kind, data, **extra):
+        _pad(body)
+        raw = data.tobytes() if isinstance(data, array) else bytes(data)
+        columns.append(dict(name=name, type=kind, offset=len(body), length=len(raw), **extra))
+        body.extend(raw)
+
+    def add_text(name, kind, values):
+        offsets = array('q', [0])
+        nulls = bytearray()
+        blob = bytearray()
+        for v in values:
+            nulls.append(v is None)
+            if v is not None:
+                text = json.dumps(v, separators=(',', ':')) if kind == 'json' else str(v)
+                blob.extend(text.encode('utf-8'))
+            offsets.append(len(blob))
+        add_blob(name, kind, blob)
+        add_blob(name + '.offsets', 'off', offsets)
+        add_blob(name + '.nulls', 'u1', nulls)
+
+    add_blob('ts', 'ts', array('d', (ts for ts, _ in rows)))
+    for name, kind in SCHEMA:
+        if name == 'download_failed':
+            values = bytearray(r.get('download_speed') == FAILED for _, r in rows)
+            add_blob(name, kind, values)
+        elif name == 'ping_failed':
+            values = bytearray(r.get('ping_ms') == FAILED for _, r in rows)
+            add_blob(name, kind, values)
+        elif name.endswith('_int'):
+            metric = next(field for field, flag in _INT_FLAGS.items() if flag == name)
+            add_blob(name, kind, bytearray(_integral(r.get(metric)) for _, r in rows))
+        elif kind == 'num':
+            values = array('d')
+            types = bytearray()
+            for _, r in rows:
+                row_type, number = _num_type(r.get(name))
+                types.append(row_type)
+                values.append(number)
+            add_blob(name, kind, values)
+            add_blob(name + '.types', 'u1', types)
+            if _NUM_OTHER in types:
+                # Anything else is kept as its JSON text
+                add_text(name + '.other', 'json', (r.get(name) if t == _NUM_OTHER else None
+                                                   for t, (_, r) in zip(types, rows)))
+        elif kind == 'f8':
+            values = array('d')
+            for _, r in rows:
+                v = r.get(name)
+                values.append(float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else 0.0)
+            add_blob(name, kind, values)
+        elif kind == 'i4':
+            add_blob(name, kind, array('i', (int(r.get(name) or 0) for _, r in rows)))
+        elif kind == 'cat':
+            dictionary = []
+            index = {}
+            codes = array('I')
+            for _, r in rows:
+                v = r.get(name)
+                if v is None:
+                    codes.append(_NULL_CODE)
+                    continue
+                v = str(v)
+                code = index.get(v)
+                if code is None:
+                    code = index[v] = len(dictionary)
+                    dictionary.append(v)
+                codes.append(code)
+            add_blob(name, kind, codes, dictionary=dictionary)
+        else:  # str
+            add_text(name, kind, (r.get(name) for _, r in rows))
+    if any(checks for _, _, checks in items):
+        add_text(SITE_CHECKS, 'json', (checks for _, _, checks in items))
+
+    header = {
+        'version': 1,
+        'rows': len(rows),
+        'byteorder': sys.byteorder,
+        'min_ts': rows[0][0] if rows else None,
+        'max_ts': rows[-1][0] if rows else None,
+        'columns': columns,
+    }
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    prefix = MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes
+    prefix += b'\0' * (-len(prefix) % _ALIGN)
+    return prefix + bytes(body)
+
+
+class Segment:
+    """A memory-mapped, read-only segment file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{path} is not a telemetry segment')
+        (header_len,) = struct.unpack_from('<I', self._mmap, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(bytes(view[start:start + header_len]))
+        base = start + header_len
+        base += -base % _ALIGN
+        self.rows = self.header['rows']
+        self.min_ts = self.header['min_ts']
+        self.max_ts = self.header['max_ts']
+        swap = self.header['byteorder'] != sys.byteorder
+        self._columns = {}
+        self._kinds = {}  # column -> storage type, as written
+        self._dictionaries = {}
+        self._codes = {}  # categorical column -> {value: code}, built on first filter
+        self._id_set = None
+        self._readers = 0  # reads in progress; counted by TelemetryStore under its lock
+        self._retired = False
+        for col in self.header['columns']:
+            raw = view[base + col['offset']:base + col['offset'] + col['length']]
+            kind = col['type']
+            if swap and kind in ('f8', 'i4', 'cat', 'ts', 'off', 'num'):
+                data = array(_TYPECODES[kind], raw.tobytes())
+                data.byteswap()
+            else:
+                data = raw.cast(_TYPECODES[kind])
+            self._columns[col['name']] = data
+            self._kinds[col['name']] = kind
+            if kind == 'cat':
+                self._dictionaries[col['name']] = col['dictionary']
+        self.ts = self._columns['ts']
+
+    def column(self, name):
+        return self._columns[name]
+
+    def row_range(self, start=None, end=None):
+        """Return (lo, hi) row indices with start <= ts < end."""
+        lo = 0 if start is None else bisect_left(self.ts, start)
+        hi = self.rows if end is None else bisect_left(self.ts, end)
+        return lo, hi
+
+    def _strings(self, name, lo, hi):
+        blob = self._columns[name]
+        offsets = self._columns[name + '.offsets']
+        nulls = self._columns[name + '.nulls']
+        return [None if nulls[i] else str(blob[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(lo, hi)]
+
+    def _categories(self, name, lo, hi):
+        dictionary = self._dictionaries[name]
+        return [None if code == _NULL_CODE else dictionary[code] for code in self._columns[name][lo:hi]]
+
+    def _numbers(self, name, lo, hi):
+        types = self._columns[name + '.types'][lo:hi]
+        other = self._columns.get(name + '.other.offsets')
+        other = [None if text is None else json.loads(text) for text in self._strings(name + '.other', lo, hi)] \
+            if other is not None else None
+        out = []
+        for i, (value, row_type) in enumerate(zip(self._columns[name][lo:hi], types)):
+            if row_type == _NUM_INT:
+                out.append(int(value))
+            elif row_type == _NUM_FLOAT:
+                out.append(value)
+            elif row_type == _NUM_TEXT:
+                out.append(str(int(value)))
+            elif row_type == _NUM_OTHER and other is not None:
+                out.append(other[i])
+            else:
+                out.append(None)
+        return out
+
+    def _metric(self, name, lo, hi):
+        """A metric column as API values: 'Failed', or an int where its int flag is set."""
+        values = self._columns[name][lo:hi].tolist()
+        flags = self._columns.get(_INT_FLAGS[name])
+        if flags is not None:
+            values = [int(v) if integral else v for v, integral in zip(values, flags[lo:hi])]
+        failed = self._columns.get(_FAILED_FLAGS.get(name))
+        if failed is not None:
+            values = [FAILED if f else v for v, f in zip(values, failed[lo:hi])]
+        return values
+
+    def _code(self, name, value):
+        codes = self._codes.get(name)
+        if codes is None:
+            codes = self._codes[name] = {v: i for i, v in enumerate(self._dictionaries[name])}
+        return codes.get(value)
+
+    def select(self, lo, hi, fields=None, failed_only=False):
+        """Ascending row indices in lo..hi passing the column filters, or None without any.
+
+        fields are equality conditions; only categorical columns are checked
+        here, so callers still apply the full filter to the records returned.
+        failed_only keeps rows with a failed download or ping.
+        """
+        if not fields and not failed_only:
+            return None
+        rows = range(lo, hi)
+        for name, value in (fields or {}).items():
+            if name not in self._dictionaries:
+                continue
+            code = self._code(name, value)
+            if code is None:
+                return []
+            column = self._columns[name]
+            rows = [i for i in rows if column[i] == code]
+        if failed_only:
+            download, ping = self._columns['download_failed'], self._columns['ping_failed']
+            rows = [i for i in rows if download[i] or ping[i]]
+        return list(rows)
+
+    def request_ids(self, lo=0, hi=None):
+        return self._strings('request_id', lo, self.rows if hi is None else hi)
+
+    def request_id_set(self):
+        """All request_ids in the segment, built once (segments never change)."""
+        if self._id_set is None:
+            self._id_set = frozenset(filter(None, self.request_ids()))
+        return self._id_set
+
+    def records(self, lo=0, hi=None):
+        """Materialize rows lo..hi as API-shaped dicts, oldest first."""
+        hi = self.rows if hi is None else hi
+        if hi <= lo:
+            return []
+        values = {
+            'download_speed': self._metric('download_speed', lo, hi),
+            'ping_ms': self._metric('ping_ms', lo, hi),
+            'upload_speed': self._metric('upload_speed', lo, hi),
+            'sites_ok': self._columns['sites_ok'][lo:hi].tolist(),
+            'sites_total': self._columns['sites_total'][lo:hi].tolist(),
+        }
+        for name in RECORD_FIELDS:
+            if name in values:
+                continue
+            kind = self._kinds.get(name)
+            if kind is None:
+                # Written before the column existed
+                values[name] = [None] * (hi - lo)
+            elif kind == 'num':
+                values[name] = self._numbers(name, lo, hi)
+            elif kind == 'cat':
+                values[name] = self._categories(name, lo, hi)
+            elif kind == 'str':
+                values[name] = self._strings(name, lo, hi)
+            elif kind == 'json':
+                values[name] = [None if text is None else json.loads(text)
+                                for text in self._strings(name, lo, hi)]
+        columns = [values[name] for name in RECORD_FIELDS]
+        return [dict(zip(RECORD_FIELDS, row)) for row in zip(*columns)]
+
+    def site_checks(self, lo=0, hi=None):
+        """Site checks of rows lo..hi (None where a row has none), oldest first."""
+        hi = self.rows if hi is None else hi
+        for name in (SITE_CHECKS, _LEGACY_SITE_CHECKS):
+            if name in self._columns:
+                return [None if text is None else json.loads(text) for text in self._strings(name, lo, hi)]
+        return [None] * max(0, hi - lo)
+
+    def acquire(self):
+        self._readers += 1
+
+    def release(self):
+        self._readers -= 1
+        if self._retired and not self._readers:
+            self.close()
+
+    def retire(self):
+        """Close the segment now, or when the last reader releases it."""
+        self._retired = True
+        if not self._readers:
+            self.close()
+
+    def close(self):
+        self._columns.clear()
+        self.ts = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # a caller still holds a view; the map closes when it is released
+
+
+class TelemetryStore:
+    """Append-only, day-partitioned segment store with time-range reads."""
+
+    def __init__(self, root=None, compact_threshold=COMPACT_THRESHOLD):
+        self.root = root or os.environ.get('DASHBOARD_STORE_DIR', DEFAULT_STORE_DIR)
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._segments = {}  # path -> Segment
+        os.makedirs(self.root, exist_ok=True)
+
+    # --- layout helpers ---
+    def _day_dir(self, day):
+        return os.path.join(self.root, f'day={day}')
+
+    def days(self):
+        """Return the partition days present, oldest first."""
+        days = []
+        for name in os.listdir(self.root):
+            if name.startswith('day=') and os.path.isdir(os.path.join(self.root, name)):
+                days.append(name[4:])
+        return sorted(days)
+
+    def _segment_paths(self, day):
+        directory = self._day_dir(day)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def _open(self, path):
+        with self._lock:
+            segment = self._segments.get(path)
+            if segment is None:
+                segment = self._segments[path] = Segment(path)
+            return segment
+
+    @contextmanager
+    def _day_lock(self, day):
+        """Hold the day's writer lock, across threads and processes."""
+        directory = self._day_dir(day)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, LOCK_FILE), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # released when f is closed
+            with self._lock:
+                yield
+
+    def _forget(self, path):
+        segment = self._segments.pop(path, None)
+        if segment is not None:
+            segment.retire()
+
+    def _write_atomic(self, path, data):
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _next_segment_path(self, day):
+        """Name for the day's next segment; caller holds the day lock until it is written."""
+        paths = self._segment_paths(day)
+        seq = int(os.path.basename(paths[-1])[4:10]) + 1 if paths else 1
+        return os.path.join(self._day_dir(day), f'seg-{seq:06d}{SEGMENT_SUFFIX}')
+
+    # --- writes ---
+    def append(self, records, site_checks=None):
+        """Append records as one new segment per day they fall in; returns rows written.
+
+        site_checks optionally holds each record's site checks, in the order of
+        records. Records whose request_id the day already holds, or that repeat
+        one earlier in records, are skipped, so overlapping syncs and backfills
+        never store a row twice.
+        """
+        by_day = {}
+        for record, checks in zip(records, repeat(None) if site_checks is None else site_checks):
+            if record.get('publish_time'):
+                day_rows = by_day.setdefault(_day_of(to_epoch(record['publish_time'])), ([], []))
+                day_rows[0].append(record)
+                day_rows[1].append(checks)
+        written = 0
+        for day, (day_records, day_checks) in by_day.items():
+            with self._day_lock(day):
+                held = set()
+                for path in self._segment_paths(day):
+                    held.update(self._open(path).request_id_set())
+                new_records, new_checks = [], []
+                for record, checks in zip(day_records, day_checks):
+                    request_id = record.get('request_id')
+                    if request_id:
+                        if request_id in held:
+                            continue
+                        held.add(request_id)
+                    new_records.append(record)
+                    new_checks.append(checks)
+                if not new_records:
+                    continue
+                self._write_atomic(self._next_segment_path(day), encode_segment(new_records, new_checks))
+                written += len(new_records)
+                if len(self._segment_paths(day)) > self.compact_threshold:
+                    self._compact(day)
+        return written
+
+    def compact(self, day):
+        """Merge all segments of a day into one."""
+        with self._day_lock(day):
+            self._compact(day)
+
+    def _compact(self, day):
+        paths = self._segment_paths(day)
+        if len(paths) < 2:
+            return
+        rows = {}
+        for path in paths:
+            segment = self._open(path)
+            for record, checks in zip(segment.records(), segment.site_checks()):
+                rows[record.get('request_id') or id(record)] = (record, checks)
+        target = self._next_segment_path(day)
+        self._write_atomic(target, encode_segment([record for record, _ in rows.values()],
+                                                  [checks for _, checks in rows.values()]))
+        for path in paths:
+            os.remove(path)
+            # Readers in other processes keep their own mapping, valid after the unlink
+            self._forget(path)
+
+    # --- reads ---
+    def _segments_between(self, start, end):
+        first_day = _day_of(start) if start is not None else None
+        last_day = _day_of(end) if end is not None else None
+        for day in self.days():
+            if (first_day and day < first_day) or (last_day and day > last_day):
+                continue
+            paths = self._segment_paths(day)
+            # Segments compacted away by another process
+            directory = self._day_dir(day)
+            listed = set(paths)
+            for path in [p for p in self._segments if os.path.dirname(p) == directory and p not in listed]:
+                self._forget(path)
+            for path in paths:
+                try:
+                    segment = self._open(path)
+                except FileNotFoundError:
+                    continue  # compacted away between listing and opening
+                if segment.rows == 0:
+                    continue
+                if start is not None and segment.max_ts < start:
+                    continue
+                if end is not None and segment.min_ts >= end:
+                    continue
+                yield segment
+
+    def _slices(self, start, end):
+        """(segment, lo, hi) row ranges holding start <= publish_time < end.
+
+        Each segment is acquired; callers hand the slices to _release() when done.
+        """
+        start = to_epoch(start) if start is not None else None
+        end = to_epoch(end) if end is not None else None
+        with self._lock:
+            slices = []
+            for segment in self._segments_between(start, end):
+                lo, hi = segment.row_range(start, end)
+                if hi > lo:
+                    segment.acquire()
+                    slices.append((segment, lo, hi))
+        return slices
+
+    def _release(self, slices):
+        with self._lock:
+            for segment, _, _ in slices:
+                segment.release()
+
+    def scan(self, start=None, end=None, limit=None):
+        """Return records with start <= publish_time < end, newest first.
+
+        start/end may be epoch seconds, datetimes or timestamp strings. With
+        limit, only the newest `limit` matching records are materialized.
+        """
+        slices = self._slices(start, end)
+        # Walk slices newest-first so a limit can stop early once no
+        # remaining slice can hold anything newer than the current cutoff
+        slices.sort(key=lambda s: s[0].ts[s[2] - 1], reverse=True)
+        out = []
+        cutoff = None
+        try:
+            for segment, lo, hi in slices:
+                if cutoff is not None and segment.ts[hi - 1] < cutoff:
+                    break
+                if limit is not None:
+                    lo = max(lo, hi - limit)
+                out.extend(zip(segment.ts[lo:hi].tolist(), segment.records(lo, hi)))
+                if limit is not None and len(out) >= limit:
+                    out.sort(key=lambda item: item[0], reverse=True)
+                    del out[limit:]
+                    cutoff = out[-1][0]
+        finally:
+            self._release(slices)
+        out.sort(key=lambda item: item[0], reverse=True)
+        return [record for _, record in out]
+
+    def iter_scan(self, start=None, end=None, batch_size=STREAM_BATCH):
+        """Yield records with start <= publish_time < end, newest first.
+
+        Ties on publish_time are ordered by request_id, descending. Unlike
+        scan(), at most batch_size rows per overlapping segment are
+        materialized at a time, so ranges of any size stream in flat memory.
+        """
+        for _, record in self.iter_rows(start, end, batch_size=batch_size):
+            yield record
+
+    def iter_rows(self, start=None, end=None, fields=None, failed_only=False, batch_size=STREAM_BATCH):
+        """Yield ((epoch, request_id), record) for every row in range, newest first.
+
+        Rows failing the column filters (see Segment.select) are yielded with
+        record None and are never materialized, so callers can bound a scan
+        by rows examined and still know how far it got.
+        """
+        def walk(segment, lo, hi):
+            while hi > lo:
+                low = max(lo, hi - batch_size)
+                timestamps = segment.ts[low:hi].tolist()
+                ids = segment.request_ids(low, hi)
+                selected = segment.select(low, hi, fields, failed_only)
+                if selected is None:
+                    records = segment.records(low, hi)
+                else:
+                    records = [None] * (hi - low)
+                    for run_lo, run_hi in _runs(selected):
+                        records[run_lo - low:run_hi - low] = segment.records(run_lo, run_hi)
+                for ts, request_id, record in zip(reversed(timestamps), reversed(ids), reversed(records)):
+                    yield (ts, request_id or ''), record
+                hi = low
+        # Slices whose time ranges overlap are merged; the groups, newest first,
+        # are chained, so a walk only starts once the scan reaches its rows
+        slices = self._slices(start, end)
+        try:
+            groups = []
+            for segment, lo, hi in sorted(slices, key=lambda s: s[0].ts[s[2] - 1], reverse=True):
+                if groups and segment.ts[hi - 1] >= groups[-1][0]:
+                    groups[-1][0] = min(groups[-1][0], segment.ts[lo])
+                    groups[-1][1].append((segment, lo, hi))
+                else:
+                    groups.append([segment.ts[lo], [(segment, lo, hi)]])
+            for _, group in groups:
+                yield from heapq.merge(*[walk(*s) for s in group], key=itemgetter(0), reverse=True)
+        finally:
+            self._release(slices)
+
+    def iter_site_checks(self, start=None, end=None, batch_size=STREAM_BATCH):
+        """Yield (record, site checks) for rows with start <= publish_time < end that have checks.
+
+        Segments are read one batch at a time, in no particular order.
+        """
+        slices = self._slices(start, end)
+        try:
+            for segment, lo, hi in slices:
+                for low in range(lo, hi, batch_size):
+                    high = min(hi, low + batch_size)
+                    for record, checks in zip(segment.records(low, high), segment.site_checks(low, high)):
+                        if checks:
+                            yield record, checks
+        finally:
+            self._release(slices)
+
+    def latest(self, limit):
+        """Return the newest `limit` records."""
+        return self.scan(limit=limit)
+
+    def count(self, start=None, end=None):
+        start = to_epoch(start) if start is not None else None
+        end = to_epoch(end) if end is not None else None
+        with self._lock:
+            total = 0
+            for segment in self._segments_between(start, end):
+                lo, hi = segment.row_range(start, end)
+                total += hi - lo
+            return total
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+
+def _runs(rows):
+    """Split ascending row indices into (lo, hi) runs of consecutive rows."""
+    runs = []
+    for i in rows:
+        if runs and runs[-1][1] == i:
+            runs[-1][1] = i + 1
+        else:
+            runs.append([i, i + 1])
+    return runs
+
+
+def day_range(days_back, now=None):
+    """Return (start, end) epoch seconds covering the last days_back days."""
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=days_back)).timestamp(), now.timestamp() + 1
+
@@ -0,0 +1,179 @@
+"""
+Incremental telemetry sync for the dashboard server.
+
+Instead of re-pulling the newest N rows on every refresh, IncrementalSync
+remembers a watermark (the newest ingestReceivedAt/requestId it has seen),
+pages through only the rows after it, enriches just those, and merges them
+into the records it already holds, de-duplicated on request_id. Records
+are held as CompactRecords (compact_records.py), sharing categorical values
+through dictionaries of the sync's own, so each tenant keeps its own.
+
+Site checks are not held: each sync hands the checks of the records it
+added to site-check listeners and back to the caller (for the store), and
+then lets them go.
+
+The watermark starts a short lookback window early so rows that land in
+BigQuery slightly out of order are still picked up; de-duplication absorbs
+the overlap.
+"""
+
+from datetime import datetime, timedelta
+import threading
+
+from compact_records import CompactRecord, from_batch, new_dictionaries
+from enrichment import enrich_batch
+from metrics import span
+
+# Rows pulled on the very first sync, before any watermark exists
+DEFAULT_INITIAL_LIMIT = 500
+# Rows fetched per keyset page on incremental syncs
+DEFAULT_PAGE_SIZE = 1000
+# Records kept in memory (newest first)
+DEFAULT_MAX_RECORDS = 5000
+# Seconds re-scanned behind the watermark to catch late-arriving rows
+DEFAULT_LOOKBACK_SECONDS = 120
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_timestamp(value):
+    """Parse the timestamp strings BigQuery/bq/SQLite hand back (UTC assumed)."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    text = str(value).strip().replace('T', ' ')
+    for suffix in (' UTC', 'Z', '+00:00'):
+        if text.endswith(suffix):
+            text = text[:-len(suffix)]
+    return datetime.fromisoformat(text)
+
+
+def record_key(record):
+    """De-duplication key: request_id, or publish time for legacy rows without one."""
+    return record.get('request_id') or f"{record.get('publish_time')}|{record.get('duration_ms')}"
+
+
+class IncrementalSync:
+    """Keeps the newest enriched records in memory, fetching only new rows."""
+
+    def __init__(self, backend, max_records=DEFAULT_MAX_RECORDS, initial_limit=DEFAULT_INITIAL_LIMIT,
+                 page_size=DEFAULT_PAGE_SIZE, lookback_seconds=DEFAULT_LOOKBACK_SECONDS):
+        self.backend = backend
+        self.max_records = max_records
+        self.initial_limit = initial_limit
+        self.page_size = page_size
+        self.lookback = timedelta(seconds=lookback_seconds)
+        self._lock = threading.Lock()
+        self._records = []  # newest first
+        self._keys = set()
+        self.dictionaries = new_dictionaries()
+        self.watermark = None  # (publish_time, request_id) of the newest row seen
+        # Callables invoked as listener(added, dropped) after records change
+        self.listeners = []
+        # Callables invoked as listener(added, site_checks) after records are added
+        self.check_listeners = []
+
+    def seed(self, records):
+        """Load previously enriched records (e.g. from the local store)."""
+        with self._lock:
+            self._notify(*self._merge(records))
+
+    def records(self):
+        """Return a snapshot of the held records, newest first."""
+        with self._lock:
+            return list(self._records)
+
+    def count(self):
+        """Number of held records, without copying them."""
+        with self._lock:
+            return len(self._records)
+
+    def sync(self):
+        """Fetch and merge rows newer than the watermark.
+
+        Returns (added, site_checks): the new records and, for each of them,
+        its site checks.
+        """
+        if self.watermark is None:
+            rows = self.backend.run('latest_rows', limit=self.initial_limit)
+        else:
+            rows = self._fetch_since(self.watermark)
+        with span('enrich'):
+            batch = enrich_batch(rows)
+            new_records = from_batch(batch, self.dictionaries)
+            checks = {id(record): record_checks for record, record_checks in zip(new_records, batch.site_checks())}
+        with self._lock:
+            added, dropped = self._merge(new_records)
+            site_checks = [checks.get(id(record)) for record in added]
+            self._notify(added, dropped)
+            if added:
+                for listener in self.check_listeners:
+                    listener(added, site_checks)
+        return added, site_checks
+
+    def subscribe(self, listener):
+        """Register listener(added, dropped); it is first fed the records already held."""
+        with self._lock:
+            self.listeners.append(listener)
+            if self._records:
+                listener(list(self._records), [])
+
+    def subscribe_checks(self, listener):
+        """Register listener(added, site_checks) for the site checks of records synced from now on."""
+        with self._lock:
+            self.check_listeners.append(listener)
+
+    def _notify(self, added, dropped):
+        """Tell listeners about a change; caller holds the lock so updates stay ordered."""
+        if not added and not dropped:
+            return
+        for listener in self.listeners:
+            listener(added, dropped)
+
+    def _fetch_since(self, watermark):
+        since = parse_timestamp(watermark[0]) - self.lookback
+        cursor = (since.strftime(TIMESTAMP_FORMAT), '')
+        rows = []
+        while True:
+            page = self.backend.run('rows_since', since_ts=cursor[0], since_id=cursor[1], limit=self.page_size)
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+            if len(rows) >= self.max_records:
+                # Too far behind to catch up incrementally; re-baseline on the newest rows
+                return self.backend.run('latest_rows', limit=self.max_records)
+            last = page[-1]
+            next_cursor = (str(last.get('publish_time')), last.get('requestId') or '')
+            if next_cursor == cursor:
+                return rows  # page of rows the keyset cannot tell apart
+            cursor = next_cursor
+
+    def _merge(self, records):
+        """Merge records into the held set; caller holds the lock.
+
+        Returns (added, dropped): the new records and those evicted by max_records.
+        """
+        added = []
+        for record in records:
+            key = record_key(record)
+            if key in self._keys or not record.get('publish_time'):
+                continue
+            self._keys.add(key)
+            added.append(CompactRecord.from_mapping(record, self.dictionaries))
+        if not added:
+            return added, []
+        added.sort(key=lambda r: parse_timestamp(r['publish_time']), reverse=True)
+        if not self._records or parse_timestamp(added[-1]['publish_time']) >= parse_timestamp(self._records[0]['publish_time']):
+            # Common case: everything new is newer than what we hold
+            self._records[:0] = added
+        else:
+            self._records.extend(added)
+            self._records.sort(key=lambda r: parse_timestamp(r['publish_time']), reverse=True)
+        dropped = self._records[self.max_records:]
+        for record in dropped:
+            self._keys.discard(record_key(record))
+        del self._records[self.max_records:]
+        newest = self._records[0]
+        candidate = (newest['publish_time'], newest.get('request_id') or '')
+        if self.watermark is None or parse_timestamp(candidate[0]) >= parse_timestamp(self.watermark[0]):
+            self.watermark = candidate
+        return added, dropped
@@ -0,0 +1,174 @@
+"""
+Tenant (school district) configuration and the shared query budget.
+
+One dashboard server can serve several districts. Each tenant reads its own
+table and has its own query concurrency share and a memory quota for its
+query-result and payload caches (held records are bounded by max_records). Tenants are read from the JSON file named by DASHBOARD_TENANTS (or
+--tenants):
+
+    {
+      "district-a": {"table": "proj.district_a.pubsub_raw", "max_queries": 4, "memory_mb": 128},
+      "district-b": {"table": "proj.district_b.pubsub_raw"}
+    }
+
+Without one, a single tenant called "default" serves TELEMETRY_TABLE as before.
+
+QueryBudget caps backend queries node-wide and per tenant. A tenant that
+uses up its share waits for its own queries to finish, so one large district
+cannot occupy every slot and starve the rest.
+"""
+
+from contextlib import contextmanager
+import json
+import math
+import os
+import re
+import threading
+
+from query_backend import QUERY_TIMEOUT, QueryError
+
+DEFAULT_TENANT = 'default'
+DEFAULT_MEMORY_MB = 256
+# Backend queries in flight across all tenants
+DEFAULT_TOTAL_QUERIES = 8
+TENANT_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class TenantConfig:
+    """Settings of one tenant; None means the server-wide default."""
+
+    OPTIONS = ('table', 'backend', 'sqlite_path', 'store_dir', 'max_queries', 'memory_mb', 'max_records')
+
+    def __init__(self, name, table=None, backend=None, sqlite_path=None, store_dir=None,
+                 max_queries=None, memory_mb=DEFAULT_MEMORY_MB, max_records=None):
+        if not TENANT_NAME.match(name):
+            raise ValueError(f'invalid tenant name {name!r}: use letters, digits, - and _')
+        self.name = name
+        self.table = table
+        self.backend = backend
+        self.sqlite_path = sqlite_path
+        self.store_dir = store_dir
+        self.max_queries = max_queries
+        self.memory_mb = memory_mb
+        self.max_records = max_records
+
+    @property
+    def memory_bytes(self):
+        return int(self.memory_mb * 1024 * 1024) if self.memory_mb else None
+
+    @classmethod
+    def from_dict(cls, name, options):
+        if not isinstance(options, dict):
+            raise ValueError(f'tenant {name!r}: expected an object of options')
+        unknown = set(options) - set(cls.OPTIONS)
+        if unknown:
+            raise ValueError(f'tenant {name!r}: unknown option(s) {", ".join(sorted(unknown))}')
+        return cls(name, **options)
+
+    def to_dict(self):
+        return {'name': self.name, **{option: getattr(self, option) for option in self.OPTIONS}}
+
+
+def load_tenants(path=None):
+    """Tenant configs from the JSON file at path (or DASHBOARD_TENANTS), in file order.
+
+    Raises ValueError for a malformed file.
+    """
+    path = path or os.environ.get('DASHBOARD_TENANTS')
+    if not path:
+        return [TenantConfig(DEFAULT_TENANT)]
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or not data:
+        raise ValueError(f'{path}: expected a non-empty object of tenant name -> options')
+    return [TenantConfig.from_dict(name, options) for name, options in data.items()]
+
+
+class QueryBudget:
+    """Node-wide and per-tenant caps on concurrent backend queries."""
+
+    def __init__(self, total=DEFAULT_TOTAL_QUERIES, timeout=QUERY_TIMEOUT):
+        self.total = max(1, total)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.total)
+        self._lock = threading.Lock()
+        self._tenants = {}  # name -> [semaphore, limit, in flight, waiting]
+
+    def fair_share(self, tenants):
+        """Default per-tenant limit: an equal split of the total, at least one."""
+        return max(1, math.ceil(self.total / max(1, tenants)))
+
+    def register(self, name, limit):
+        limit = max(1, min(int(limit), self.total))
+        with self._lock:
+            self._tenants[name] = [threading.BoundedSemaphore(limit), limit, 0, 0]
+
+    @contextmanager
+    def slot(self, name):
+        """Hold one of the tenant's query slots and one node-wide slot.
+
+        Raises QueryError when none frees up within the timeout.
+        """
+        state = self._tenants[name]
+        with self._lock:
+            state[3] += 1
+        try:
+            if not state[0].acquire(timeout=self.timeout):
+                raise QueryError(f'tenant {name} is over its query budget')
+            if not self._slots.acquire(timeout=self.timeout):
+                state[0].release()
+                raise QueryError('query budget exhausted')
+        finally:
+            with self._lock:
+                state[3] -= 1
+        with self._lock:
+            state[2] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                state[2] -= 1
+            self._slots.release()
+            state[0].release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'total': self.total,
+                'in_flight': sum(state[2] for state in self._tenants.values()),
+                'tenants': {name: {'limit': state[1], 'in_flight': state[2], 'waiting': state[3]}
+                            for name, state in self._tenants.items()},
+            }
+
+
+class BudgetedBackend:
+    """Wraps a query backend so every query runs inside its tenant's budget slot."""
+
+    def __init__(self, backend, budget, tenant):
+        self.backend = backend
+        self.budget = budget
+        self.tenant = tenant
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    @property
+    def table(self):
+        return self.backend.table
+
+    def render(self, name):
+        return self.backend.render(name)
+
+    def run(self, name, **params):
+        return self.query(self.render(name), params)
+
+    def query(self, sql, params=None):
+        with self.budget.slot(self.tenant):
+            return self.backend.query(sql, params)
+
+    def check_access(self):
+        return self.backend.check_access()
+
+    def close(self):
+        self.backend.close()
@@ -59,7 +59,6 @@ if [ "$http_code" = "202" ]; then
     sleep 10
     
     echo "🔍 Checking BigQuery for new data..."
-    export PATH="/Users/jwilder/google-cloud-sdk/bin:$PATH"
     python3 fetch-data.py
 else
     echo "❌ Test failed with HTTP $http_code"
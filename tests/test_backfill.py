@@ -0,0 +1,99 @@
+"""Backfill resume: a run cut short between writing a page and checkpointing it leaves no duplicates."""
+
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backfill  # noqa: E402
+from query_backend import SyntheticBackend  # noqa: E402
+from telemetry_store import TelemetryStore  # noqa: E402
+
+ROWS = 500
+PAGE_SIZE = 60
+
+
+class CrashingManifest(backfill.Manifest):
+    """Fails the checkpoint after the third page, as if the process died right after writing it."""
+
+    checkpoints = 0
+
+    def update(self, day, **state):
+        if state.get('status') == 'partial':
+            type(self).checkpoints += 1
+            if type(self).checkpoints == 3:
+                raise OSError('simulated crash before checkpoint')
+        super().update(day, **state)
+
+
+class BackfillResumeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.backend = SyntheticBackend(rows=ROWS, latency=0, pool_size=2)
+        today = datetime.now(timezone.utc).date()
+        cls.start, cls.end = today - timedelta(days=1), today
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.backend.close()
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp(prefix='backfill-test-')
+        CrashingManifest.checkpoints = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.output, ignore_errors=True)
+
+    def run_twice(self, fmt):
+        with mock.patch.object(backfill, 'Manifest', CrashingManifest):
+            first = backfill.backfill(self.backend, self.start, self.end, self.output, fmt=fmt, workers=1,
+                                      page_size=PAGE_SIZE, retries=0, progress=lambda message: None)
+        self.assertTrue(first['failed'])
+        second = backfill.backfill(self.backend, self.start, self.end, self.output, fmt=fmt, workers=1,
+                                   page_size=PAGE_SIZE, retries=0, progress=lambda message: None)
+        self.assertEqual(second['failed'], [])
+
+    def test_store_resume_keeps_every_row_once(self):
+        self.run_twice('store')
+        store = TelemetryStore(self.output)
+        try:
+            ids = [record['request_id'] for record in store.scan()]
+        finally:
+            store.close()
+        self.assertEqual(len(ids), ROWS)
+        self.assertEqual(len(set(ids)), ROWS)
+
+    def test_store_backfill_over_synced_days_adds_nothing(self):
+        self.run_twice('store')
+        summary = backfill.backfill(self.backend, self.start, self.end, self.output, fmt='store', workers=1,
+                                    page_size=PAGE_SIZE, retries=0, progress=lambda message: None)
+        self.assertEqual(summary['done'], 0)  # every window already completed
+        os.remove(os.path.join(self.output, backfill.MANIFEST_NAME))
+        backfill.backfill(self.backend, self.start, self.end, self.output, fmt='store', workers=2,
+                          page_size=PAGE_SIZE, retries=0, progress=lambda message: None)
+        store = TelemetryStore(self.output)
+        try:
+            self.assertEqual(store.count(), ROWS)
+        finally:
+            store.close()
+
+    def test_ndjson_resume_keeps_every_row_once(self):
+        self.run_twice('ndjson')
+        ids = []
+        for name in sorted(os.listdir(self.output)):
+            if name.endswith('.ndjson'):
+                with open(os.path.join(self.output, name)) as f:
+                    ids.extend(json.loads(line)['request_id'] for line in f)
+        self.assertEqual(len(ids), ROWS)
+        self.assertEqual(len(set(ids)), ROWS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+"""Request coalescing and result caching: SingleFlight, StaleWhileRevalidate and ResultCache."""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_cache import ResultCache  # noqa: E402
+from singleflight import SingleFlight, StaleWhileRevalidate  # noqa: E402
+
+CALLERS = 8
+
+
+class CountingFlight(SingleFlight):
+    """SingleFlight that counts callers who joined a call already in flight."""
+
+    def __init__(self):
+        super().__init__()
+        self.joined = 0
+        self.joined_lock = threading.Lock()
+
+    def _start(self, key):
+        call, leader = super()._start(key)
+        if not leader:
+            with self.joined_lock:
+                self.joined += 1
+        return call, leader
+
+    def wait_for_joined(self, count, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.joined_lock:
+                if self.joined >= count:
+                    return
+            time.sleep(0.005)
+        raise AssertionError(f'only {self.joined} of {count} callers joined')
+
+
+def in_threads(target, count=CALLERS):
+    """Start target() in count threads; returns (threads, results, errors), filled in as they finish."""
+    results, errors = [], []
+
+    def run():
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def join(threads):
+    for thread in threads:
+        thread.join(5)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = CountingFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow(self, result=None, error=None):
+        def fn():
+            self.calls += 1
+            self.release.wait(5)
+            if error is not None:
+                raise error
+            return result
+        return fn
+
+    def test_concurrent_callers_share_one_call(self):
+        fn = self.slow(result=['row'])
+        threads, results, errors = in_threads(lambda: self.flight.do('q', fn))
+        self.flight.wait_for_joined(CALLERS - 1)
+        self.release.set()
+        join(threads)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [['row']] * CALLERS)
+        self.assertFalse(self.flight.in_flight('q'))
+
+    def test_errors_reach_every_joined_caller(self):
+        fn = self.slow(error=ValueError('backend down'))
+        threads, results, errors = in_threads(lambda: self.flight.do('q', fn))
+        self.flight.wait_for_joined(CALLERS - 1)
+        self.release.set()
+        join(threads)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ['backend down'] * CALLERS)
+        # The failed call is not remembered; the next caller starts a new one
+        self.assertEqual(self.flight.do('q', lambda: 'ok'), 'ok')
+
+    def test_different_keys_do_not_share(self):
+        self.assertEqual(self.flight.do('a', lambda: 1), 1)
+        self.assertEqual(self.flight.do('b', lambda: 2), 2)
+
+
+class StaleWhileRevalidateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = CountingFlight()
+        self.cache = StaleWhileRevalidate(self.flight, retry_delay=10, max_retry_delay=40)
+        self.loads = 0
+
+    def loader(self, value):
+        def load():
+            self.loads += 1
+            return value
+        return load
+
+    def test_cold_callers_wait_for_one_load(self):
+        release = threading.Event()
+
+        def load():
+            self.loads += 1
+            release.wait(5)
+            return ['rows']
+        threads, results, errors = in_threads(lambda: self.cache.get('k', load, ttl=60))
+        self.flight.wait_for_joined(CALLERS - 1)
+        release.set()
+        join(threads)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(results, [['rows']] * CALLERS)
+        self.assertEqual(self.cache.misses, CALLERS)
+
+    def test_stale_value_served_while_one_refresh_runs(self):
+        self.cache.seed('k', 'old', fetched_at=time.time() - 120)
+        release = threading.Event()
+
+        def load():
+            self.loads += 1
+            release.wait(5)
+            return 'new'
+        served = [self.cache.get('k', load, ttl=60) for _ in range(CALLERS)]
+        self.assertEqual(served, ['old'] * CALLERS)
+        self.assertEqual(self.cache.stale, CALLERS)
+        release.set()
+        for _ in range(200):
+            if not self.flight.in_flight('k'):
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.get('k', load, ttl=60), 'new')
+
+    def test_failed_refreshes_back_off(self):
+        now = time.time()
+        self.cache.seed('k', 'good', fetched_at=now - 120)
+        with self.assertRaises(ValueError):
+            self.cache.refresh('k', mock.Mock(side_effect=ValueError('down')))
+        self.assertAlmostEqual(self.cache.retry_at('k'), now + 10, delta=1)
+        failing = mock.Mock(side_effect=ValueError('down'))
+        self.assertEqual(self.cache.get('k', failing, ttl=60), 'good')
+        failing.assert_not_called()  # still within the backoff
+        self.assertEqual(self.cache.refresh('k', mock.Mock(return_value=None)), 'good')
+        self.assertEqual(self.cache.peek('k')[0], 'good')  # an empty result keeps the last good value
+        self.assertAlmostEqual(self.cache.retry_at('k'), now + 20, delta=1)
+        with mock.patch('singleflight.time.time', return_value=now + 1000):
+            self.assertEqual(self.cache.get('k', self.loader('fresh'), ttl=60), 'good')
+        for _ in range(200):
+            if not self.flight.in_flight('k'):
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.peek('k')[0], 'fresh')
+        self.assertIsNone(self.cache.retry_at('k'))
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def test_entries_expire_after_their_ttl(self):
+        cache = ResultCache()
+        with mock.patch('result_cache.time.time', return_value=1000):
+            cache.set('short', 1, ttl=10)
+            cache.set('long', 2, ttl=100)
+        with mock.patch('result_cache.time.time', return_value=1050):
+            self.assertEqual(cache.get('short'), (False, None))
+            self.assertEqual(cache.get('long'), (True, 2))
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResultCache(max_entries=3)
+        for key in 'abc':
+            cache.set(key, key, ttl=60)
+        cache.get('a')
+        cache.set('d', 'd', ttl=60)
+        self.assertEqual(cache.get('b'), (False, None))
+        for key in 'acd':
+            self.assertEqual(cache.get(key), (True, key))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_byte_quota_evicts_oldest_entries(self):
+        rows = [{'n': i} for i in range(10)]
+        cache = ResultCache(max_bytes=250)
+        cache.set('a', rows, ttl=60)
+        cache.set('b', rows, ttl=60)
+        cache.set('c', rows, ttl=60)
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], 250)
+        self.assertEqual(cache.get('a'), (False, None))
+        self.assertEqual(cache.get('c'), (True, rows))
+        cache.set('huge', rows * 100, ttl=60)
+        self.assertEqual(cache.get('huge'), (False, None))  # larger than the quota: not cached
+        self.assertEqual(cache.get('c'), (True, rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""CompactRecords serialize exactly like the EnrichedBatch records they are built from."""
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact_records import CompactRecord, compact, from_batch, json_default, new_dictionaries  # noqa: E402
+from enrichment import enrich_batch  # noqa: E402
+from synthetic_data import raw_rows  # noqa: E402
+
+
+def mixed_rows(count=300):
+    """Synthetic rows with int, float, missing and failed metrics and int/str durations."""
+    rows = raw_rows(count, seed=7)
+    for i, row in enumerate(rows):
+        if i % 4 == 0:
+            row['speed'] = json.dumps({'downloadMbps': 45, 'uploadMbps': 12, 'pingMs': 0})
+        elif i % 4 == 1:
+            row['speed'] = json.dumps({'downloadMbps': 45.5, 'pingMs': 20})
+        elif i % 4 == 2:
+            row['speed'] = json.dumps({'downloadError': 'timeout', 'uploadMbps': 3, 'pingError': 'x'})
+        if i % 3 == 0:
+            row['durationMs'] = int(row['durationMs'])
+        elif i % 3 == 1:
+            row['durationMs'] = None
+    return rows
+
+
+def dumps(records):
+    return json.dumps(records, default=json_default)
+
+
+class CompactRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batch = enrich_batch(mixed_rows())
+        self.expected = self.batch.to_dicts()
+
+    def test_from_batch_matches_to_dicts(self):
+        records = from_batch(self.batch, new_dictionaries())
+        self.assertEqual(dumps(records), dumps(self.expected))
+        self.assertEqual([record.to_dict() for record in records], self.expected)
+
+    def test_mapping_reads_match_to_dicts(self):
+        for record, expected in zip(from_batch(self.batch), self.expected):
+            self.assertEqual(dict(record), expected)
+            for field, value in expected.items():
+                self.assertIs(type(record[field]), type(value), field)
+
+    def test_from_mapping_round_trips(self):
+        records = compact(self.expected, new_dictionaries())
+        self.assertEqual(dumps(records), dumps(self.expected))
+
+    def test_ints_stay_ints(self):
+        record = CompactRecord.from_mapping({'publish_time': 't', 'download_speed': 45, 'upload_speed': 12.0,
+                                             'ping_ms': 0, 'duration_ms': '1234'})
+        self.assertEqual(dumps(record), '{"publish_time": "t", "trigger": null, "version": null, '
+                         '"duration_ms": "1234", "user_email": null, "device_make": null, "device_type": null, '
+                         '"device_os": null, "device_os_version": null, "isp_provider": null, "city": null, '
+                         '"download_speed": 45, "upload_speed": 12.0, "ping_ms": 0, "sites_ok": 0, '
+                         '"sites_total": 0, "request_id": null}')
+
+    def test_dictionaries_are_per_holder(self):
+        first, second = new_dictionaries(), new_dictionaries()
+        from_batch(self.batch, first)
+        self.assertTrue(len(first['city']))
+        self.assertEqual(len(second['city']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+"""Content negotiation and conditional requests: Accept-Encoding q-values, per-encoding ETags and 304s."""
+
+import gzip
+import http.client
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import http_payload  # noqa: E402
+from http_payload import MIN_COMPRESS_BYTES, Payload, etag_matches, negotiate_encoding  # noqa: E402
+from tenants import TenantConfig  # noqa: E402
+
+
+def load_server():
+    spec = importlib.util.spec_from_file_location('dashboard_server', os.path.join(ROOT, 'dashboard-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class NegotiateEncodingTest(unittest.TestCase):
+
+    def negotiate(self, header, encodings=('br', 'gzip')):
+        with mock.patch.object(http_payload, 'supported_encodings', return_value=encodings):
+            return negotiate_encoding(header)
+
+    def test_preference_follows_q_values(self):
+        self.assertEqual(self.negotiate('gzip, deflate, br'), 'br')
+        self.assertEqual(self.negotiate('br;q=0.5, gzip;q=0.8'), 'gzip')
+        self.assertEqual(self.negotiate('gzip; q=0.2, br; q=0.9'), 'br')
+        self.assertEqual(self.negotiate('GZIP'), 'gzip')
+        self.assertEqual(self.negotiate('br;level=5;q=0.2, gzip;q=0.4'), 'gzip')
+
+    def test_q_zero_and_unsupported_encodings_are_refused(self):
+        self.assertIsNone(self.negotiate(None))
+        self.assertIsNone(self.negotiate(''))
+        self.assertIsNone(self.negotiate('identity'))
+        self.assertIsNone(self.negotiate('gzip;q=0, br;q=0'))
+        self.assertIsNone(self.negotiate('gzip;q=bogus'))
+        self.assertEqual(self.negotiate('br;q=0, gzip'), 'gzip')
+        self.assertEqual(self.negotiate('br', encodings=('gzip',)), None)
+
+    def test_wildcard_covers_unlisted_encodings(self):
+        self.assertEqual(self.negotiate('*'), 'br')
+        self.assertEqual(self.negotiate('br;q=0, *;q=0.5'), 'gzip')
+        self.assertIsNone(self.negotiate('*;q=0'))
+
+
+class PayloadETagTest(unittest.TestCase):
+
+    def setUp(self):
+        self.payload = Payload(b'{"rows": "' + b'x' * MIN_COMPRESS_BYTES + b'"}')
+        self.small = Payload(b'{"rows": []}')
+
+    def test_each_encoding_has_its_own_etag(self):
+        etag = self.payload.etag
+        self.assertEqual(self.payload.etag_for(None), etag)
+        self.assertEqual(self.payload.etag_for('gzip'), etag[:-1] + '-gz"')
+        self.assertEqual(self.payload.etag_for('br'), etag[:-1] + '-br"')
+        body, encoding = self.payload.encoded('gzip')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(body), self.payload.body)
+
+    def test_small_bodies_stay_identity(self):
+        self.assertIsNone(self.small.encoding_for('gzip'))
+        self.assertEqual(self.small.etag_for('gzip'), self.small.etag)
+        self.assertEqual(self.small.encoded('gzip'), (self.small.body, None))
+
+    def test_if_none_match_ignores_the_encoding_suffix(self):
+        identity, gz, br = (self.payload.etag_for(encoding) for encoding in (None, 'gzip', 'br'))
+        for header in (identity, gz, br, 'W/' + gz, f'"other", {br}', '*'):
+            for etag in (identity, gz, br):
+                self.assertTrue(etag_matches(header, etag), (header, etag))
+        for header in (None, '', '"other"', self.small.etag, self.small.etag[:-1] + '-gz"'):
+            self.assertFalse(etag_matches(header, gz), header)
+
+
+class ConditionalRequestTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.env = {name: os.environ.get(name) for name in ('DASHBOARD_SYNTHETIC_ROWS', 'DASHBOARD_SYNTHETIC_LATENCY_MS')}
+        os.environ['DASHBOARD_SYNTHETIC_ROWS'] = '300'
+        os.environ['DASHBOARD_SYNTHETIC_LATENCY_MS'] = '0'
+        cls.scratch = tempfile.mkdtemp(prefix='dashboard-test-')
+        server = cls.server = load_server()
+        config = TenantConfig('etags', backend='synthetic', store_dir=os.path.join(cls.scratch, 'store'))
+        server.configure_tenants([config], 4, 2)
+        cls.httpd = server.PooledHTTPServer(('127.0.0.1', 0), server.DashboardHandler, workers=4)
+        cls.port = cls.httpd.server_address[1]
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        for tenant in cls.server.tenants.values():
+            tenant.close()
+        cls.httpd.server_close()
+        shutil.rmtree(cls.scratch, ignore_errors=True)
+        for name, value in cls.env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    def get(self, path, **headers):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            conn.request('GET', path, headers={name.replace('_', '-'): value for name, value in headers.items()})
+            response = conn.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            conn.close()
+
+    def test_gzip_response_revalidates_to_304(self):
+        status, headers, body = self.get('/api/agg', Accept_Encoding='gzip, br;q=0')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        etag = headers['ETag']
+        self.assertTrue(etag.endswith('-gz"'), etag)
+        identity = etag[:-len('-gz"')] + '"'
+
+        status, headers, body = self.get('/api/agg', Accept_Encoding='gzip', If_None_Match=etag)
+        self.assertEqual((status, body), (304, b''))
+        self.assertEqual(headers['ETag'], etag)
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+
+        # A tag from another encoding still matches the same body
+        status, headers, _ = self.get('/api/agg', If_None_Match=etag)
+        self.assertEqual(status, 304)
+        self.assertEqual(headers['ETag'], identity)
+        status, _, _ = self.get('/api/agg', Accept_Encoding='gzip', If_None_Match=identity)
+        self.assertEqual(status, 304)
+
+    def test_changed_or_missing_tags_get_the_body(self):
+        status, headers, body = self.get('/api/agg', Accept_Encoding='gzip;q=0')
+        self.assertEqual(status, 200)
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertFalse(headers['ETag'].endswith('-gz"'))
+        status, _, again = self.get('/api/agg', If_None_Match='"stale-gz"')
+        self.assertEqual(status, 200)
+        self.assertEqual(again, body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Demand-driven prefetch: an idle tenant's background jobs stop querying until the next data request."""
+
+import http.client
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tenants import TenantConfig  # noqa: E402
+
+
+def load_server():
+    spec = importlib.util.spec_from_file_location('dashboard_server', os.path.join(ROOT, 'dashboard-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class IdlePrefetchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.env = {name: os.environ.get(name) for name in ('DASHBOARD_SYNTHETIC_ROWS', 'DASHBOARD_SYNTHETIC_LATENCY_MS')}
+        os.environ['DASHBOARD_SYNTHETIC_ROWS'] = '200'
+        os.environ['DASHBOARD_SYNTHETIC_LATENCY_MS'] = '0'
+        cls.scratch = tempfile.mkdtemp(prefix='dashboard-test-')
+        server = cls.server = load_server()
+        config = TenantConfig('idle', backend='synthetic', store_dir=os.path.join(cls.scratch, 'store'))
+        server.configure_tenants([config], 4, 2)
+        cls.tenant = server.default_tenant
+        cls.queries = []
+        backend = cls.tenant.get_backend()
+        query = backend.query
+
+        def counted_query(sql, params=None):
+            cls.queries.append(sql)
+            return query(sql, params)
+        backend.query = counted_query
+        cls.httpd = server.PooledHTTPServer(('127.0.0.1', 0), server.DashboardHandler, workers=4)
+        cls.port = cls.httpd.server_address[1]
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        for tenant in cls.server.tenants.values():
+            tenant.close()
+        cls.httpd.server_close()
+        shutil.rmtree(cls.scratch, ignore_errors=True)
+        for name, value in cls.env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    def get(self, path):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    def go_idle(self):
+        self.tenant.last_request = time.monotonic() - self.server.PREFETCH_IDLE - 1
+        # Make the held data stale, so a non-idle tenant would sync
+        value, _ = self.tenant.data_cache.peek(self.server.DATA_CACHE_KEY)
+        self.tenant.data_cache.seed(self.server.DATA_CACHE_KEY, value, fetched_at=time.time() - 3600)
+
+    def run_jobs(self):
+        del self.queries[:]
+        self.tenant.prefetch_telemetry()
+        self.tenant.prefetch_reachability_summary()
+        self.tenant.prefetch_hot_sites()
+        return len(self.queries)
+
+    def test_idle_tenant_runs_no_queries(self):
+        self.assertEqual(self.get('/api/data'), 200)
+        self.go_idle()
+        self.assertTrue(self.tenant.idle())
+        self.assertEqual(self.run_jobs(), 0)
+
+    def test_monitoring_does_not_count_as_demand(self):
+        self.assertEqual(self.get('/api/data'), 200)
+        self.go_idle()
+        for path in ('/metrics', '/api/cache/stats', '/api/tenants'):
+            self.assertEqual(self.get(path), 200)
+        self.assertTrue(self.tenant.idle())
+
+    def test_a_data_request_resumes_prefetching(self):
+        self.assertEqual(self.get('/api/data'), 200)
+        self.go_idle()
+        self.assertEqual(self.get('/api/agg/summary'), 200)
+        self.assertFalse(self.tenant.idle())
+        while self.tenant.data_cache.flight.in_flight(self.server.DATA_CACHE_KEY):
+            time.sleep(0.01)  # the stale data's background refresh
+        self.go_idle()
+        self.tenant.last_request = time.monotonic()
+        self.assertGreater(self.run_jobs(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
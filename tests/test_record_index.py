@@ -0,0 +1,191 @@
+"""Keyset paging of /api/data: cursors stay stable across inserts, and bad cursors are rejected."""
+
+import http.client
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from record_index import (RecordFilter, RecordIndex, decode_cursor, encode_cursor,  # noqa: E402
+                          page_records)
+from telemetry_store import RECORD_FIELDS, TelemetryStore  # noqa: E402
+from tenants import TenantConfig  # noqa: E402
+
+ISPS = ('COMCAST', 'FRONTIER', 'ATT-INTERNET4')
+
+
+def record(i, **values):
+    """Record i; every three records share a publish time, so pages split ties on request_id."""
+    second = i // 3
+    out = dict.fromkeys(RECORD_FIELDS)
+    out.update(publish_time=f'2026-10-16 {10 + second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}',
+               request_id=f'req-{i:05d}', trigger='manual', version='1.2.0', isp_provider=ISPS[i % 3],
+               city='Bloomington', device_type='chromebook', download_speed=40.0 + i % 7, upload_speed=10.0,
+               ping_ms=20.0, sites_ok=3, sites_total=4)
+    out.update(values)
+    return out
+
+
+def newest_first(records):
+    return [r['request_id'] for r in sorted(records, key=lambda r: (r['publish_time'], r['request_id']),
+                                            reverse=True)]
+
+
+def load_server():
+    spec = importlib.util.spec_from_file_location('dashboard_server', os.path.join(ROOT, 'dashboard-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class RecordIndexPagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.records = [record(i) for i in range(1000, 1300)]
+        self.index = RecordIndex()
+        self.index.update(self.records)
+
+    def walk(self, record_filter, limit, between_pages=None):
+        seen, cursor, pages = [], None, 0
+        while True:
+            page, next_cursor = self.index.page(record_filter, decode_cursor(cursor) if cursor else None, limit)
+            seen.extend(r['request_id'] for r in page)
+            pages += 1
+            if next_cursor is None:
+                return seen
+            if between_pages:
+                between_pages(pages)
+            cursor = next_cursor
+
+    def test_pages_cover_every_record_once(self):
+        self.assertEqual(self.walk(RecordFilter(), 40), newest_first(self.records))
+        comcast = [r for r in self.records if r['isp_provider'] == 'COMCAST']
+        self.assertEqual(self.walk(RecordFilter(fields={'isp_provider': 'COMCAST'}), 7), newest_first(comcast))
+
+    def test_cursor_is_stable_across_inserts_and_drops(self):
+        newer = [record(i) for i in range(2000, 2060)]
+        older = [record(i) for i in range(100, 130)]
+
+        def sync(pages):
+            # New rows land above the cursor; old ones and a drop land below it
+            if pages == 1:
+                self.index.update(newer[:30])
+            elif pages == 2:
+                self.index.update(newer[30:] + older, dropped=self.records[:3])
+        seen = self.walk(RecordFilter(), 50, sync)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(seen, newest_first(self.records[3:] + older))
+
+    def test_malformed_cursors_raise_value_error(self):
+        self.assertEqual(decode_cursor(encode_cursor(1760608800.0, 'req-1')), (1760608800.0, 'req-1'))
+        for text in ('not a cursor!', encode_cursor('x', 'req-1'), encode_cursor(1.0), encode_cursor(1.0, 'a', 'b'),
+                     'e30', ''):
+            with self.assertRaises(ValueError, msg=text):
+                decode_cursor(text)
+
+
+class StorePagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='paging-test-')
+        self.store = TelemetryStore(self.root)
+        self.records = [record(i) for i in range(600)]
+        for start in range(0, len(self.records), 150):
+            self.store.append(self.records[start:start + 150])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def walk(self, record_filter, limit, max_scan=10000):
+        seen, cursor = [], None
+        while True:
+            page, next_cursor = page_records(self.store, record_filter, cursor, limit, max_scan=max_scan)
+            self.assertLessEqual(len(page), limit)
+            seen.extend(r['request_id'] for r in page)
+            if next_cursor is None:
+                return seen
+            cursor = decode_cursor(next_cursor)
+
+    def test_pages_match_the_index(self):
+        index = RecordIndex()
+        index.update(self.records)
+        for record_filter in (RecordFilter(), RecordFilter(fields={'isp_provider': 'FRONTIER'})):
+            expected = newest_first(r for r in self.records if record_filter.matches(r))
+            self.assertEqual(self.walk(record_filter, 45), expected)
+            self.assertEqual([r['request_id'] for r in index.page(record_filter, limit=45)[0]], expected[:45])
+
+    def test_scan_cap_ends_pages_early_without_losing_rows(self):
+        record_filter = RecordFilter(fields={'isp_provider': 'COMCAST'})
+        page, next_cursor = page_records(self.store, record_filter, limit=100, max_scan=60)
+        self.assertEqual(len(page), 20)  # 60 rows examined, a third of them match
+        self.assertIsNotNone(next_cursor)
+        expected = newest_first(r for r in self.records if r['isp_provider'] == 'COMCAST')
+        self.assertEqual(self.walk(record_filter, 100, max_scan=60), expected)
+
+
+class DataPagingServerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.env = {name: os.environ.get(name) for name in ('DASHBOARD_SYNTHETIC_ROWS', 'DASHBOARD_SYNTHETIC_LATENCY_MS')}
+        os.environ['DASHBOARD_SYNTHETIC_ROWS'] = '300'
+        os.environ['DASHBOARD_SYNTHETIC_LATENCY_MS'] = '0'
+        cls.scratch = tempfile.mkdtemp(prefix='dashboard-test-')
+        server = cls.server = load_server()
+        config = TenantConfig('paging', backend='synthetic', store_dir=os.path.join(cls.scratch, 'store'))
+        server.configure_tenants([config], 4, 2)
+        cls.httpd = server.PooledHTTPServer(('127.0.0.1', 0), server.DashboardHandler, workers=4)
+        cls.port = cls.httpd.server_address[1]
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        for tenant in cls.server.tenants.values():
+            tenant.close()
+        cls.httpd.server_close()
+        shutil.rmtree(cls.scratch, ignore_errors=True)
+        for name, value in cls.env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    def get(self, path):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            return response.status, response.getheader('X-Next-Cursor'), response.read()
+        finally:
+            conn.close()
+
+    def test_malformed_cursor_is_a_400(self):
+        for cursor in ('garbage', encode_cursor('x', 'y'), encode_cursor(1.0)):
+            status, _, body = self.get(f'/api/data?cursor={cursor}')
+            self.assertEqual(status, 400, body)
+            self.assertIn('invalid cursor', json.loads(body)['error'])
+
+    def test_following_next_cursor_returns_every_record_once(self):
+        status, _, body = self.get('/api/data')
+        self.assertEqual(status, 200)
+        expected = [r['request_id'] for r in json.loads(body)]
+        seen, path = [], '/api/data?failed=0&limit=70'
+        while path:
+            status, cursor, body = self.get(path)
+            self.assertEqual(status, 200, body)
+            seen.extend(r['request_id'] for r in json.loads(body))
+            path = f'/api/data?failed=0&limit=70&cursor={cursor}' if cursor else None
+        self.assertEqual(seen, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
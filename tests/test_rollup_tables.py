@@ -0,0 +1,78 @@
+"""Rollup table refreshes: completed hours only, and no queries until another hour completes."""
+
+from datetime import datetime, timedelta, timezone
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query_backend import SyntheticBackend  # noqa: E402
+from rollup_tables import REPORT_DAYS, RollupTables  # noqa: E402
+
+ROWS = 500
+
+
+class CountingBackend:
+    """Passes queries through to a backend, remembering their names."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.table = backend.table
+        self.queries = []
+
+    def run(self, name, **params):
+        self.queries.append(name)
+        return self.backend.run(name, **params)
+
+
+class RollupTablesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.synthetic = SyntheticBackend(rows=ROWS, latency=0, pool_size=2)
+        self.backend = CountingBackend(self.synthetic)
+        self.tables = RollupTables(self.backend)
+        self.now = datetime.now(timezone.utc)
+        self.hour = self.now.replace(minute=0, second=0, microsecond=0)
+
+    def tearDown(self):
+        self.synthetic.close()
+
+    def total_tests(self, now):
+        return sum(row['test_count'] for row in self.tables.report('isp-totals', now=now))
+
+    def test_refresh_covers_completed_hours_only(self):
+        start, end = self.tables.refresh(self.now)
+        self.assertEqual(end, self.hour.strftime('%Y-%m-%d %H:%M:%S'))
+        self.assertEqual(self.tables.built_until, self.hour)
+        self.assertLessEqual(self.total_tests(self.now), ROWS)
+
+    def test_no_queries_until_another_hour_completes(self):
+        self.tables.refresh(self.now)
+        self.backend.queries.clear()
+        self.assertIsNone(self.tables.refresh(self.now + timedelta(minutes=30)))
+        self.assertEqual(self.backend.queries, [])
+        later = self.now + timedelta(hours=1)
+        start, _ = self.tables.refresh(later)
+        self.assertEqual(self.backend.queries, ['rollup_refresh'])
+        self.assertEqual(start, (self.hour - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S'))
+        self.assertEqual(self.total_tests(later), ROWS)
+
+    def test_due_waits_for_a_new_hour_with_synced_rows(self):
+        self.assertTrue(self.tables.due(self.now))
+        self.tables.refresh(self.now)
+        later = self.now + timedelta(hours=1)
+        self.assertFalse(self.tables.due(self.now + timedelta(minutes=30)))
+        self.assertFalse(self.tables.due(later, synced_until=self.hour - timedelta(minutes=5)))
+        self.assertTrue(self.tables.due(later, synced_until=self.hour + timedelta(minutes=5)))
+        self.assertTrue(self.tables.due(later))
+
+    def test_reports_default_to_the_dashboard_queries_window(self):
+        self.tables.refresh(self.now)
+        for name, days in REPORT_DAYS.items():
+            self.assertEqual(self.tables.report(name, now=self.now),
+                             self.tables.report(name, days, now=self.now), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Concurrency test: dashboard-server.py against the synthetic backend, in process.
+
+Starts the server on a free port with a cold cache and a simulated query
+latency, fires /api/data, /api/agg and /api/stream requests at it in
+parallel, and checks that every one gets a 200 with the same data, and that
+the concurrent cache misses were served by a single backend sync.
+
+Run: python3 -m unittest discover tests
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tenants import TenantConfig  # noqa: E402
+
+ROWS = 2000
+LATENCY_MS = 200
+WORKERS = 8
+CLIENTS = {'/api/data': 8, '/api/agg': 6, '/api/stream': 2}
+
+
+def load_server():
+    spec = importlib.util.spec_from_file_location('dashboard_server', os.path.join(ROOT, 'dashboard-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get(port, path):
+    """(status, body) of a GET; for /api/stream, the body up to the first agg event."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        if not path.startswith('/api/stream') or response.status != 200:
+            return response.status, response.read()
+        body = b''
+        while b'event: agg' not in body or not body.endswith(b'\n\n'):
+            line = response.fp.readline()
+            if not line:
+                break
+            body += line
+        return response.status, body
+    finally:
+        conn.close()
+
+
+class ServerConcurrencyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.env = {name: os.environ.get(name) for name in ('DASHBOARD_SYNTHETIC_ROWS', 'DASHBOARD_SYNTHETIC_LATENCY_MS')}
+        os.environ['DASHBOARD_SYNTHETIC_ROWS'] = str(ROWS)
+        os.environ['DASHBOARD_SYNTHETIC_LATENCY_MS'] = str(LATENCY_MS)
+        cls.scratch = tempfile.mkdtemp(prefix='dashboard-test-')
+        server = cls.server = load_server()
+        server.backend_pool_size = WORKERS
+        config = TenantConfig('loadtest', backend='synthetic', store_dir=os.path.join(cls.scratch, 'store'))
+        server.configure_tenants([config], WORKERS, WORKERS // 2)
+        cls.tenant = server.default_tenant
+
+        # Count telemetry syncs and the backend queries behind them
+        cls.fetches = 0
+        cls.queries = []
+        counter_lock = threading.Lock()
+        fetch_telemetry = cls.tenant.fetch_telemetry
+        backend = cls.tenant.get_backend()
+        query = backend.query
+
+        def counted_fetch():
+            with counter_lock:
+                cls.fetches += 1
+            return fetch_telemetry()
+
+        def counted_query(sql, params=None):
+            with counter_lock:
+                cls.queries.append(sql)
+            return query(sql, params)
+        cls.tenant.fetch_telemetry = counted_fetch
+        backend.query = counted_query
+        cls.latest_rows = backend.render('latest_rows')
+
+        cls.httpd = server.PooledHTTPServer(('127.0.0.1', 0), server.DashboardHandler, workers=WORKERS)
+        cls.port = cls.httpd.server_address[1]
+        cls.thread = threading.Thread(target=cls.httpd.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        for tenant in cls.server.tenants.values():
+            tenant.close()  # ends open streams
+        cls.httpd.server_close()
+        shutil.rmtree(cls.scratch, ignore_errors=True)
+        for name, value in cls.env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    def test_parallel_requests_share_one_sync(self):
+        paths = [path for path, n in CLIENTS.items() for _ in range(n)]
+        with ThreadPoolExecutor(len(paths)) as pool:
+            results = list(pool.map(lambda path: (path, get(self.port, path)), paths))
+
+        for path, (status, body) in results:
+            self.assertEqual(status, 200, f'{path}: {body[:200]!r}')
+        data = [body for path, (_, body) in results if path == '/api/data']
+        self.assertEqual(len(set(data)), 1, 'parallel /api/data responses differ')
+        records = json.loads(data[0])
+        self.assertTrue(records)
+        self.assertEqual(len({record['request_id'] for record in records}), len(records))
+        agg = [body for path, (_, body) in results if path == '/api/agg']
+        self.assertEqual(len(set(agg)), 1, 'parallel /api/agg responses differ')
+        self.assertEqual(json.loads(agg[0])['summary']['total_tests'], len(records))
+        for path, (_, body) in results:
+            if path == '/api/stream':
+                self.assertIn(b'event: agg', body)
+
+        # The concurrent misses coalesced into one sync and one latest_rows query
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(self.queries.count(self.latest_rows), 1)
+
+    def test_bind_failure_closes_cleanly(self):
+        with self.assertRaises(OSError):
+            self.server.PooledHTTPServer(('127.0.0.1', self.port), self.server.DashboardHandler, workers=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""TelemetryStore round trips: records read back exactly as they were appended."""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telemetry_store  # noqa: E402
+from record_index import RecordFilter, page_records  # noqa: E402
+from telemetry_store import RECORD_FIELDS, TelemetryStore  # noqa: E402
+
+
+def record(i, **values):
+    out = dict.fromkeys(RECORD_FIELDS)
+    out.update(publish_time=f'2026-10-16 12:{i // 60:02d}:{i % 60:02d}', request_id=f'req-{i:04d}',
+               trigger='manual', version='1.2.0', duration_ms=5000 + i, user_email=f'user{i}@example.org',
+               device_make='Acer', device_type='Chromebook', device_os='ChromeOS', device_os_version='120',
+               isp_provider='COMCAST', city='Bloomington', download_speed=45, upload_speed=12.5, ping_ms=0,
+               sites_ok=3, sites_total=4)
+    out.update(values)
+    return out
+
+
+def mixed_records():
+    records = []
+    for i in range(200):
+        values = {}
+        if i % 5 == 1:
+            values.update(download_speed=45.5, upload_speed=12, ping_ms=20.25)
+        elif i % 5 == 2:
+            values.update(download_speed='Failed', ping_ms='Failed')
+        if i % 4 == 1:
+            values['duration_ms'] = str(4000 + i)
+        elif i % 4 == 2:
+            values['duration_ms'] = None
+        elif i % 4 == 3:
+            values['duration_ms'] = 4000.5 if i % 8 == 3 else 'n/a'
+        if i % 7 == 0:
+            values.update(user_email=None, city=None)
+        records.append(record(i, **values))
+    return records
+
+
+class StoreRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='store-test-')
+        self.store = TelemetryStore(self.root)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def assertSameRecords(self, got, expected):
+        key = lambda r: r['request_id']  # noqa: E731
+        self.assertEqual(json.dumps(sorted(got, key=key)), json.dumps(sorted(expected, key=key)))
+
+    def test_append_then_scan_returns_the_input(self):
+        records = mixed_records()
+        self.store.append(records)
+        self.assertSameRecords(self.store.scan(), records)
+        self.assertSameRecords(list(self.store.iter_scan()), records)
+
+    def test_types_survive_compaction_and_reopen(self):
+        records = mixed_records()
+        for start in range(0, len(records), 50):
+            self.store.append(records[start:start + 50])
+        self.store.compact('2026-10-16')
+        self.store.close()
+        self.assertSameRecords(TelemetryStore(self.root).scan(), records)
+
+    def test_append_skips_request_ids_already_held(self):
+        records = mixed_records()
+        self.assertEqual(self.store.append(records[:120]), 120)
+        self.assertEqual(self.store.append(records[100:] + records[150:160]), 80)
+        self.assertEqual(self.store.append(records[:50]), 0)
+        self.assertSameRecords(self.store.scan(), records)
+        self.assertEqual(len(list(self.store.iter_scan())), len(records))
+        self.assertEqual(self.store.count(), len(records))
+        records_page, _ = page_records(self.store, RecordFilter(), limit=1000)
+        self.assertEqual(len(records_page), len(records))
+
+    def test_segments_from_the_old_schema_still_read(self):
+        old_schema = tuple((name, 'cat' if name in ('duration_ms', 'user_email') else kind)
+                           for name, kind in telemetry_store.SCHEMA if not name.endswith('_int'))
+        with mock.patch.object(telemetry_store, 'SCHEMA', old_schema):
+            self.store.append([record(1)])
+        (row,) = self.store.scan()
+        self.assertEqual(row['duration_ms'], '5001')
+        self.assertEqual(row['user_email'], 'user1@example.org')
+        self.assertEqual(row['download_speed'], 45.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Tenant isolation: separate local files per tenant, and per-tenant /metrics and /api/cache/stats."""
+
+import http.client
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tenants import TenantConfig  # noqa: E402
+
+
+def load_server():
+    spec = importlib.util.spec_from_file_location('dashboard_server', os.path.join(ROOT, 'dashboard-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TenantConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = load_server()
+
+    def test_sqlite_tenants_get_their_own_files(self):
+        configs = [TenantConfig('district-a', backend='sqlite'), TenantConfig('district-b', backend='sqlite'),
+                   TenantConfig('district-c', backend='sqlite', sqlite_path='/data/c.db')]
+        self.server.configure_tenants(configs, 8, 0)
+        paths = [config.sqlite_path for config in configs]
+        self.assertEqual(len(set(paths)), 3)
+        self.assertTrue(paths[0].endswith('-district-a.db'), paths[0])
+        self.assertEqual(paths[2], '/data/c.db')
+
+    def test_a_lone_tenant_keeps_the_default_file(self):
+        config = TenantConfig('default', backend='sqlite')
+        self.server.configure_tenants([config], 8, 0)
+        self.assertIsNone(config.sqlite_path)
+
+    def test_shared_sqlite_files_are_rejected(self):
+        configs = [TenantConfig('district-a', backend='sqlite', sqlite_path='shared.db'),
+                   TenantConfig('district-b', backend='sqlite', sqlite_path='shared.db')]
+        with self.assertRaises(ValueError):
+            self.server.configure_tenants(configs, 8, 0)
+
+
+class TenantEndpointsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.env = {name: os.environ.get(name) for name in ('DASHBOARD_SYNTHETIC_ROWS', 'DASHBOARD_SYNTHETIC_LATENCY_MS')}
+        os.environ['DASHBOARD_SYNTHETIC_ROWS'] = '200'
+        os.environ['DASHBOARD_SYNTHETIC_LATENCY_MS'] = '0'
+        cls.scratch = tempfile.mkdtemp(prefix='dashboard-test-')
+        server = cls.server = load_server()
+        configs = [TenantConfig(name, backend='synthetic', store_dir=os.path.join(cls.scratch, name))
+                   for name in ('district-a', 'district-b')]
+        server.configure_tenants(configs, 4, 2)
+        server.prefetcher = server.PrefetchScheduler(1)
+        for name, tenant in server.tenants.items():
+            server.prefetcher.add(f'{name}/telemetry', tenant.prefetch_telemetry, 60)
+        cls.httpd = server.PooledHTTPServer(('127.0.0.1', 0), server.DashboardHandler, workers=4)
+        cls.port = cls.httpd.server_address[1]
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+        for name in server.tenants:
+            cls.get(f'/t/{name}/api/agg')  # give both tenants request metrics
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        for tenant in cls.server.tenants.values():
+            tenant.close()
+        cls.httpd.server_close()
+        shutil.rmtree(cls.scratch, ignore_errors=True)
+        for name, value in cls.env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    @classmethod
+    def get(cls, path):
+        conn = http.client.HTTPConnection('127.0.0.1', cls.port, timeout=30)
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def test_metrics_show_only_the_requested_tenant(self):
+        status, body = self.get('/t/district-b/metrics')
+        self.assertEqual(status, 200)
+        text = body.decode()
+        self.assertIn('tenant="district-b"', text)
+        self.assertNotIn('district-a', text)
+        self.assertIn('process_threads', text)
+
+    def test_cache_stats_show_only_the_requested_tenant(self):
+        status, body = self.get('/t/district-a/api/cache/stats')
+        self.assertEqual(status, 200)
+        stats = json.loads(body)
+        self.assertEqual(stats['tenant'], 'district-a')
+        self.assertEqual(list(stats['prefetch']), ['district-a/telemetry'])
+        self.assertNotIn('district-b', body.decode())
+
+
+if __name__ == '__main__':
+    unittest.main()